@@ -0,0 +1,6 @@
+import pandas as pd
+
+# copy-on-write: selections and derived frames share the buffers of their source until one of them is written,
+# so the calc steps do not need defensive copies; default from pandas 3 on
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
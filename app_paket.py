@@ -1,7 +1,24 @@
 import logging
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields, replace
+from datetime import date
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from dateutil.relativedelta import relativedelta
+
 from src.project_path import DATA_ROOT_FOLDER
-from src.run_config import run_name, reference_date
-from src.utils import dwh_tables, files, logger
+from src.run_config import log_level, preflight_mode, run_name, reference_date
+from src.utils import dwh_tables, files, logger, perf_history
+from src.utils.catalog import artifact_exists, copy_artifact
+from src.utils.month_cache import MonthCache
+from src.utils.preflight import build_queries, preflight
+from src.utils.hana_loader import load_delta
+from src.utils.profiling import profiler
+from src.utils.td_connector import telemetry
+from src.utils.utils import read_df
 
 from src.input import input_dwh, input_kpr
 from src.calculation import (
@@ -10,62 +27,149 @@ from src.calculation import (
     calc_soll_estimate_kpr,
     calc_weight_distribution,
     calc_kpr_ekp_data,
+    mapping,
 )
+from src.calculation.calc_constants import PRODUKT_ID_MAPPING
 
 
-def run():
-    product = "paket"
-    product_data = DATA_ROOT_FOLDER / f"{product}"
+def _product_data(product: str, data_root: Path = DATA_ROOT_FOLDER) -> str:
+    return f"{data_root / product}/data"
 
-    # Part 1 INPUT Data
+
+def _product_logger(product: str, part: str, data_root: Path = DATA_ROOT_FOLDER) -> logging.Logger:
+    # runs with another data root (backfill) get their own loggers
+    name = f"{product}_{part}_logger" if data_root == DATA_ROOT_FOLDER else f"{data_root.name}_{product}_{part}_logger"
+    return logger.setup_logger(name, data_root / f"{product}_{run_name}_{part}.log", level=log_level)
+
+
+def _setup_slow_query_log(name: str, data_root: Path = DATA_ROOT_FOLDER) -> None:
+    # Slow Teradata queries are logged separately, all queries end up in the per-run query table
+    telemetry.slow_logger = logger.setup_logger(
+        f"{name}_slow_query_logger", data_root / f"{name}_{run_name}_slow_queries.log", level=logging.INFO
+    )
+
+
+def _record_performance(scope: str, reference_date: date, data_root: Path = DATA_ROOT_FOLDER) -> None:
+    # stage and query measures of this process go to the performance history, regressions are logged
+    perf_logger = _product_logger(scope, "perf", data_root)
+    perf_history.record(scope, profiler.summary(), telemetry.to_frame(), perf_logger, reference_date)
+
+
+def run_preflight(
+    products: List[str], calc_tables: dwh_tables.CalculatedTables, reference_date: date, logger: logging.Logger
+):
+    """
+    EXPLAINs the Teradata queries of a run of the products and checks them against the budgets of run_config.
+    """
+    if preflight_mode == "off":
+        return None
+    queries, failed = build_queries({
+        "input_kpr": lambda: input_kpr.preflight_queries(calc_tables, reference_date, products),
+        "input_dwh": lambda: input_dwh.preflight_queries(calc_tables, reference_date),
+        "ist_abrechnungsnr": lambda: calc_abrechungsnr.preflight_queries(calc_tables, reference_date),
+    })
+    return preflight(queries, logger, failed=failed)
+
+
+def run(
+    product: str = "paket",
+    reference_date: date = reference_date,
+    data_root: Path = DATA_ROOT_FOLDER,
+    month_cache: Optional[MonthCache] = None,
+):
+    _setup_slow_query_log(product)
     calc_tables = dwh_tables.CalculatedTables(run_name=run_name)
+    run_preflight([product], calc_tables, reference_date, _product_logger(product, "preflight", data_root))
+    run_input(product, calc_tables, reference_date, data_root, month_cache)
+
+    # PART 2 Data Aggregation and Calculation
+    run_calc(product, calc_tables, reference_date, data_root, month_cache)
 
+    # Export stage timings as Chrome/Perfetto trace and JSON summary
+    profiler.export(data_root, f"{product}_{run_name}")
+    telemetry.export(data_root / f"{product}_{run_name}_queries.parquet")
+    _record_performance(product, reference_date, data_root)
+
+
+def run_input(
+    product: str,
+    calc_tables: dwh_tables.CalculatedTables,
+    reference_date: date = reference_date,
+    data_root: Path = DATA_ROOT_FOLDER,
+    month_cache: Optional[MonthCache] = None,
+):
+    # Part 1 INPUT Data
     # Logging setup for KPR
-    kpr_files = files.KprFiles(in_data_path=None, df_data_path=f"{product_data}/data")
-    kpr_logger = logger.setup_logger(
-        f"{product}_kpr_logger", DATA_ROOT_FOLDER / f"{product}_{run_name}_kpr.log", level=logging.DEBUG
-    )
+    kpr_files = files.KprFiles(in_data_path=None, df_data_path=_product_data(product, data_root))
+    kpr_logger = _product_logger(product, "kpr", data_root)
     kpr_files.log(kpr_logger)
 
     # Load input data from KPR
-    input_kpr.input_kpr(
-        logger=kpr_logger,
-        kpr_files=kpr_files,
-        calc_tables=calc_tables,
-        reference_date=reference_date,
-        product=product,
-    )
+    with profiler.stage("input_kpr"):
+        input_kpr.input_kpr(
+            logger=kpr_logger,
+            kpr_files=kpr_files,
+            calc_tables=calc_tables,
+            reference_date=reference_date,
+            product=product,
+            month_cache=month_cache,
+        )
 
     # Logging setup for DWH
-    dwh_files = files.DwhFiles(in_data_path="", df_data_path=f"{product_data}/data")
-    dwh_logger = logger.setup_logger(
-        f"{product}_dwh_logger", DATA_ROOT_FOLDER / f"{product}_{run_name}_dwh.log", level=logging.DEBUG
-    )
+    dwh_files = files.DwhFiles(in_data_path="", df_data_path=_product_data(product, data_root))
+    dwh_logger = _product_logger(product, "dwh", data_root)
     dwh_files.log(dwh_logger)
 
     # Load input data from DWH
-    input_dwh.input_dwh(dwh_logger, dwh_files, calc_tables, reference_date)
+    with profiler.stage("input_dwh"):
+        input_dwh.input_dwh(dwh_logger, dwh_files, calc_tables, reference_date, month_cache)
 
-    # PART 2 Data Aggregation and Calculation
-    calc_logger = logger.setup_logger(
-        f"{product}_calc_logger", DATA_ROOT_FOLDER / f"{product}_{run_name}_calc.log", level=logging.DEBUG
-    )
-    calc_files = files.CalculatedFiles(in_data_path="", df_data_path=f"{product_data}/data")
+
+def run_calc(
+    product: str,
+    calc_tables: dwh_tables.CalculatedTables,
+    reference_date: date = reference_date,
+    data_root: Path = DATA_ROOT_FOLDER,
+    month_cache: Optional[MonthCache] = None,
+):
+    """
+    Calculation chain of one product on the input files in its data folder.
+    """
+    calc_logger = _product_logger(product, "calc", data_root)
+    kpr_files = files.KprFiles(in_data_path=None, df_data_path=_product_data(product, data_root))
+    dwh_files = files.DwhFiles(in_data_path="", df_data_path=_product_data(product, data_root))
+    calc_files = files.CalculatedFiles(in_data_path="", df_data_path=_product_data(product, data_root))
+    kpr_files.files_exist(calc_logger)
+    dwh_files.files_exist(calc_logger)
 
     # Perform calculations specific to KPR and DWH
-    calc_abrechungsnr.ist_abrechnungsnr(
-        logger=calc_logger, calc_files=calc_files, calc_tables=calc_tables, reference_date=reference_date
-    )
+    with profiler.stage("ist_abrechnungsnr"):
+        calc_abrechungsnr.ist_abrechnungsnr(
+            logger=calc_logger,
+            calc_files=calc_files,
+            calc_tables=calc_tables,
+            reference_date=reference_date,
+            month_cache=month_cache,
+        )
 
-    calc_ist_kpr.calc_ist_kpr(kpr_files=kpr_files, calc_files=calc_files, logger=calc_logger, level=["ekpnr", "kalknr"])
+    with profiler.stage("calc_ist_kpr"):
+        calc_ist_kpr.calc_ist_kpr(
+            kpr_files=kpr_files, calc_files=calc_files, logger=calc_logger, level=["ekpnr", "kalknr"]
+        )
 
-    calc_soll_estimate_kpr.calc_soll_estimate_kpr_ekp(
-        kpr_files=kpr_files, calc_files=calc_files, logger=calc_logger, product=product
-    )
+    with profiler.stage("calc_soll_estimate_kpr"):
+        calc_soll_estimate_kpr.calc_soll_estimate_kpr_ekp(
+            kpr_files=kpr_files, calc_files=calc_files, logger=calc_logger, product=product
+        )
 
-    calc_weight_distribution.calc_weight_distribution(logger=calc_logger, dwh_files=dwh_files, calc_files=calc_files)
+    with profiler.stage("calc_weight_distribution"):
+        df_gewicht2verteilung = calc_weight_distribution.calc_weight_distribution(
+            logger=calc_logger, dwh_files=dwh_files, calc_files=calc_files
+        )
+        calc_weight_distribution.insert_weight_distribution_into_hana(calc_logger, df_gewicht2verteilung, product)
 
-    calc_kpr_ekp_data.calc_kpr_ekp_data(kpr_files=kpr_files, calc_files=calc_files)
+    with profiler.stage("calc_kpr_ekp_data"):
+        calc_kpr_ekp_data.calc_kpr_ekp_data(kpr_files=kpr_files, calc_files=calc_files)
 
     # PART 3 Insert into HANA Cloud (if applicable)
     # Here you can add the insert operation into HANA cloud with the aggregated data
@@ -73,3 +177,276 @@ def run():
     # insert_into_prima_price_delta(data)
 
     # Additional result handling can be added as needed
+
+
+def _reset_measurements() -> None:
+    # forked workers inherit the records of the parent, reused workers those of their earlier tasks
+    profiler.reset()
+    telemetry.reset()
+
+
+def _run_calc_process(product: str, calc_tables: dwh_tables.CalculatedTables):
+    # runs in a worker process, which exports its own stage timings
+    _reset_measurements()
+    # the chains of the products run at the same time, each builds its own scratch tables
+    run_calc(product, replace(calc_tables, chain=product))
+    profiler.export(DATA_ROOT_FOLDER, f"{product}_{run_name}_calc")
+    # a series per kind of run, the calc chain of a multi-product run differs from that of run()
+    _record_performance(f"{product}_multi_calc", reference_date)
+
+
+def run_multi_product(products: List[str] = list(PRODUKT_ID_MAPPING)):
+    """
+    Runs several products with a shared extraction: the KPR views are scanned once for all products and the
+    DWH input, which does not depend on the product, is loaded once. The calc chains run in parallel processes.
+    """
+    name = "_".join(products)
+    _setup_slow_query_log(name)
+    calc_tables = dwh_tables.CalculatedTables(run_name=run_name)
+    run_preflight(products, calc_tables, reference_date, _product_logger(name, "preflight"))
+
+    kpr_files = {product: files.KprFiles(in_data_path=None, df_data_path=_product_data(product)) for product in products}
+    kpr_logger = _product_logger(name, "kpr")
+    for product_files in kpr_files.values():
+        product_files.log(kpr_logger)
+
+    with profiler.stage("input_kpr"):
+        input_kpr.input_kpr_multi_product(
+            logger=kpr_logger, kpr_files=kpr_files, calc_tables=calc_tables, reference_date=reference_date
+        )
+
+    dwh_files = {product: files.DwhFiles(in_data_path="", df_data_path=_product_data(product)) for product in products}
+    dwh_logger = _product_logger(name, "dwh")
+    with profiler.stage("input_dwh"):
+        input_dwh.input_dwh(dwh_logger, dwh_files[products[0]], calc_tables, reference_date)
+        for product in products[1:]:
+            for entry in fields(files.DwhFiles):
+                if entry.name.startswith("df_"):
+                    copy_artifact(getattr(dwh_files[products[0]], entry.name), getattr(dwh_files[product], entry.name))
+
+    with profiler.stage("calc"):
+        with ProcessPoolExecutor(max_workers=len(products)) as pool:
+            list(pool.map(_run_calc_process, products, [calc_tables] * len(products)))
+
+    profiler.export(DATA_ROOT_FOLDER, f"{name}_{run_name}")
+    telemetry.export(DATA_ROOT_FOLDER / f"{name}_{run_name}_queries.parquet")
+    _record_performance(name, reference_date)
+
+
+def _backfill_root(reference_date: date) -> Path:
+    return DATA_ROOT_FOLDER / "backfill" / reference_date.strftime("%Y%m")
+
+
+def _run_calc_date(product: str, calc_tables: dwh_tables.CalculatedTables, reference_date: date, cache_root: Path):
+    # runs in a worker process, all months are already in the cache
+    _reset_measurements()
+    data_root = _backfill_root(reference_date)
+    run_calc(product, calc_tables, reference_date, data_root, MonthCache(cache_root))
+    profiler.export(data_root, f"{product}_{run_name}")
+    # the dates of a backfill run in parallel, each date is compared with its own earlier backfills
+    _record_performance(f"{product}_backfill_calc_{reference_date:%Y%m}", reference_date, data_root)
+
+
+def run_backfill(first_date: date, last_date: date, product: str = "paket", max_workers: Optional[int] = None):
+    """
+    Runs all reference dates (month starts) from first_date to last_date, results go to backfill/<yyyymm>.
+    The monthly source extracts are cached per month and shared between the dates, so each month is fetched once.
+    The extraction runs date by date, the calc chains of all dates run in parallel processes afterwards.
+    """
+    dates = []
+    month = first_date.replace(day=1)
+    while month <= last_date:
+        dates.append(month)
+        month += relativedelta(months=1)
+
+    _setup_slow_query_log(f"{product}_backfill")
+    calc_tables = dwh_tables.CalculatedTables(run_name=run_name)
+    cache_root = DATA_ROOT_FOLDER / "backfill" / "months"
+    month_cache = MonthCache(cache_root, logger=_product_logger(product, "backfill"))
+
+    for backfill_date in dates:
+        run_preflight([product], calc_tables, backfill_date, month_cache.logger)
+
+    for backfill_date in dates:
+        data_root = _backfill_root(backfill_date)
+        Path(_product_data(product, data_root)).mkdir(parents=True, exist_ok=True)
+        with profiler.stage(f"input_{backfill_date:%Y%m}"):
+            run_input(product, calc_tables, backfill_date, data_root, month_cache)
+            calc_abrechungsnr.abrnr_base_data(month_cache.logger, calc_tables, backfill_date, month_cache)
+
+    with profiler.stage("calc"):
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            n_dates = len(dates)
+            list(pool.map(_run_calc_date, [product] * n_dates, [calc_tables] * n_dates, dates, [cache_root] * n_dates))
+
+    profiler.export(DATA_ROOT_FOLDER, f"{product}_{run_name}_backfill")
+    telemetry.export(DATA_ROOT_FOLDER / f"{product}_{run_name}_backfill_queries.parquet")
+    _record_performance(f"{product}_backfill", last_date)
+
+
+@dataclass
+class StageContext:
+    """
+    Files, tables and logger a single stage runs with. Artifact paths can be overridden per stage run.
+    """
+
+    product: str
+    reference_date: date
+    data_root: Path
+    calc_tables: dwh_tables.CalculatedTables
+    kpr: files.KprFiles
+    dwh: files.DwhFiles
+    calc: files.CalculatedFiles
+    sap: files.SapFiles
+    logger: Optional[logging.Logger] = None
+
+    def artifact(self, ref: str) -> str:
+        container, name = ref.split(".")
+        return getattr(getattr(self, container), name)
+
+    def set_artifact(self, ref: str, path: str) -> None:
+        container, name = ref.split(".")
+        if not hasattr(getattr(self, container), name):
+            raise KeyError(f"unknown artifact {ref}")
+        setattr(getattr(self, container), name, path)
+
+
+@dataclass
+class Stage:
+    func: Callable[[StageContext], None]
+    part: str
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+
+
+def _hana_load(artifact: str, table: str, key_cols: List[str], by_product: bool = False) -> Callable:
+    def load(ctx: StageContext):
+        partition = {"produkt": ctx.product.lower()} if by_product else None
+        load_delta(ctx.logger, read_df(ctx.artifact(artifact)), table, key_cols=key_cols, partition=partition)
+
+    return load
+
+
+# Stages in the order of run(), each reads and writes only the listed artifacts (and the DWH tables), only the
+# hana_* stages write to HANA
+STAGES: Dict[str, Stage] = {
+    "preflight": Stage(
+        lambda ctx: run_preflight([ctx.product], ctx.calc_tables, ctx.reference_date, ctx.logger), "preflight"
+    ),
+    "kpr_rv_ekpnr_mapping": Stage(
+        lambda ctx: input_kpr.kpr_rv_ekpnr_mapping(ctx.kpr, ctx.reference_date),
+        "kpr",
+        outputs=["kpr.df_mapping_rv_abrnr"],
+    ),
+    "kpr_kosten": Stage(
+        lambda ctx: input_kpr.kpr_kosten(ctx.logger, ctx.kpr, ctx.calc_tables, ctx.reference_date, ctx.product),
+        "kpr",
+        outputs=["kpr.df_kpr_costs_report15"],
+    ),
+    "kpr_kosten_merge": Stage(
+        lambda ctx: input_kpr.kpr_kosten_merge(ctx.logger, ctx.kpr, ctx.product),
+        "kpr",
+        inputs=["kpr.df_kpr_costs_report15"],
+        outputs=["kpr.df_kpr_kosten"],
+    ),
+    "kpr_treiber": Stage(
+        lambda ctx: input_kpr.kpr_treiber(ctx.logger, ctx.kpr, ctx.calc_tables, ctx.product, ctx.reference_date),
+        "kpr",
+        outputs=["kpr.df_kpr_treiber"],
+    ),
+    "kpr_zustellung": Stage(
+        lambda ctx: input_kpr.kpr_zustellung(ctx.logger, ctx.kpr, ctx.calc_tables, ctx.product, ctx.reference_date),
+        "kpr",
+        outputs=["kpr.df_kpr_zustellung"],
+    ),
+    "dwh_kundenkonzern_vertragspartner": Stage(
+        lambda ctx: input_dwh.data_input_kundenkonzern_vertragspartner(ctx.logger, ctx.calc_tables), "dwh"
+    ),
+    "dwh_paket_gewicht": Stage(
+        lambda ctx: input_dwh.dwh_paket_gewicht(ctx.logger, ctx.dwh, ctx.reference_date),
+        "dwh",
+        outputs=["dwh.df_prod_gewicht"],
+    ),
+    "hana_prod_gewicht": Stage(
+        _hana_load("dwh.df_prod_gewicht", "DWH_HANA_TABLE", ["ekpnr"]), "hana", inputs=["dwh.df_prod_gewicht"]
+    ),
+    "ist_abrechnungsnr": Stage(
+        lambda ctx: calc_abrechungsnr.ist_abrechnungsnr(ctx.logger, ctx.calc, ctx.calc_tables, ctx.reference_date),
+        "calc",
+        outputs=["calc.df_sh2pr_12M_abrnr"],
+    ),
+    "abr_kalknr_mapping": Stage(
+        lambda ctx: mapping.prepare_abr_kalknr_mapping(ctx.calc, ctx.sap),
+        "calc",
+        inputs=["sap.df_kontrakt"],
+        outputs=["calc.df_mapping"],
+    ),
+    "calc_weight_distribution": Stage(
+        lambda ctx: calc_weight_distribution.calc_weight_distribution(ctx.logger, ctx.dwh, ctx.calc),
+        "calc",
+        inputs=["dwh.df_prod_gewicht", "calc.df_mapping"],
+        outputs=["calc.df_prod_gewicht_prepared", "calc.df_gewicht2verteilung"],
+    ),
+    "hana_gewicht2verteilung": Stage(
+        _hana_load("calc.df_gewicht2verteilung", "SHIPTOPROFILE_KONTRAKT_SERV", ["gewicht_avg_est"], by_product=True),
+        "hana",
+        inputs=["calc.df_gewicht2verteilung"],
+    ),
+    "hana_kpr_kosten": Stage(
+        _hana_load("kpr.df_kpr_costs_report15", "KPR_HANA_TABLE", ["abrnr", "prozessebene_id"], by_product=True),
+        "hana",
+        inputs=["kpr.df_kpr_costs_report15"],
+    ),
+}
+
+
+def run_stage(
+    stage_name: str,
+    product: str = "paket",
+    reference_date: date = reference_date,
+    data_root: Path = DATA_ROOT_FOLDER,
+    artifacts: Optional[Dict[str, str]] = None,
+):
+    """
+    Runs one stage on its own, e.g. as a separate container. artifacts overrides input and output paths by
+    reference, e.g. {"dwh.df_prod_gewicht": "/mnt/shared/df_prod_gewicht.parquet"}.
+    """
+    stage = STAGES[stage_name]
+    data_folder = _product_data(product, data_root)
+    Path(data_folder).mkdir(parents=True, exist_ok=True)
+    ctx = StageContext(
+        product=product,
+        reference_date=reference_date,
+        data_root=data_root,
+        calc_tables=dwh_tables.CalculatedTables(run_name=run_name),
+        kpr=files.KprFiles(in_data_path=None, df_data_path=data_folder),
+        dwh=files.DwhFiles(in_data_path="", df_data_path=data_folder),
+        calc=files.CalculatedFiles(in_data_path="", df_data_path=data_folder),
+        sap=files.SapFiles(in_data_path="", df_data_path=data_folder),
+        logger=_product_logger(product, stage.part, data_root),
+    )
+    for ref, path in (artifacts or {}).items():
+        ctx.set_artifact(ref, path)
+
+    missing = [ref for ref in stage.inputs if not artifact_exists(ctx.artifact(ref))]
+    if missing:
+        raise FileNotFoundError(f"stage {stage_name} is missing input artifacts {[ctx.artifact(m) for m in missing]}")
+
+    _setup_slow_query_log(f"{product}_{stage_name}", data_root)
+    ctx.logger.info(f"stage {stage_name}: inputs {[ctx.artifact(ref) for ref in stage.inputs]}")
+    with profiler.stage(stage_name):
+        stage.func(ctx)
+    ctx.logger.info(f"stage {stage_name}: outputs {[ctx.artifact(ref) for ref in stage.outputs]}")
+
+    profiler.export(data_root, f"{product}_{run_name}_{stage_name}")
+    telemetry.export(data_root / f"{product}_{run_name}_{stage_name}_queries.parquet")
+    _record_performance(f"{product}_{stage_name}", reference_date, data_root)
+
+
+def run_chain(stage_args: List[str], stages: List[str] = list(STAGES)):
+    """
+    Runs stages one after another as subprocesses of the stage CLI, like separate containers would run them.
+    stage_args are the command line options passed to every stage.
+    """
+    for stage_name in stages:
+        subprocess.run([sys.executable, "-m", "src.main_stage", stage_name, *stage_args], check=True)
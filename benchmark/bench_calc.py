@@ -0,0 +1,106 @@
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from src.benchmark.synthetic_data import SyntheticData
+from src.calculation import calc_abrechungsnr, calc_fibu_presliste, calc_weight_distribution, mapping, rahmenvertrag
+from src.utils import logger as logger_utils
+from src.utils.exclusion import AbrnrExclusion
+from src.utils.files import CalculatedFiles, DwhFiles, KprFiles, SapFiles
+from src.utils.profiling import Profiler
+from src.utils.utils import read_df
+
+DEFAULT_SCALES = (1, 10, 100)
+STAGES = ["generate", "mapping", "calc_abrechungsnr", "calc_weight_distribution", "calc_fibu_preisliste", "rahmenvertrag"]
+
+
+def run_stages(scale: float, data_dir: Path, logger: logging.Logger, repeat: int = 1) -> pd.DataFrame:
+    """
+    Generates synthetic data for one scale factor and times every calc stage on it.
+    """
+    profiler = Profiler()
+    synthetic = SyntheticData(scale=scale)
+    kpr_files = KprFiles(in_data_path=None, df_data_path=str(data_dir))
+    dwh_files = DwhFiles(in_data_path="", df_data_path=str(data_dir))
+    calc_files = CalculatedFiles(in_data_path="", df_data_path=str(data_dir))
+    sap_files = SapFiles(in_data_path="", df_data_path=str(data_dir / "sap"))
+    with profiler.stage("generate"):
+        base_data_path = synthetic.write(kpr_files, dwh_files, calc_files, sap_files)
+
+    df_base = read_df(base_data_path)
+    df_fibu = read_df(sap_files.df_fibu_excl_a)
+    df_kontrakt = read_df(sap_files.df_kontrakt)
+    df_kpr_kosten = read_df(kpr_files.df_kpr_kosten)
+    kleinpaket = AbrnrExclusion.from_frame(read_df(sap_files.df_kt_abr_kleinpaket))
+
+    for _ in range(repeat):
+        with profiler.stage("mapping", rows_in=len(df_kontrakt)):
+            mapping.prepare_abr_kalknr_mapping(calc_files, sap_files)
+        df_mapping = read_df(calc_files.df_mapping)
+
+        with profiler.stage("calc_abrechungsnr", rows_in=len(df_base)):
+            calc_abrechungsnr.calc_ist_abrechnungsnr(logger, calc_files, df_base, synthetic.reference_date)
+
+        with profiler.stage("calc_weight_distribution"):
+            calc_weight_distribution.prod_gewicht_preparation(logger, dwh_files, calc_files)
+            calc_weight_distribution.prod_gewicht2verteilung(logger, calc_files)
+
+        with profiler.stage("calc_fibu_preisliste", rows_in=len(df_fibu)) as record:
+            record.set_output(
+                calc_fibu_presliste.fibu_preisliste_unique(df_fibu, df_mapping, kleinpaket, "paket", logger)
+            )
+
+        with profiler.stage("rahmenvertrag", rows_in=len(df_kpr_kosten)) as record:
+            record.set_output(rahmenvertrag.map_rahmenvertag_ekp(df_kpr_kosten, df_kontrakt))
+
+    df = profiler.summary()
+    df = df[df["name"].isin(STAGES)].copy()
+    df[["wall_s", "cpu_s"]] = df[["wall_s", "cpu_s"]].div(df["calls"], axis=0)
+    df.insert(0, "scale", scale)
+    df.insert(1, "n_abrnr", len(synthetic.abr))
+    return df
+
+
+def scaling_exponents(df_results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fits wall_s ~ n_abrnr^k per stage, k close to 1 means linear scaling.
+    """
+    rows = []
+    for name, df in df_results.groupby("name"):
+        if len(df) > 1:
+            k = np.polyfit(np.log(df["n_abrnr"]), np.log(df["wall_s"].clip(lower=1e-6)), 1)[0]
+            rows.append({"name": name, "scaling_exponent": round(k, 2)})
+    return pd.DataFrame(rows)
+
+
+def run_benchmark(scales: Iterable[float] = DEFAULT_SCALES, out_dir: Path = None, repeat: int = 1) -> pd.DataFrame:
+    out_dir = Path(out_dir or tempfile.mkdtemp(prefix="bench_calc_"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    logger = logger_utils.setup_logger("bench_calc_logger", out_dir / "bench_calc.log", level=logging.INFO)
+
+    results = []
+    for scale in scales:
+        logger.info(f"running calc benchmark with scale {scale}")
+        results.append(run_stages(scale, out_dir / f"scale_{scale}", logger, repeat=repeat))
+    df_results = pd.concat(results, ignore_index=True)
+
+    df_results.to_csv(out_dir / "bench_calc.csv", index=False)
+    scaling_exponents(df_results).to_csv(out_dir / "bench_calc_scaling.csv", index=False)
+    return df_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the calc stages on synthetic data")
+    parser.add_argument("--scales", type=float, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    df = run_benchmark(args.scales, args.out, args.repeat)
+    print(df.to_string(index=False))
+    print(scaling_exponents(df).to_string(index=False))
@@ -0,0 +1,161 @@
+import argparse
+import datetime
+import logging
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, Iterable
+
+import pandas as pd
+import pyarrow as pa
+from dateutil.relativedelta import relativedelta
+
+from src.benchmark.synthetic_data import SyntheticData
+from src.utils import logger as logger_utils
+from src.utils.arrow_fetch import ARROW_BATCH_SIZE, decimals_to_float
+from src.utils.profiling import Profiler
+
+DEFAULT_SCALES = (1, 10)
+
+
+class _RowCursor:
+    """
+    DB-API cursor handing out the rows of a frame as tuples, like pyodbc does for a result set.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.description = [(col, None, None, None, None, None, None) for col in df.columns]
+        self._columns = [df[col].tolist() for col in df.columns]
+        self._pos = 0
+
+    def execute(self, sql, params=None):
+        self._pos = 0
+
+    def fetchmany(self, size):
+        # the driver builds one tuple and one Python object per cell
+        rows = list(zip(*(column[self._pos : self._pos + size] for column in self._columns)))
+        self._pos += len(rows)
+        return rows
+
+    def close(self):
+        pass
+
+
+def fetch_rows(df: pd.DataFrame, batch_size: int = ARROW_BATCH_SIZE) -> pd.DataFrame:
+    """
+    Client side of the row path (QueryTelemetry.read_sql) from the result: the tuples and Python objects per cell
+    the driver builds, fetched in batches, then DataFrame.from_records.
+    """
+    cursor = _RowCursor(df)
+    cursor.execute("")
+    columns = [column[0] for column in cursor.description]
+    data = []
+    rows = cursor.fetchmany(batch_size)
+    while rows:
+        data.extend(rows)
+        rows = cursor.fetchmany(batch_size)
+    return pd.DataFrame.from_records(data, columns=columns, coerce_float=True)
+
+
+def fetch_arrow(df: pd.DataFrame, batch_size: int = ARROW_BATCH_SIZE) -> pd.DataFrame:
+    """
+    Client side of the Arrow path (arrow_fetch.read_arrow) from the result: the column buffers of the batches
+    arrow-odbc fills in native code, then the conversion to pandas.
+    """
+    batches = pa.Table.from_pandas(df, preserve_index=False).to_batches(max_chunksize=batch_size)
+    return decimals_to_float(pa.Table.from_batches(batches)).to_pandas()
+
+
+def run_synthetic(scale: float, profiler: Profiler, logger: logging.Logger) -> None:
+    """
+    Times both paths end to end from the same result, shaped like the weight and KPR cost queries, to the
+    DataFrame: the buffers the driver fills (Python rows or Arrow batches) are built inside the timed stage.
+    """
+    synthetic = SyntheticData(scale=scale)
+    results = {"weight_query": synthetic.prod_gewicht(), "kpr_costs_report15": synthetic.kpr_costs()}
+    for name, df in results.items():
+        with profiler.stage(f"{name}_rows", rows_in=len(df)) as record:
+            record.set_output(fetch_rows(df))
+        with profiler.stage(f"{name}_arrow", rows_in=len(df)) as record:
+            record.set_output(fetch_arrow(df))
+        logger.info(f"scale {scale} {name}: {df.shape}")
+
+
+def run_live(reference_date: datetime.date, profiler: Profiler, logger: logging.Logger) -> None:
+    """
+    Runs one month of the weight query and the KPR cost query over pyodbc and over arrow-odbc.
+    """
+    from src.input.input_dwh import paket_gewicht_query
+    from src.input.input_kpr import get_query_costs_report15, product_ids
+    from src.utils.arrow_fetch import read_arrow
+    from src.utils.dwh_tables import STATIC_TABLES, CalculatedTables
+    from src.run_config import run_name
+    from src.utils.td_connector import dwh_connection_string, open_dwh_session, telemetry
+    from src.utils.utils import monthdelta
+
+    month_start = reference_date + relativedelta(months=-1)
+    queries = {
+        "weight_query": paket_gewicht_query(STATIC_TABLES["pze_table"], STATIC_TABLES["pan_table"]).bind(
+            start_date=month_start, end_date=month_start + relativedelta(day=31)
+        ),
+        "kpr_costs_report15": get_query_costs_report15(
+            monthdelta(-12, reference_date),
+            monthdelta(-1, reference_date),
+            product_ids("paket"),
+            CalculatedTables(run_name=run_name),
+        ),
+    }
+    session = open_dwh_session()
+    for name, query in queries.items():
+        with profiler.stage(f"{name}_rows") as record:
+            df_rows = telemetry.read_sql(session, query.sql, params=query.params)
+            record.set_output(df_rows)
+        with profiler.stage(f"{name}_arrow") as record:
+            df_arrow = read_arrow(dwh_connection_string(), query.sql, query.params)
+            record.set_output(df_arrow)
+        logger.info(f"{name}: rows path {df_rows.shape}, arrow path {df_arrow.shape}")
+
+
+def summarize(profiler: Profiler) -> pd.DataFrame:
+    df = profiler.summary()
+    df["query"] = df["name"].str.rsplit("_", n=1).str[0]
+    df["path"] = df["name"].str.rsplit("_", n=1).str[1]
+    df = df.pivot_table(["wall_s", "cpu_s"], "query", "path", aggfunc="sum")
+    df.columns = [f"{metric}_{path}" for metric, path in df.columns]
+    df["speedup_cpu"] = (df["cpu_s_rows"] / df["cpu_s_arrow"].clip(lower=1e-6)).round(2)
+    return df.reset_index()
+
+
+def run_benchmark(
+    scales: Iterable[float] = DEFAULT_SCALES, out_dir: Path = None, live: bool = False
+) -> Dict[str, pd.DataFrame]:
+    out_dir = Path(out_dir or tempfile.mkdtemp(prefix="bench_fetch_"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    logger = logger_utils.setup_logger("bench_fetch_logger", out_dir / "bench_fetch.log", level=logging.INFO)
+
+    runs: Dict[str, Callable[[Profiler], None]] = {
+        f"scale_{scale}": (lambda profiler, scale=scale: run_synthetic(scale, profiler, logger)) for scale in scales
+    }
+    if live:
+        from src.run_config import reference_date
+
+        runs["live"] = lambda profiler: run_live(reference_date, profiler, logger)
+
+    results = {}
+    for run, func in runs.items():
+        profiler = Profiler()
+        func(profiler)
+        results[run] = summarize(profiler)
+        results[run].insert(0, "run", run)
+    pd.concat(results.values(), ignore_index=True).to_csv(out_dir / "bench_fetch.csv", index=False)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the row and the Arrow fetch path")
+    parser.add_argument("--scales", type=float, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--live", action="store_true", help="also run the weight and KPR cost queries on Teradata")
+    args = parser.parse_args()
+
+    for df in run_benchmark(args.scales, args.out, args.live).values():
+        print(df.to_string(index=False))
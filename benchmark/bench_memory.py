@@ -0,0 +1,69 @@
+import argparse
+import logging
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+
+from src.benchmark.bench_calc import run_stages
+from src.utils import logger as logger_utils
+
+DEFAULT_SCALES = (1, 10)
+COLUMNS = ["scale", "n_abrnr", "name", "peak_traced_mb", "peak_rss_mb", "wall_s"]
+# measures compared with the baseline run, peak_rss_mb only grows over the run and is not compared per stage
+COMPARED = ["peak_traced_mb", "wall_s"]
+
+
+def run_benchmark(scales: Iterable[float] = DEFAULT_SCALES, out_dir: Path = None) -> pd.DataFrame:
+    """
+    Peak memory allocated by every calc stage on synthetic data, traced with tracemalloc (numpy and pandas
+    buffers included, Arrow buffers not). The RSS peak of the process only grows, so it cannot be split by stage.
+    """
+    out_dir = Path(out_dir or tempfile.mkdtemp(prefix="bench_memory_"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    logger = logger_utils.setup_logger("bench_memory_logger", out_dir / "bench_memory.log", level=logging.INFO)
+
+    results = []
+    tracemalloc.start()
+    try:
+        for scale in scales:
+            logger.info(f"running memory benchmark with scale {scale}")
+            results.append(run_stages(scale, out_dir / f"scale_{scale}", logger)[COLUMNS])
+    finally:
+        tracemalloc.stop()
+    df_results = pd.concat(results, ignore_index=True)
+    df_results.to_csv(out_dir / "bench_memory.csv", index=False)
+    return df_results
+
+
+def compare(df_after: pd.DataFrame, df_baseline: pd.DataFrame) -> pd.DataFrame:
+    """
+    Measures of a run next to those of a baseline run (e.g. bench_memory.csv of the tree before a change) per
+    scale and stage, with the ratio after / baseline.
+    """
+    df = df_baseline[["scale", "name"] + COMPARED].merge(
+        df_after[["scale", "name"] + COMPARED], on=["scale", "name"], how="outer", suffixes=("_baseline", "_after")
+    )
+    for measure in COMPARED:
+        df[f"{measure}_ratio"] = (df[f"{measure}_after"] / df[f"{measure}_baseline"]).round(3)
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the peak memory of the calc stages on synthetic data")
+    parser.add_argument("--scales", type=float, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument(
+        "--baseline", type=Path, default=None, help="bench_memory.csv of an earlier run to compare the stages with"
+    )
+    args = parser.parse_args()
+
+    df_after = run_benchmark(args.scales, args.out)
+    print(df_after.to_string(index=False))
+    if args.baseline is not None:
+        df_compare = compare(df_after, pd.read_csv(args.baseline))
+        if args.out is not None:
+            df_compare.to_csv(args.out / "bench_memory_compare.csv", index=False)
+        print(df_compare.to_string(index=False))
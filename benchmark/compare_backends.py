@@ -0,0 +1,95 @@
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from src.benchmark.synthetic_data import SyntheticData
+from src.calculation import calc_abrechungsnr, calc_duckdb, calc_fibu_presliste, calc_weight_distribution
+from src.utils import logger as logger_utils
+from src.utils.exclusion import AbrnrExclusion
+from src.utils.files import CalculatedFiles, DwhFiles, KprFiles, SapFiles
+from src.utils.profiling import Profiler
+from src.utils.utils import read_df
+
+
+def _compare(name: str, df_pandas: pd.DataFrame, df_duckdb: pd.DataFrame, logger: logging.Logger) -> bool:
+    try:
+        pd.testing.assert_frame_equal(
+            df_pandas.reset_index(drop=True),
+            df_duckdb.reset_index(drop=True),
+            check_dtype=False,
+            check_exact=False,
+            rtol=1e-6,
+        )
+        logger.info(f"{name}: pandas and duckdb results are equal, shape {df_pandas.shape}")
+        return True
+    except AssertionError as e:
+        logger.error(f"{name}: pandas and duckdb results differ\n{e}")
+        return False
+
+
+def compare_backends(scale: float, out_dir: Path) -> pd.DataFrame:
+    """
+    Runs the pandas and duckdb implementations of every calc step on the same synthetic data and compares
+    their results and timings.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    logger = logger_utils.setup_logger("compare_backends_logger", out_dir / "compare_backends.log", level=logging.INFO)
+    profiler = Profiler()
+
+    synthetic = SyntheticData(scale=scale)
+    kpr_files = KprFiles(in_data_path=None, df_data_path=str(out_dir))
+    dwh_files = DwhFiles(in_data_path="", df_data_path=str(out_dir))
+    calc_files = CalculatedFiles(in_data_path="", df_data_path=str(out_dir))
+    sap_files = SapFiles(in_data_path="", df_data_path=str(out_dir / "sap"))
+    df_base = read_df(synthetic.write(kpr_files, dwh_files, calc_files, sap_files))
+    df_fibu = read_df(sap_files.df_fibu_excl_a)
+    df_mapping = read_df(calc_files.df_mapping)
+    kleinpaket = AbrnrExclusion.from_frame(read_df(sap_files.df_kt_abr_kleinpaket))
+
+    results = []
+    with profiler.stage("pivot_months_to_cols pandas"):
+        df_pandas = calc_abrechungsnr.pivot_months_to_cols(df_base)
+    with profiler.stage("pivot_months_to_cols duckdb"):
+        df_duckdb = calc_duckdb.pivot_months_to_cols(df_base)
+    results.append(("pivot_months_to_cols", _compare("pivot_months_to_cols", df_pandas, df_duckdb, logger)))
+
+    duckdb_output = str(out_dir / "df_prod_gewicht_prepared_duckdb.parquet")
+    with profiler.stage("prod_gewicht_preparation pandas"):
+        calc_weight_distribution.prod_gewicht_preparation(logger, dwh_files, calc_files)
+    with profiler.stage("prod_gewicht_preparation duckdb"):
+        calc_duckdb.prod_gewicht_preparation(logger, dwh_files, calc_files, output_path=duckdb_output)
+    df_pandas = read_df(calc_files.df_prod_gewicht_prepared)
+    df_duckdb = read_df(duckdb_output)
+    results.append(("prod_gewicht_preparation", _compare("prod_gewicht_preparation", df_pandas, df_duckdb, logger)))
+
+    with profiler.stage("fibu_preisliste_unique pandas"):
+        df_pandas = calc_fibu_presliste.fibu_preisliste_unique(
+            df_fibu, df_mapping, kleinpaket, "paket", logger, backend="pandas"
+        )
+    with profiler.stage("fibu_preisliste_unique duckdb"):
+        df_duckdb = calc_fibu_presliste.fibu_preisliste_unique(
+            df_fibu, df_mapping, kleinpaket, "paket", logger, backend="duckdb"
+        )
+    results.append(("fibu_preisliste_unique", _compare("fibu_preisliste_unique", df_pandas, df_duckdb, logger)))
+
+    df_timing = profiler.summary()
+    df_timing = df_timing[df_timing["name"].str.endswith((" pandas", " duckdb"))]
+    df_timing[["step", "backend"]] = df_timing["name"].str.rsplit(" ", n=1, expand=True)
+    df_results = df_timing.pivot_table("wall_s", "step", "backend").reset_index()
+    df_results["equal"] = df_results["step"].map(dict(results))
+    return df_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare pandas and duckdb calc backends on synthetic data")
+    parser.add_argument("--scale", type=float, default=10)
+    parser.add_argument("--out", type=Path, default=None)
+    args = parser.parse_args()
+
+    df = compare_backends(args.scale, args.out or Path(tempfile.mkdtemp(prefix="compare_backends_")))
+    print(df.to_string(index=False))
+    if not df["equal"].all():
+        raise SystemExit(1)
@@ -0,0 +1,169 @@
+import datetime
+from dataclasses import fields
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from src.calculation.calc_constants import MATERIAL_LIST, PL_ENTRIES_PAKET, PL_ENTRIES_WAPO, PRODUKT_VERFAHREN_MAPPING
+from src.utils.files import CalculatedFiles, DwhFiles, KprFiles, SapFiles
+from src.utils.utils import monthdelta, save_df
+
+# number of ekpnr at scale factor 1
+BASE_CUSTOMERS = 1_000
+
+GEWICHT_STAFFELN = [
+    "gewicht_bis01kg",
+    "gewicht_bis02kg",
+    "gewicht_bis05kg",
+    "gewicht_bis10kg",
+    "gewicht_bis20kg",
+    "gewicht_bis31kg",
+    "gewicht_ue31kg",
+]
+PROZESSEBENEN = range(1, 9)
+
+
+class SyntheticData:
+    """
+    Generates synthetic KPR/DWH/SAP artifacts with the key formats of production data.
+    Every customer (ekpnr in 5000000000-7000000000) has one to three abrnr = ekpnr + verfa + teiln.
+    """
+
+    def __init__(self, scale: float = 1, reference_date: datetime.date = None, seed: int = 42):
+        self.scale = scale
+        self.reference_date = reference_date or datetime.date(2024, 5, 1)
+        self.rng = np.random.default_rng(seed)
+        self.months = [monthdelta(-delta, self.reference_date) for delta in range(12, 0, -1)]
+        self.abr = self._abrnr()
+        self._kontrakt = None
+
+    def _abrnr(self) -> pd.DataFrame:
+        n_customers = max(int(BASE_CUSTOMERS * self.scale), 1)
+        ekpnr = self.rng.choice(2_000_000_000, size=n_customers, replace=False) + 5_000_000_000
+        n_abr = self.rng.choice([1, 2, 3], size=n_customers, p=[0.6, 0.3, 0.1])
+        df = pd.DataFrame({"ekpnr": np.repeat(ekpnr, n_abr).astype(str)})
+        df["verfa"] = self.rng.choice(list(PRODUKT_VERFAHREN_MAPPING.values()), size=len(df), p=[0.8, 0.2])
+        df["teiln"] = (df.groupby(["ekpnr", "verfa"]).cumcount() + 1).astype(str).str.zfill(2)
+        df["abrnr"] = df["ekpnr"] + df["verfa"] + df["teiln"]
+        df["kunden_seit"] = self.rng.choice(self.months[:1] * 8 + self.months, size=len(df))
+        return df[["abrnr", "ekpnr", "verfa", "teiln", "kunden_seit"]]
+
+    def _per_month(self, active_share: float = 0.8) -> pd.DataFrame:
+        df = self.abr.merge(pd.DataFrame({"jahr_monat": self.months}), how="cross")
+        df = df[(df["jahr_monat"] >= df["kunden_seit"]) & (self.rng.random(len(df)) < active_share)]
+        return df.reset_index(drop=True)
+
+    def abrnr_base_data(self) -> pd.DataFrame:
+        """
+        Monthly volumes per abrnr as downloaded in calc_abrechungsnr.
+        """
+        df = self._per_month()
+        df["num_sendung"] = self.rng.lognormal(4, 1.5, len(df)).round().astype(int) + 1
+        df["vol_ber"] = (df["num_sendung"] * self.rng.uniform(5, 60, len(df))).round(2)
+        return df[["jahr_monat", "abrnr", "ekpnr", "verfa", "teiln", "kunden_seit", "vol_ber", "num_sendung"]]
+
+    def kpr_costs(self) -> pd.DataFrame:
+        df = self.abr[["abrnr", "ekpnr"]].merge(pd.DataFrame({"prozessebene_id": PROZESSEBENEN}), how="cross")
+        df["Prozessmenge"] = self.rng.lognormal(6, 1.5, len(df)).round()
+        df["Fixkosten"] = (df["Prozessmenge"] * self.rng.uniform(0.05, 0.5, len(df))).round(2)
+        df["Varkosten"] = (df["Prozessmenge"] * self.rng.uniform(0.5, 2.5, len(df))).round(2)
+        return df
+
+    def kpr_treiber(self) -> pd.DataFrame:
+        df = self._per_month()[["ekpnr", "abrnr", "jahr_monat"]].rename(columns={"jahr_monat": "monat"})
+        df["Menge"] = self.rng.lognormal(5, 1.5, len(df)).round()
+        df["Absatz"] = (df["Menge"] * self.rng.uniform(0.7, 1, len(df))).round()
+        df["Raummass"] = self.rng.uniform(5, 60, len(df)).round(3)
+        df["Volumen"] = (df["Absatz"] * df["Raummass"]).round(3)
+        return df[["ekpnr", "abrnr", "monat", "Raummass", "Volumen", "Absatz", "Menge"]]
+
+    def kpr_zustellung(self) -> pd.DataFrame:
+        df = self.abr[["abrnr", "ekpnr"]].copy()
+        df["RZ"] = self.rng.lognormal(6, 1.5, len(df)).round()
+        return df
+
+    def kontrakt(self) -> pd.DataFrame:
+        if self._kontrakt is not None:
+            return self._kontrakt.copy()
+        df = self.abr[["ekpnr", "abrnr"]].copy()
+        df["kalknr"] = "K" + pd.Series(self.rng.integers(1, 10_000, len(df))).astype(str).str.zfill(6).to_numpy()
+        with_rv = self.rng.random(len(df)) < 0.1
+        df["rahmenvertrag"] = np.where(with_rv, "RV" + df["ekpnr"].str[-6:], None)
+        df["rv_ekp"] = np.where(with_rv, self.rng.choice(df["ekpnr"].to_numpy(), len(df)), None)
+        df["pl"] = self.rng.choice(PL_ENTRIES_PAKET, len(df))
+        self._kontrakt = df[["ekpnr", "kalknr", "abrnr", "rv_ekp", "rahmenvertrag", "pl"]]
+        return self._kontrakt.copy()
+
+    def mapping_rv_abrnr(self) -> pd.DataFrame:
+        df = self.kontrakt().dropna(subset=["rahmenvertrag"])
+        df["kundenname"] = "Kunde " + df["ekpnr"]
+        return df[["rahmenvertrag", "ekpnr", "abrnr", "kundenname"]]
+
+    def prod_gewicht(self) -> pd.DataFrame:
+        df = self.abr[["ekpnr"]].drop_duplicates().reset_index(drop=True)
+        df.insert(0, "abrnr", df["ekpnr"])
+        counts = self.rng.lognormal(4, 1.5, (len(df), len(GEWICHT_STAFFELN))).round()
+        df[GEWICHT_STAFFELN] = counts
+        bin_weight = np.array([0.7, 1.5, 3.5, 7.5, 15, 25, 35])
+        df["gewicht_sum"] = (counts * bin_weight).sum(axis=1).round(1)
+        return df[["abrnr", "ekpnr", "gewicht_sum"] + GEWICHT_STAFFELN]
+
+    def kunden_seit(self) -> pd.DataFrame:
+        return self.abr[["abrnr", "ekpnr", "kunden_seit"]].copy()
+
+    def fibu_excl_a(self) -> pd.DataFrame:
+        df = self.abr[["ekpnr", "verfa", "teiln", "abrnr"]].sample(frac=2, replace=True, random_state=0)
+        df = df.rename(columns={"ekpnr": "Auftr.geb.", "verfa": "Verf.", "teiln": "Teiln."}).reset_index(drop=True)
+        n = len(df)
+        df["PL"] = self.rng.choice(PL_ENTRIES_PAKET + PL_ENTRIES_WAPO + [None], n)
+        df["RV-Nr"] = None
+        df["LCode"] = "DE"
+        df["PKZ"] = None
+        df["KArt"] = "ZPR0"
+        df["Material"] = self.rng.choice(MATERIAL_LIST, n)
+        df["Waehrg"] = "EUR"
+        start = pd.Timestamp(self.reference_date) - pd.to_timedelta(self.rng.integers(0, 1500, (2, n)).ravel(), "D")
+        df["Gueltig_ab_l"] = start[:n]
+        df["Gueltig_ab_r"] = start[n:]
+        df["Gueltig_bis_l"] = df["Gueltig_ab_l"] + pd.Timedelta(days=365)
+        df["Gueltig_bis_r"] = pd.Timestamp("9999-12-31")
+        return df
+
+    def kt_abr_kleinpaket(self, share: float = 0.02) -> pd.DataFrame:
+        return self.abr[["abrnr", "ekpnr"]].sample(frac=share, random_state=1).reset_index(drop=True)
+
+    def write(self, kpr_files: KprFiles, dwh_files: DwhFiles, calc_files: CalculatedFiles, sap_files: SapFiles) -> str:
+        """
+        Writes all KprFiles/DwhFiles artifacts, the SAP inputs of the calc stages and calc_files.df_mapping.
+        The report16-18 extracts have no query in this repo and get the schema of report15.
+        Returns the path of the monthly abrnr base data.
+        """
+        for path in {kpr_files.df_data_path, dwh_files.df_data_path, calc_files.df_data_path, sap_files.df_data_path}:
+            Path(path).mkdir(parents=True, exist_ok=True)
+        df_costs = self.kpr_costs()
+        kpr_artifacts: Dict[str, pd.DataFrame] = {
+            "df_kpr_treiber": self.kpr_treiber(),
+            "df_kpr_zustellung": self.kpr_zustellung(),
+            "df_mapping_rv_abrnr": self.mapping_rv_abrnr(),
+        }
+        for entry in fields(kpr_files):
+            if entry.name.startswith("df_kpr_costs") or entry.name == "df_kpr_kosten":
+                kpr_artifacts[entry.name] = df_costs
+        for name, df in kpr_artifacts.items():
+            save_df(getattr(kpr_files, name), df)
+        save_df(dwh_files.df_prod_gewicht, self.prod_gewicht())
+        save_df(dwh_files.df_kunden_seit, self.kunden_seit())
+
+        df_kontrakt = self.kontrakt()
+        df_mapping = df_kontrakt[["ekpnr", "kalknr", "abrnr"]].assign(verfa=df_kontrakt.abrnr.str[10:12])
+        save_df(calc_files.df_mapping, df_mapping)
+
+        save_df(sap_files.df_kontrakt, df_kontrakt)
+        save_df(sap_files.df_fibu_excl_a, self.fibu_excl_a())
+        save_df(sap_files.df_kt_abr_kleinpaket, self.kt_abr_kleinpaket())
+
+        base_data_path = str(Path(calc_files.df_data_path) / "df_abrnr_base_data.parquet")
+        save_df(base_data_path, self.abrnr_base_data())
+        return base_data_path
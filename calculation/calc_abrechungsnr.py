@@ -1,22 +1,35 @@
 import logging
 from datetime import date, datetime
-from typing import List
+from typing import Dict, List, Optional
 
 import pandas as pd
 import numpy as np
 
+from src.calculation import calc_duckdb
+from src.run_config import calc_backend, reconcile_loads
 from src.utils.dwh_tables import STP_TABLES, CalculatedTables
-from src.utils.dwh_utils import create_table
+from src.utils.df_profile import profile_df
+from src.utils.dwh_utils import create_table, drop_table, get_table_checksums, table_fingerprint
+from src.utils.exclusion import anti_join_sql
 from src.utils.files import CalculatedFiles
+from src.utils.logger import Lazy, LazyDf, LazySql
+from src.utils.memory_budget import budget
+from src.utils.month_cache import MonthCache, month_range
+from src.utils.profiling import profile_stage
+from src.utils.reconciliation import reconcile
+from src.utils.sharding import shard_apply
+from src.utils.sql_templates import BoundQuery, bind
 from src.utils.td_connector import td
-from src.utils.utils import log_df_string, monthdelta, save_df
+from src.utils.utils import monthdelta, save_df
 
 
+@profile_stage()
 def ist_abrechnungsnr(
     logger: logging.Logger,
     calc_files: CalculatedFiles,
     calc_tables: CalculatedTables,
     reference_date: datetime,
+    month_cache: Optional[MonthCache] = None,
 ) -> None:
     """
     Merges monthly_volumes and kunden_seit tables, then checks, if multiple entries are in kunden_seit field and writes
@@ -24,11 +37,49 @@ def ist_abrechnungsnr(
     Calculates amount and average volume for different time deltas and saves to file.
     """
 
+    df = abrnr_base_data(logger, calc_tables, reference_date, month_cache)
+    calc_ist_abrechnungsnr(logger, calc_files, df, reference_date)
+
+
+def abrnr_base_data(
+    logger: logging.Logger,
+    calc_tables: CalculatedTables,
+    reference_date: datetime,
+    month_cache: Optional[MonthCache] = None,
+) -> pd.DataFrame:
+    """
+    Monthly volumes per abrnr of the 12 months before reference_date.
+    With a month_cache the months fetched for an earlier reference date are reused, as long as the kunden_seit
+    and exclusion tables they were joined with are unchanged.
+    """
     delta_1_month = monthdelta(-1, date=reference_date)
     delta_12_month = monthdelta(-12, date=reference_date)
 
-    df = __download_abrnr_base_data(logger, calc_tables, delta_1_month, delta_12_month)
-    df_sh2pr_12M_abr = __pivot_months_to_cols(df)
+    source = None if month_cache is None else _abrnr_base_data_source(logger, calc_tables)
+    if source is None:
+        return __download_abrnr_base_data(logger, calc_tables, delta_1_month, delta_12_month)
+    return month_cache.get(
+        source,
+        month_range(delta_12_month, delta_1_month),
+        lambda first, last: __download_abrnr_base_data(logger, calc_tables, last, first),
+        "jahr_monat",
+    )
+
+
+@profile_stage()
+def calc_ist_abrechnungsnr(
+    logger: logging.Logger,
+    calc_files: CalculatedFiles,
+    df: pd.DataFrame,
+    reference_date: datetime,
+) -> None:
+    """
+    Calculation part of ist_abrechnungsnr on the downloaded monthly volumes per abrnr.
+    """
+    if calc_backend == "duckdb":
+        df_sh2pr_12M_abr = calc_duckdb.pivot_months_to_cols(df)
+    else:
+        df_sh2pr_12M_abr = pivot_months_to_cols(df)
 
     occurence_ekp_verf_teiln = pd.DataFrame(df_sh2pr_12M_abr.abrnr.value_counts())
     multiple_kundenseit = occurence_ekp_verf_teiln[occurence_ekp_verf_teiln > 1]
@@ -48,67 +99,112 @@ def ist_abrechnungsnr(
         )
         save_df(calc_files.df_ist_abrnr_multiple_kundenseit, multiple_kundenseit)
 
+    # aggregation and time horizons work per ekpnr, the shards by ekpnr run in parallel processes
+    aggregate = multiple_kundenseit.size > 0
+    df_sh2pr_12M_abr = shard_apply(
+        __aggregate_and_time_horizons,
+        df_sh2pr_12M_abr,
+        ["ekpnr"],
+        keep_order=not aggregate,
+        sort_by=AGGREGATE_KEYS,
+        name="ist_abrechnungsnr",
+        reference_date=reference_date,
+        aggregate=aggregate,
+    )
+
+    # one pass for the whole frame and the breakdown by Verfahren
+    logger.debug(
+        "%s",
+        Lazy(profile_df, df_sh2pr_12M_abr, ["abrnr"], by="verfa", by_values=["01", "62"], name="df_sh2pr_12M_abr"),
+    )
+
+    logger.debug("\ndf_sh2pr_12M_abr head: \n%s", LazyDf(df_sh2pr_12M_abr))
+
+    save_df(calc_files.df_sh2pr_12M_abrnr, df_sh2pr_12M_abr)
+    logger.info("!!!finished abrechnungsnr!!!")
+
+
+AGGREGATE_KEYS = ["abrnr", "ekpnr", "verfa", "teiln"]
+
+
+def __aggregate_and_time_horizons(df_sh2pr_12M_abr: pd.DataFrame, reference_date: date, aggregate: bool):
+    if aggregate:
         df_sh2pr_12M_abr = __aggregate_data_from_multiple_kundenseit_abrnr(df_sh2pr_12M_abr)
 
-    df_sh2pr_12M_abr.fillna(0, inplace=True)
+    df_sh2pr_12M_abr = df_sh2pr_12M_abr.fillna(0)
+    df_sh2pr_12M_abr["kunden_seit"] = pd.to_numeric(df_sh2pr_12M_abr["kunden_seit"], errors="coerce")
 
     mnt_kpr_cols = [col for col in df_sh2pr_12M_abr.columns if "mnt_kpr" in col]
     vol_kpr_cols = [col for col in df_sh2pr_12M_abr.columns if "vol_kpr" in col]
+    # the columns of all time horizons are added at once, one insert per column fragments the frame
+    horizons = {}
     for delta in [1, 3, 6, 9, 12]:
-        __calculate_amount_and_volume_for_time_horizon(
-            reference_date, df_sh2pr_12M_abr, mnt_kpr_cols, vol_kpr_cols, delta
+        horizons.update(
+            __calculate_amount_and_volume_for_time_horizon(
+                reference_date, df_sh2pr_12M_abr, mnt_kpr_cols, vol_kpr_cols, delta
+            )
         )
-
-    logger.info(log_df_string(df_sh2pr_12M_abr, ["abrnr"], "df_sh2pr_12M_abr "))
-    logger.info(
-        log_df_string(
-            df_sh2pr_12M_abr[df_sh2pr_12M_abr["verfa"] == "01"],
-            ["abrnr"],
-            "df_sh2pr_12M_abr Verf=01",
-        )
-    )
-    logger.info(
-        log_df_string(
-            df_sh2pr_12M_abr[df_sh2pr_12M_abr["verfa"] == "62"],
-            ["abrnr"],
-            "df_sh2pr_12M_abr Verf=62",
-        )
-    )
-
-    logger.info(f"\ndf_sh2pr_12M_abr head: \n{df_sh2pr_12M_abr.head()}")
-
-    save_df(calc_files.df_sh2pr_12M_abrnr, df_sh2pr_12M_abr)
-    logger.info("!!!finished abrechnungsnr!!!")
+    return pd.concat([df_sh2pr_12M_abr, pd.DataFrame(horizons, index=df_sh2pr_12M_abr.index)], axis=1)
 
 
+@profile_stage()
 def __aggregate_data_from_multiple_kundenseit_abrnr(df_pivot: pd.DataFrame) -> pd.DataFrame:
     agg_dict = {col: "sum" for col in df_pivot.columns if "kpr" in col}
     agg_dict["kunden_seit"] = "min"
-    df_pivot = df_pivot.groupby(["abrnr", "ekpnr", "verfa", "teiln"], as_index=False).agg(agg_dict)
+    df_pivot = df_pivot.groupby(AGGREGATE_KEYS, as_index=False).agg(agg_dict)
 
     return df_pivot
 
 
-def __pivot_months_to_cols(df: pd.DataFrame):
-    df_pivot = df.pivot_table(
-        ["vol_ber", "num_sendung"],
-        ["abrnr", "ekpnr", "verfa", "teiln", "kunden_seit"],
-        "jahr_monat",
-    ).reset_index()
+PIVOT_INDEX = ["abrnr", "ekpnr", "verfa", "teiln", "kunden_seit"]
+
+
+@profile_stage()
+def pivot_months_to_cols(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    One column per month for amount and volume of the monthly volumes per abrnr, see calc_duckdb for the DuckDB version.
+    """
+    # over the memory budget the pivot runs per abrnr partition, every month column of the wide result at once
+    # would not fit
+    df_pivot = shard_apply(__pivot_budgeted, df, ["ekpnr"], sort_by=PIVOT_INDEX, name="pivot_months")
+    # partitions can lack months, the month columns are put back into the order of one pivot
+    return df_pivot[PIVOT_INDEX + sorted(col for col in df_pivot.columns if col not in PIVOT_INDEX)]
+
+
+def __pivot_budgeted(df: pd.DataFrame) -> pd.DataFrame:
+    return budget.apply(df, ["abrnr"], __pivot_partition, factor=3, sort_by=PIVOT_INDEX, name="pivot_months")
+
+
+def __pivot_partition(df: pd.DataFrame) -> pd.DataFrame:
+    df_pivot = df.pivot_table(["vol_ber", "num_sendung"], PIVOT_INDEX, "jahr_monat").reset_index()
 
     df_pivot.columns = [col[0] + "_" + str(col[1]) if col[1] != "" else col[0] for col in df_pivot.columns]
     df_pivot.columns = df_pivot.columns.str.replace("num_sendung", "mnt_kpr").str.replace("vol_ber", "vol_kpr")
     return df_pivot
 
 
-def __download_abrnr_base_data(
-    logger: logging.Logger, calc_tables: CalculatedFiles, delta_1_month: str, delta_12_month: str
-) -> pd.DataFrame:
-    tmp_table = "DBX_DWH_SBX_GB30_PRD.tmp_monthlyV_kundenseit"
+def _abrnr_base_data_source(logger: logging.Logger, calc_tables: CalculatedTables) -> Optional[str]:
+    # the cached months are only valid for the content of the joined tables, None if it could not be checked
+    checksums = get_table_checksums(
+        td,
+        {
+            calc_tables.get_table("kunden_seit"): "(abrnr, kunden_seit)",
+            calc_tables.get_table("kt_abr_aktionsgeschaeft"): "(abrnr)",
+            calc_tables.get_table("kt_abr_kleinpaket"): "(abrnr)",
+        },
+        logger,
+    )
+    if None in checksums.values():
+        logger.warning("Not caching abrnr_base_data, the kunden_seit and exclusion tables could not be checked")
+        return None
+    return f"abrnr_base_data_{table_fingerprint(abrnr_base_data_query(calc_tables, 0, 0), '', checksums)[:12]}"
 
-    logger.info(f"using dates from {delta_12_month} to {delta_1_month} and tmp table {tmp_table}")
 
-    sql_join = f"""
+def abrnr_base_data_query(calc_tables: CalculatedTables, delta_1_month, delta_12_month) -> str:
+    """
+    Monthly volumes per abrnr joined with kunden_seit, the defining query of the tmp_monthlyV_kundenseit table.
+    """
+    return f"""
         SELECT
             a.jahr_monat
             , a.abrnr
@@ -135,35 +231,74 @@ def __download_abrnr_base_data(
         LEFT JOIN {calc_tables.get_table("kunden_seit")} as b
         ON a.abrnr = b.abrnr
         WHERE a.abrnr is not NULL
-            and a.abrnr
-                not in (sel abrnr from {calc_tables.get_table("kt_abr_aktionsgeschaeft")} where abrnr is not null)
-            and a.abrnr
-                not in (sel abrnr from {calc_tables.get_table("kt_abr_kleinpaket")} where abrnr is not null)
+            and {anti_join_sql(calc_tables.get_table("kt_abr_aktionsgeschaeft"), "a.abrnr", "ag")}
+            and {anti_join_sql(calc_tables.get_table("kt_abr_kleinpaket"), "a.abrnr", "kp")}
         GROUP BY jahr_monat, a.abrnr, AUFTRAGGEBER_EKP, AUFTRAGGEBER_VERFAHREN, AUFTRAGGEBER_TEILNAHME
     """
 
-    logger.info(sql_join)
 
-    create_table(td, tmp_table, sql_join, "(abrnr)", logger)
+def preflight_queries(calc_tables: CalculatedTables, reference_date: datetime) -> Dict[str, BoundQuery]:
+    """
+    The Teradata queries of ist_abrechnungsnr, for the pre-flight EXPLAIN.
+    """
+    query = abrnr_base_data_query(calc_tables, monthdelta(-1, date=reference_date), monthdelta(-12, date=reference_date))
+    return {"abrnr_base_data": bind(query)}
+
+
+@profile_stage()
+def __download_abrnr_base_data(
+    logger: logging.Logger, calc_tables: CalculatedTables, delta_1_month: str, delta_12_month: str
+) -> pd.DataFrame:
+    # the table is only read back on the session that builds it, volatile it is neither journaled nor left behind
+    tmp_table = calc_tables.get_scratch_table("tmp_monthlyV_kundenseit", delta_1_month, volatile=True)
+
+    logger.info(f"using dates from {delta_12_month} to {delta_1_month} and tmp table {tmp_table}")
+
+    sql_join = abrnr_base_data_query(calc_tables, delta_1_month, delta_12_month)
+
+    logger.debug("%s", LazySql(sql_join))
 
+    create_table(
+        td,
+        tmp_table,
+        sql_join,
+        calc_tables.get_index("tmp_monthlyV_kundenseit"),
+        logger,
+        volatile=True,
+        statistics=calc_tables.get_statistics("tmp_monthlyV_kundenseit"),
+        index_candidates=calc_tables.get_index_candidates("tmp_monthlyV_kundenseit"),
+    )
+
+    # read_query can use another session (arrow-odbc or the bound pyodbc session), where the table does not exist
     df = td.download_table_odbc(f"select * from {tmp_table}")
+    if reconcile_loads:
+        reconcile(
+            lambda query: td.download_table_odbc(query.render()),
+            df,
+            tmp_table,
+            ["abrnr", "jahr_monat"],
+            logger,
+            dialect="teradata",
+        )
+    drop_table(td, tmp_table, logger)
     return df
 
 
 def __calculate_amount_and_volume_for_time_horizon(
     reference_date: date, df_sh2pr_12M_abr: pd.DataFrame, mnt_kpr_cols: List[str], vol_kpr_cols: List[str], delta: int
-):
+) -> dict:
+    """
+    Amount and average volume of the last delta months for the customers of that period, as new columns.
+    """
     first_month = monthdelta(-delta, date=reference_date)
     mnt_kpr_period = [col for col in mnt_kpr_cols if int(col.split("_")[-1]) >= first_month]
     vol_kpr_period = [col for col in vol_kpr_cols if int(col.split("_")[-1]) >= first_month]
 
-    df_sh2pr_12M_abr["kunden_seit"] = pd.to_numeric(df_sh2pr_12M_abr["kunden_seit"], errors="coerce")
-    df_sh2pr_12M_abr[f"amount_{str(delta).zfill(2)}M"] = np.where(
-        df_sh2pr_12M_abr["kunden_seit"] <= first_month, df_sh2pr_12M_abr[mnt_kpr_period].sum(axis=1), np.nan
-    )
-
-    df_sh2pr_12M_abr[f"vol_{str(delta).zfill(2)}M_avg"] = np.where(
-        df_sh2pr_12M_abr["kunden_seit"] <= first_month,
-        round((df_sh2pr_12M_abr[vol_kpr_period].sum(axis=1) / df_sh2pr_12M_abr[mnt_kpr_period].sum(axis=1)), 2),
-        np.nan,
-    )
+    customer = df_sh2pr_12M_abr["kunden_seit"] <= first_month
+    amount = df_sh2pr_12M_abr[mnt_kpr_period].sum(axis=1)
+    return {
+        f"amount_{str(delta).zfill(2)}M": np.where(customer, amount, np.nan),
+        f"vol_{str(delta).zfill(2)}M_avg": np.where(
+            customer, round(df_sh2pr_12M_abr[vol_kpr_period].sum(axis=1) / amount, 2), np.nan
+        ),
+    }
@@ -1,5 +1,8 @@
 PRODUKT_VERFAHREN_MAPPING = {"paket": "01", "warenpost": "62"}
 
+# produkt_id of the products in the KPR views
+PRODUKT_ID_MAPPING = {"paket": [1], "warenpost": [34, 35]}
+
 MATERIAL_LIST = [
     "",
     "1123",
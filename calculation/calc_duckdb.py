@@ -0,0 +1,130 @@
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # optional, only needed for calc_backend = "duckdb"
+    duckdb = None
+
+from src.run_config import duckdb_memory_limit, duckdb_temp_directory
+from src.utils.files import CalculatedFiles, DwhFiles
+from src.utils.logger import LazySql
+from src.utils.profiling import profile_stage
+
+# DuckDB versions of the heavy calc steps, used with calc_backend = "duckdb". They run on all cores and spill
+# to duckdb_temp_directory once duckdb_memory_limit is reached, results equal the pandas versions.
+PIVOT_INDEX = ["abrnr", "ekpnr", "verfa", "teiln", "kunden_seit"]
+
+
+def connect():
+    if duckdb is None:
+        raise ImportError("duckdb is required for calc_backend 'duckdb'")
+    con = duckdb.connect()
+    con.execute(f"SET threads = {os.cpu_count()}")
+    con.execute(f"SET memory_limit = '{duckdb_memory_limit}'")
+    if duckdb_temp_directory:
+        con.execute(f"SET temp_directory = '{duckdb_temp_directory}'")
+    return con
+
+
+def _parquet_columns(con, path: str) -> List[str]:
+    return [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM read_parquet('{path}')").fetchall()]
+
+
+@profile_stage()
+def prod_gewicht_preparation(
+    logger: logging.Logger, dwh_files: DwhFiles, calc_files: CalculatedFiles, output_path: Optional[str] = None
+) -> None:
+    """
+    DuckDB version of calc_weight_distribution.prod_gewicht_preparation, reads and writes parquet directly.
+    """
+    output_path = output_path or calc_files.df_prod_gewicht_prepared
+    con = connect()
+    gewicht_cols = _parquet_columns(con, dwh_files.df_prod_gewicht)
+    staffel_cols = [c for c in gewicht_cols if ("gewicht_bis" in c) or ("gewicht_ue" in c)]
+
+    anz_sdg = " + ".join(f"coalesce(g.{c}, 0)" for c in staffel_cols)
+    anteil = ",\n".join(f"round({c} / anz_sdg, 6) AS anteil_{c}" for c in staffel_cols)
+    sql = f"""
+        COPY (
+            WITH joined AS (
+                SELECT g.* EXCLUDE (file_row_number), m.kalknr, {anz_sdg} AS anz_sdg,
+                    g.file_row_number AS _g_row, m.file_row_number AS _m_row
+                FROM read_parquet('{dwh_files.df_prod_gewicht}', file_row_number = true) AS g
+                LEFT JOIN read_parquet('{calc_files.df_mapping}', file_row_number = true) AS m
+                    ON g.abrnr = m.abrnr
+            )
+            SELECT * EXCLUDE (_g_row, _m_row), round(gewicht_sum / anz_sdg, 1) AS gewicht_avg,
+                {anteil}
+            FROM joined
+            WHERE kalknr IS NOT NULL
+            ORDER BY _g_row, _m_row
+        ) TO '{output_path}' (FORMAT PARQUET)
+    """
+    logger.debug("%s", LazySql(sql))
+    con.execute(sql)
+    con.close()
+
+
+@profile_stage()
+def pivot_months_to_cols(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    DuckDB version of the monthly pivot in calc_abrechungsnr, one column per month for amount and volume.
+    """
+    con = connect()
+    con.register("base", df)
+    months = sorted(df["jahr_monat"].dropna().unique())
+    mnt_cols = [f'avg(num_sendung) FILTER (WHERE jahr_monat = {m}) AS "mnt_kpr_{m}"' for m in months]
+    vol_cols = [f'avg(vol_ber) FILTER (WHERE jahr_monat = {m}) AS "vol_kpr_{m}"' for m in months]
+    index = ", ".join(PIVOT_INDEX)
+    df_pivot = con.execute(
+        f"""
+        SELECT {index}, {", ".join(mnt_cols + vol_cols)}
+        FROM base
+        WHERE {" AND ".join(f"{col} IS NOT NULL" for col in PIVOT_INDEX)}
+        GROUP BY {index}
+        ORDER BY {index}
+        """
+    ).df()
+    con.close()
+    return df_pivot
+
+
+@profile_stage()
+def dedup_fibu_preisliste(df_fibu_unique: pd.DataFrame, df_kalknr_mapping: pd.DataFrame) -> pd.DataFrame:
+    """
+    DuckDB version of the sort/dedup/groupby in calc_fibu_presliste: latest price list per abrnr, aggregated by kalknr.
+    """
+    con = connect()
+    con.register("fibu", df_fibu_unique.assign(_f_row=np.arange(len(df_fibu_unique))))
+    con.register("mapping", df_kalknr_mapping[["abrnr", "kalknr"]].assign(_m_row=np.arange(len(df_kalknr_mapping))))
+    order = "abrnr, _f_row, _m_row"
+    df = con.execute(
+        f"""
+        WITH latest AS (
+            SELECT * FROM fibu
+            QUALIFY row_number() OVER (
+                PARTITION BY ekpnr, abrnr
+                ORDER BY Gueltig_ab DESC NULLS LAST, Gueltig_bis DESC NULLS LAST, PL DESC NULLS LAST, _f_row
+            ) = 1
+        ), joined AS (
+            SELECT latest.*, mapping.kalknr, mapping._m_row
+            FROM latest JOIN mapping ON latest.abrnr = mapping.abrnr
+        )
+        SELECT ekpnr, kalknr,
+            first(abrnr ORDER BY {order}) FILTER (WHERE abrnr IS NOT NULL) AS abrnr,
+            first(Gueltig_ab ORDER BY {order}) FILTER (WHERE Gueltig_ab IS NOT NULL) AS Gueltig_ab,
+            max(Gueltig_bis) AS Gueltig_bis,
+            first(PL ORDER BY {order}) FILTER (WHERE PL IS NOT NULL) AS PL
+        FROM joined
+        WHERE ekpnr IS NOT NULL AND kalknr IS NOT NULL
+        GROUP BY ekpnr, kalknr
+        ORDER BY ekpnr, kalknr
+        """
+    ).df()
+    con.close()
+    return df
@@ -2,10 +2,16 @@ import logging
 import pandas as pd
 import numpy as np
 from ..utils.files import SapFiles, CalculatedFiles
+from ..utils.hana_loader import load_delta
+from ..utils.profiling import profile_stage
+from ..utils.exclusion import AbrnrExclusion, load_exclusion
 from ..utils.utils import read_df, save_df, exclude_abrnr
+from . import calc_duckdb
+from ..run_config import calc_backend
 from .calc_constants import MATERIAL_LIST, PL_ENTRIES_PAKET, PL_ENTRIES_WAPO, PL_LETTERS, PRODUKT_VERFAHREN_MAPPING
 
 
+@profile_stage()
 def calc_fibu_preisliste(
     sap_files: SapFiles,
     calc_files: CalculatedFiles,
@@ -18,16 +24,42 @@ def calc_fibu_preisliste(
 
     df_fibuabzug = read_df(sap_files.df_fibu_excl_a)
     df_kalknr_mapping = read_df(calc_files.df_mapping)
-    df_kalknr_mapping = df_kalknr_mapping[["abrnr", "kalknr"]].copy()
+    df_kleinpaket = load_exclusion(sap_files.df_kt_abr_kleinpaket)
 
-    logger.info("excluding Kleinpaket from FIBU %s", product)
-    df_kp = read_df(sap_files.df_kt_abr_kleinpaket)
-    df_fibuabzug = exclude_abrnr(df_fibuabzug, df_kp, logger)
+    df_fibu_unique = fibu_preisliste_unique(
+        df_fibuabzug, df_kalknr_mapping, df_kleinpaket, product, logger, pl_start_letters
+    )
+
+    # Only the price lists changed since the last run are sent to HANA Cloud
+    load_delta(
+        logger, df_fibu_unique, "PRIMA_PRICE_DELTA", key_cols=["ekpnr", "kalknr"], partition={"produkt": product.lower()}
+    )
+
+    save_df(calc_files.df_fibu_preisliste_unique, df_fibu_unique)
+
+
+@profile_stage()
+def fibu_preisliste_unique(
+    df_fibuabzug: pd.DataFrame,
+    df_kalknr_mapping: pd.DataFrame,
+    df_kleinpaket: AbrnrExclusion,
+    product: str,
+    logger: logging.Logger,
+    pl_start_letters: str = PL_LETTERS,
+    backend: str = calc_backend,
+) -> pd.DataFrame:
+    """
+    Determines the valid FIBU price list per ekpnr and kalknr.
+    """
+    df_kalknr_mapping = df_kalknr_mapping[["abrnr", "kalknr"]]
 
-    for col in ["PL", "RV-Nr", "LCode", "PKZ", "KArt", "Material", "Waehrg"]:
-        df_fibuabzug[col].fillna("", inplace=True)
+    logger.info("excluding Kleinpaket from FIBU %s", product)
+    df_fibuabzug = exclude_abrnr(df_fibuabzug, df_kleinpaket, logger)
 
-    df_fibuabzug.rename(columns={"Auftr.geb.": "ekpnr", "Verf.": "Verf", "Teiln.": "Teiln"}, inplace=True)
+    # the chained inplace fillna per column did not reach the frame under copy-on-write
+    df_fibuabzug = df_fibuabzug.fillna(
+        {col: "" for col in ["PL", "RV-Nr", "LCode", "PKZ", "KArt", "Material", "Waehrg"]}
+    ).rename(columns={"Auftr.geb.": "ekpnr", "Verf.": "Verf", "Teiln.": "Teiln"})
     df_fibuabzug["abrnr"] = df_fibuabzug.ekpnr + df_fibuabzug.Verf + df_fibuabzug.Teiln
 
     # macht es hier nicht mehr Sinn, die Preislisten nach dem Gültigkeitsdatum zu filtern, anstelle der PL Bezeichnungen?
@@ -40,8 +72,8 @@ def calc_fibu_preisliste(
         mask = (df_fibuabzug["Verf"].astype(str).str.strip() == "62") & (df_fibuabzug.Material.isin(MATERIAL_LIST))
         price_list = PL_ENTRIES_WAPO
 
-    df_fibuabzug = df_fibuabzug[mask][
-        ["ekpnr", "abrnr", "Gueltig_ab_l", "Gueltig_bis_l", "PL", "Gueltig_ab_r", "Gueltig_bis_r", "Material"]
+    df_fibuabzug = df_fibuabzug.loc[
+        mask, ["ekpnr", "abrnr", "Gueltig_ab_l", "Gueltig_bis_l", "PL", "Gueltig_ab_r", "Gueltig_bis_r", "Material"]
     ]
 
     logger.info("calculating valid time periods for prices")
@@ -72,7 +104,16 @@ def calc_fibu_preisliste(
         ),
     )
 
-    df_fibu_unique = df_fibuabzug[["ekpnr", "abrnr", "PL", "Gueltig_ab", "Gueltig_bis"]].copy()
+    df_fibu_unique = df_fibuabzug[["ekpnr", "abrnr", "PL", "Gueltig_ab", "Gueltig_bis"]]
+    if backend == "duckdb":
+        return calc_duckdb.dedup_fibu_preisliste(df_fibu_unique, df_kalknr_mapping)
+    return dedup_fibu_preisliste(df_fibu_unique, df_kalknr_mapping)
+
+
+def dedup_fibu_preisliste(df_fibu_unique: pd.DataFrame, df_kalknr_mapping: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keeps the latest price list per abrnr and aggregates it by kalknr.
+    """
     df_fibu_unique = df_fibu_unique.sort_values(
         by=["ekpnr", "abrnr", "Gueltig_ab", "Gueltig_bis", "PL"], ascending=[True, True, False, False, False]
     )
@@ -81,22 +122,4 @@ def calc_fibu_preisliste(
     df_fibu_unique = df_fibu_unique.groupby(["ekpnr", "kalknr"], as_index=False).agg(
         {"abrnr": "first", "Gueltig_ab": "first", "Gueltig_bis": max, "PL": "first"}
     )
-     
-# Start of Abhijeet Insert into HANA Cloud after the data is processed
-    connection = connect_to_hana()
-    cursor = connection.cursor()
-
-    # Prepare SQL query to insert data into HANA Cloud table (example)
-    sql = """
-        INSERT INTO PRIMA_PRICE_DELTA (column1, column2, ...)
-        VALUES (?, ?, ...)
-    """
-    cursor.execute(sql, [value1, value2, ...])
-    connection.commit()
-    cursor.close()
-    connection.close()
-
-    logger.info("Data inserted into HANA Cloud successfully")
-    # End of Abhijeet 
-
-    save_df(calc_files.df_fibu_preisliste_unique, df_fibu_unique)
+    return df_fibu_unique
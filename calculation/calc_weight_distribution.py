@@ -1,10 +1,20 @@
+from src.calculation import calc_duckdb
+from src.run_config import calc_backend
 from src.utils.files import DwhFiles, CalculatedFiles
+from src.utils.hana_loader import load_delta
+from src.utils.logger import LazyDf
+from src.utils.profiling import profile_stage
+from src.utils.sharding import shard_apply
 from src.utils.utils import read_df, save_df
 import logging
 import pandas as pd
 
 
-def calc_weight_distribution(logger: logging.Logger, dwh_files: DwhFiles, calc_files: CalculatedFiles):
+def calc_weight_distribution(logger: logging.Logger, dwh_files: DwhFiles, calc_files: CalculatedFiles) -> pd.DataFrame:
+    """
+    Prepares the weights and calculates the weight distribution, the caller loads it into HANA (see
+    insert_weight_distribution_into_hana).
+    """
     logger.info("Starting weight distribution calculations related to DWH and KPR systems.")
     
     # Step 1: Prepare weight data by reading DWH data
@@ -13,62 +23,73 @@ def calc_weight_distribution(logger: logging.Logger, dwh_files: DwhFiles, calc_f
     
     # Step 2: Calculate weight distribution (if necessary for KPR flow)
     logger.info("Start calculating weight distribution.")
-    prod_gewicht2verteilung(logger, calc_files=calc_files)
-    
-    # Optional: Insert the results into HANA Cloud if needed for further analysis or reporting
-    logger.info("Inserting the weight distribution data into HANA Cloud.")
-    connection = connect_to_hana()
-    cursor = connection.cursor()
-
-    sql = """
-        INSERT INTO SHIPTOPROFILE_KONTRAKT_SERV (column1, column2, ...)
-        VALUES (?, ?, ...)
-    """
-    cursor.executemany(sql, data_to_insert)  # Assuming data_to_insert contains data for HANA insertion
-    connection.commit()
-    cursor.close()
-    connection.close()
+    df_gewicht2verteilung = prod_gewicht2verteilung(logger, calc_files=calc_files)
 
-    logger.info("Weight distribution data successfully inserted into HANA Cloud.")
     logger.info("Finished weight distribution calculations.")
+    return df_gewicht2verteilung
 
 
+def insert_weight_distribution_into_hana(logger: logging.Logger, df_gewicht2verteilung: pd.DataFrame, product: str):
+    # Only the weight distribution rows changed since the last run are sent to HANA Cloud, the rows of each product
+    # are a partition of the table so that products loaded in parallel do not delete each other's rows
+    load_delta(
+        logger,
+        df_gewicht2verteilung,
+        "SHIPTOPROFILE_KONTRAKT_SERV",
+        key_cols=["gewicht_avg_est"],
+        partition={"produkt": product.lower()},
+    )
+
+
+@profile_stage()
 def prod_gewicht_preparation(logger: logging.Logger, dwh_files: DwhFiles, calc_files: CalculatedFiles) -> None:
     """
     Prepares weight distribution data by reading from DWH and merging it with relevant mappings for KPR processing.
     """
+    if calc_backend == "duckdb":
+        logger.info("Preparing weight data with duckdb.")
+        calc_duckdb.prod_gewicht_preparation(logger, dwh_files, calc_files)
+        return
+
     logger.info("Reading product weight data from DWH files.")
     df_prod_gewicht = read_df(dwh_files.df_prod_gewicht)  # Reading from DWH
     
     logger.info("Reading and merging mapping files for KPR.")
     df_mapping = read_df(calc_files.df_mapping)  # Reading mapping for further processing
     df_mapping = df_mapping[['abrnr', 'kalknr']]  # Keep only relevant columns (abrnr, kalknr)
-    
-    # Merging DWH data with mapping
-    df = pd.merge(df_prod_gewicht, df_mapping, how="left", on=["abrnr"])
-    
-    # Grouping by relevant fields (ekpnr, kalknr)
-    logger.info("Grouping weight data by KPR and relevant identifiers.")
-    df.groupby(["ekpnr", "kalknr"], as_index=False).sum()
-    
-    # Calculating weight distribution by staffel (weight classes)
-    gewicht_staffel_cols = [c for c in df.columns if ("gewicht_bis" in c) or ("gewicht_ue" in c)]
-    df["anz_sdg"] = df[gewicht_staffel_cols].sum(axis=1)
-    
-    df["gewicht_avg"] = round(df.gewicht_sum / df.anz_sdg, 1)  # Average weight
-    
-    # Calculating percentage contribution for each staffel
-    for staffel in gewicht_staffel_cols:
-        df[f"anteil_{staffel}"] = round(df[staffel] / df.anz_sdg, 6)
-    
-    df.dropna(subset="kalknr", inplace=True)  # Drop rows without kalknr
-    
+
+    # Every abrnr is prepared on its own, the shards by abrnr run in parallel processes
+    df = shard_apply(
+        _prepare_weights,
+        df_prod_gewicht,
+        ["abrnr"],
+        co_sharded={"df_mapping": (df_mapping, ["abrnr"])},
+        keep_order=True,
+        name="prod_gewicht_preparation",
+    )
+
     # Save the prepared data
     logger.info("Saving the prepared weight distribution data.")
     save_df(calc_files.df_prod_gewicht_prepared, df)
 
 
-def prod_gewicht2verteilung(logger: logging.Logger, calc_files: CalculatedFiles):
+def _prepare_weights(df_prod_gewicht: pd.DataFrame, df_mapping: pd.DataFrame) -> pd.DataFrame:
+    # Merging DWH data with mapping, rows without kalknr are dropped before anything is calculated for them
+    df = pd.merge(df_prod_gewicht, df_mapping, how="left", on=["abrnr"])
+    df = df[df["kalknr"].notna()]
+
+    # Calculating weight distribution by staffel (weight classes), the rows stay per abrnr
+    gewicht_staffel_cols = [c for c in df.columns if ("gewicht_bis" in c) or ("gewicht_ue" in c)]
+    anz_sdg = df[gewicht_staffel_cols].sum(axis=1)
+
+    # Percentage contribution for each staffel, all new columns are added in one step
+    df_anteil = df[gewicht_staffel_cols].div(anz_sdg, axis=0).round(6).add_prefix("anteil_")
+    df_calc = pd.DataFrame({"anz_sdg": anz_sdg, "gewicht_avg": round(df.gewicht_sum / anz_sdg, 1)})
+    return pd.concat([df, df_calc, df_anteil], axis=1)
+
+
+@profile_stage()
+def prod_gewicht2verteilung(logger: logging.Logger, calc_files: CalculatedFiles) -> pd.DataFrame:
     """
     Calculates the weight distribution based on prepared data and stores the results.
     """
@@ -78,26 +99,26 @@ def prod_gewicht2verteilung(logger: logging.Logger, calc_files: CalculatedFiles)
     # Selecting relevant columns
     anteil_columns = df_prod_gewicht.columns[df_prod_gewicht.columns.str.contains("anteil_")]
     
-    logger.info(f"Weight data sample: \n{df_prod_gewicht.head()}")
+    logger.debug("Weight data sample: \n%s", LazyDf(df_prod_gewicht))
 
     # Grouping by average weight and calculating sum of contributions
     df_gewicht2verteilung = df_prod_gewicht.groupby(["gewicht_avg"], as_index=False)[anteil_columns].sum()
     df_gewicht2verteilung = df_gewicht2verteilung[~df_gewicht2verteilung["gewicht_avg"].isna()]
-    df_gewicht2verteilung["anz_kunde"] = round(df_gewicht2verteilung[anteil_columns].sum(axis=1), 0)
-    
+    anz_kunde = round(df_gewicht2verteilung[anteil_columns].sum(axis=1), 0)
+
     # Calculating estimated contribution for each staffel
-    for col in anteil_columns:
-        col_est = col + "_est"
-        df_gewicht2verteilung[col_est] = round(df_gewicht2verteilung[col] / df_gewicht2verteilung["anz_kunde"], 6)
-    
-    df_gewicht2verteilung.rename(columns={"gewicht_avg": "gewicht_avg_est"}, inplace=True)
+    df_est = df_gewicht2verteilung[anteil_columns].div(anz_kunde, axis=0).round(6).add_suffix("_est")
+    df_gewicht2verteilung = pd.concat(
+        [df_gewicht2verteilung.assign(anz_kunde=anz_kunde), df_est], axis=1
+    ).rename(columns={"gewicht_avg": "gewicht_avg_est"})
     df_gewicht2verteilung = df_gewicht2verteilung[
         df_gewicht2verteilung.columns[df_gewicht2verteilung.columns.str.contains("_est|anz_|ekpnr|kalknr")]
     ]
     
-    logger.info(f"Calculated weight distribution sample: \n{df_gewicht2verteilung.head()}")
+    logger.debug("Calculated weight distribution sample: \n%s", LazyDf(df_gewicht2verteilung))
     logger.info(f"Total number of customers: {df_gewicht2verteilung['anz_kunde'].sum()}")
 
     # Save the calculated weight distribution
     logger.info("Saving the calculated weight distribution data.")
     save_df(calc_files.df_gewicht2verteilung, df_gewicht2verteilung)
+    return df_gewicht2verteilung
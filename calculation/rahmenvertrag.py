@@ -1,17 +1,21 @@
 import logging
-import numpy as np
 import pandas as pd
 from src.utils.files import KprFiles, DwhFiles, SapFiles, CalculatedFiles
+from src.utils.memory_budget import budget
+from src.utils.profiling import profile_stage
+from src.utils.sharding import shard_apply
 from src.utils.utils import read_df, save_df
 
+@profile_stage()
 def map_rahmenvertag_ekp(df_abr: pd.DataFrame, df_mapping: pd.DataFrame) -> pd.DataFrame:
-    df_mapping = df_mapping.drop(columns="kalknr").drop_duplicates(keep="first")
-    df_merged = df_abr.merge(df_mapping, left_on=["abrnr"], right_on=["abrnr"], how="left")
+    # the columns dropped right after the merge are not merged at all, the rows stay deduplicated with them
+    df_mapping = df_mapping.drop(columns="kalknr").drop_duplicates(keep="first").drop(columns=["rahmenvertrag", "pl"])
+    df_merged = budget.merge(df_abr, df_mapping, on=["abrnr"], how="left", name="map_rahmenvertag_ekp")
     df_merged["ag_ekp"] = df_merged.abrnr.str[:10]
-    df_merged["ekpnr"] = np.where(df_merged.rv_ekp.notna(), df_merged.rv_ekp, df_merged.ag_ekp)
-    df_merged.drop(columns=["rv_ekp", "rahmenvertrag", "pl"], inplace=True)
+    df_merged["ekpnr"] = df_merged.pop("rv_ekp").fillna(df_merged["ag_ekp"])
     return df_merged
 
+@profile_stage()
 def _overwrite_ekpnr_rv(logger: logging.Logger, file_path: str, df_kontrakt: pd.DataFrame, mapping_func):
     logger.info("reading file %s", file_path)
     df_abr = read_df(file_path)
@@ -19,7 +23,15 @@ def _overwrite_ekpnr_rv(logger: logging.Logger, file_path: str, df_kontrakt: pd.
     old_file_path = file_path + "_old"
     save_df(old_file_path, df_abr)
     logger.info("saved old file to %s", old_file_path)
-    df_abr = mapping_func(df_abr, df_kontrakt)
+    # the mapping works per abrnr, the shards by abrnr run in parallel processes
+    df_abr = shard_apply(
+        mapping_func,
+        df_abr,
+        ["abrnr"],
+        co_sharded={"df_mapping": (df_kontrakt, ["abrnr"])},
+        keep_order=True,
+        name="map_rahmenvertrag",
+    )
     logger.info("shape before after rahmenvertrag %s", df_abr.shape)
     save_df(file_path, df_abr)
     logger.info("shape before after rahmenvertrag %s", df_abr.shape)
@@ -44,6 +56,7 @@ def _select_files_to_map_rv_ekpnr(
         calc_files.df_sh2pr_12M_abrnr,
     ]
 
+@profile_stage()
 def overwrite_files_with_ekpnr_rv(
     logger: logging.Logger,
     sap_files: SapFiles,
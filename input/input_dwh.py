@@ -1,11 +1,27 @@
 import logging
-from datetime import datetime
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
 import pandas as pd
 from dateutil.relativedelta import relativedelta
+from ..run_config import pipeline_mode, pipeline_queue_size
+from ..utils.async_pipeline import Pipeline
 from ..utils.dwh_tables import STATIC_TABLES, CalculatedTables
-from ..utils.dwh_utils import create_table, log_minmax_date, log_table_sample, log_table_shape
+from ..utils.dwh_utils import (
+    create_table,
+    get_source_watermarks,
+    log_minmax_date,
+    log_table_sample,
+    log_table_shape,
+)
 from ..utils.files import DwhFiles
-from ..utils.td_connector import td
+from ..utils.hana_loader import load_delta
+from ..utils.logger import Lazy, LazyDf, LazySql
+from ..utils.memory_budget import budget
+from ..utils.month_cache import MonthCache
+from ..utils.profiling import profile_stage
+from ..utils.sql_templates import BoundQuery, SqlTemplate, bind
+from ..utils.td_connector import read_query, td
 from ..utils.utils import log_df_string, monthdelta, normalize_code, save_df
 
 
@@ -14,73 +30,25 @@ def input_dwh(
     dwh_files: DwhFiles,
     calc_tables: CalculatedTables,
     reference_date: datetime,
+    month_cache: Optional[MonthCache] = None,
 ) -> None:
     logger.info("Start with data_input_kundenkonzern_vertragspartner")
     data_input_kundenkonzern_vertragspartner(logger, calc_tables=calc_tables)
 
     logger.info("Start with dwh_paket_gewicht")
-    df_prod_gewicht = dwh_paket_gewicht(logger, dwh_files, reference_date)
-
-    # Start of Abhijeet: Inserting extracted data into HANA Cloud
-    if df_prod_gewicht is not None and not df_prod_gewicht.empty:
-        logger.info("Inserting data from DataFrame into HANA Cloud...")
-        try:
-            connection = connect_to_hana()  #  connect_to_hana() is correctly implemented in your utils
-            cursor = connection.cursor()
-
-            # Assuming your HANA table has corresponding columns to your DataFrame
-            sql = """
-                INSERT INTO DWH_HANA_TABLE (ekpnr, gewicht_sum, gewicht_bis01kg, gewicht_bis02kg, ...)
-                VALUES (?, ?, ?, ?, ...)
-            """
-            # Map the DataFrame to tuples for insertion
-            data_to_insert = [
-                (
-                    row['ekpnr'], row['gewicht_sum'], row['gewicht_bis01kg'], row['gewicht_bis02kg'], ...
-                )
-                for index, row in df_prod_gewicht.iterrows()
-            ]
-
-            # Execute the insert statement with the DataFrame data
-            cursor.executemany(sql, data_to_insert)
-            connection.commit()
-
-            logger.info(f"Inserted {len(data_to_insert)} rows into HANA Cloud.")
-        except Exception as e:
-            logger.error(f"Error inserting data into HANA Cloud: {str(e)}")
-        finally:
-            cursor.close()
-            connection.close()
-
-    else:
-        logger.warning("DataFrame is empty. No data to insert into HANA Cloud.")
+    df_prod_gewicht = dwh_paket_gewicht(logger, dwh_files, reference_date, month_cache)
 
-    logger.info("Finished inserting data into HANA Cloud.")
-    # End of Abhijeet
+    # Only the weight profiles changed since the last run are sent to HANA Cloud
+    load_delta(logger, df_prod_gewicht, "DWH_HANA_TABLE", key_cols=["ekpnr"])
 
     logger.info("!!!Finished input_dwh!!!")
 
 
-def dwh_paket_gewicht(logger: logging.Logger, files: DwhFiles, reference_date: datetime) -> pd.DataFrame:
+def paket_gewicht_query(pze_table: str, pan_table: str) -> SqlTemplate:
     """
-    Queries weight data for all ekps and returns it as a DataFrame
+    Weight classes per ekpnr of the parcels with an event between :start_date and :end_date.
     """
-    logger.info("Starting extraction of parcel weight data")
-
-    pze_table = STATIC_TABLES["pze_table"]
-    pan_table = STATIC_TABLES["pan_table"]
-
-    delta_12_month = pd.to_datetime(monthdelta(-12, reference_date), format="%Y%m", errors="coerce").date()
-    delta_11_month = pd.to_datetime(monthdelta(-11, reference_date), format="%Y%m", errors="coerce").date()
-    delta_n1_month = pd.to_datetime(monthdelta(1, reference_date), format="%Y%m", errors="coerce").date()
-
-    logger.info(f"Dates: +1 month {delta_n1_month}, -11 month {delta_11_month}, -12 month {delta_12_month}")
-
-    log_minmax_date(td, pze_table, "ereignis_datum", logger)
-    log_minmax_date(td, pan_table, "load_dtm", logger)
-
-    def weight_query(start_date, end_date):
-        sql = f"""
+    return SqlTemplate(f"""
              SELECT
                 COALESCE(PAN.ekpnr, PZE.ekpnr) as ekpnr,
                 SUM(PZE.GEWICHT) as gewicht_sum,
@@ -96,7 +64,7 @@ def dwh_paket_gewicht(logger: logging.Logger, files: DwhFiles, reference_date: d
                 FROM
                     {pze_table}
                 WHERE
-                    ereignis_datum BETWEEN DATE '{start_date}' AND DATE '{end_date}'
+                    ereignis_datum BETWEEN :start_date AND :end_date
                     AND GEWICHT > 0
                 qualify row_number() over (partition by SENDUNGS_CODE order by ereignis_datum desc)= 1
             ) AS PZE
@@ -108,50 +76,121 @@ def dwh_paket_gewicht(logger: logging.Logger, files: DwhFiles, reference_date: d
                 FROM
                     {pan_table}
                 WHERE
-                    load_dtm BETWEEN DATE '{start_date}' - INTERVAL '30' DAY AND DATE '{end_date}'
+                    load_dtm BETWEEN CAST(:start_date AS DATE) - INTERVAL '30' DAY AND :end_date
                 qualify row_number() over (partition by SHIPMENT_CODE order by load_dtm desc)= 1
             ) AS PAN
             ON
                 PZE.SENDUNGS_CODE = PAN.SHIPMENT_CODE
             GROUP BY 1
             WHERE COALESCE(PAN.ekpnr, PZE.ekpnr) BETWEEN 5000000000 AND 7000000000
-            """
-        return sql
+            """)
+
+
+def weight_months(reference_date: datetime) -> List[date]:
+    """
+    Starts of the months of the weight query, the 12 months up to the month of reference_date.
+    """
+    delta_11_month = pd.to_datetime(monthdelta(-11, reference_date), format="%Y%m", errors="coerce").date()
+    delta_n1_month = pd.to_datetime(monthdelta(1, reference_date), format="%Y%m", errors="coerce").date()
 
-    dfs_gewicht = []
+    month_starts = []
     start_date = delta_11_month
     end_date = start_date + relativedelta(day=31)
     while end_date < delta_n1_month:
         end_date = start_date + relativedelta(day=31)
-        query = weight_query(start_date=start_date, end_date=end_date)
-        logger.info(query)
-        df_gewicht_month = td.download_table_odbc(query)
-        dfs_gewicht.append(df_gewicht_month)
+        month_starts.append(start_date)
         start_date += relativedelta(months=1)
+    return month_starts
 
-    df_gewicht = pd.concat(dfs_gewicht)
-    normalize_code(df_gewicht, {"ekpnr": 10})
-    df_gewicht["abrnr"] = df_gewicht["ekpnr"]
-    df_gewicht = df_gewicht.drop(columns=["verf", "teiln"])
-    df_prod_gewicht = df_gewicht.groupby(["abrnr", "ekpnr"], as_index=False, dropna=False).sum()
 
-    logger.info(f"\n{df_prod_gewicht.head()}")
-    logger.info(log_df_string(df_prod_gewicht, ["ekpnr"]))
+def preflight_queries(calc_tables: CalculatedTables, reference_date: datetime) -> Dict[str, BoundQuery]:
+    """
+    The Teradata queries of input_dwh, for the pre-flight EXPLAIN.
+    """
+    queries = {f"dwh_{key}": bind(query) for key, query in kundenkonzern_queries().items()}
+    weight_query = paket_gewicht_query(STATIC_TABLES["pze_table"], STATIC_TABLES["pan_table"])
+    for month_start in weight_months(reference_date):
+        queries[f"dwh_paket_gewicht_{month_start:%Y%m}"] = weight_query.bind(
+            start_date=month_start, end_date=month_start + relativedelta(day=31)
+        )
+    return queries
+
+
+@profile_stage()
+def dwh_paket_gewicht(
+    logger: logging.Logger, files: DwhFiles, reference_date: datetime, month_cache: Optional[MonthCache] = None
+) -> pd.DataFrame:
+    """
+    Queries weight data for all ekps and returns it as a DataFrame.
+    With a month_cache only the months not fetched by an earlier reference date are queried.
+    """
+    logger.info("Starting extraction of parcel weight data")
+
+    pze_table = STATIC_TABLES["pze_table"]
+    pan_table = STATIC_TABLES["pan_table"]
+
+    delta_12_month = pd.to_datetime(monthdelta(-12, reference_date), format="%Y%m", errors="coerce").date()
+    delta_11_month = pd.to_datetime(monthdelta(-11, reference_date), format="%Y%m", errors="coerce").date()
+    delta_n1_month = pd.to_datetime(monthdelta(1, reference_date), format="%Y%m", errors="coerce").date()
+
+    logger.info(f"Dates: +1 month {delta_n1_month}, -11 month {delta_11_month}, -12 month {delta_12_month}")
+
+    log_minmax_date(td, pze_table, "ereignis_datum", logger)
+    log_minmax_date(td, pan_table, "load_dtm", logger)
+
+    weight_query = paket_gewicht_query(pze_table, pan_table)
+    month_starts = weight_months(reference_date)
+    months = [month_start.year * 100 + month_start.month for month_start in month_starts]
+
+    def download_months(first_month: int, last_month: int):
+        for month_start, month in zip(month_starts, months):
+            if first_month <= month <= last_month:
+                query = weight_query.bind(start_date=month_start, end_date=month_start + relativedelta(day=31))
+                logger.debug("%s", LazySql(query.render()))
+                yield read_query(query).assign(monat=month)
+
+    def iter_months(first_month: int, last_month: int):
+        if not pipeline_mode:
+            yield from download_months(first_month, last_month)
+            return
+
+        # the next months are downloaded while the caller prepares and sums up the last one
+        yield from Pipeline(pipeline_queue_size, logger, "dwh_paket_gewicht").iterate(
+            download_months(first_month, last_month), []
+        )
+
+    def fetch_months(first_month: int, last_month: int) -> pd.DataFrame:
+        return pd.concat(iter_months(first_month, last_month))
+
+    def prepare_months(dfs_gewicht):
+        for df_gewicht in dfs_gewicht:
+            df_gewicht = df_gewicht.drop(columns=["monat", "verf", "teiln"])
+            normalize_code(df_gewicht, {"ekpnr": 10})
+            df_gewicht["abrnr"] = df_gewicht["ekpnr"]
+            yield df_gewicht
+
+    if month_cache is None:
+        dfs_gewicht = iter_months(months[0], months[-1])
+    else:
+        dfs_gewicht = [month_cache.get("dwh_paket_gewicht", months, fetch_months, "monat")]
+    # the months are summed up without holding their concatenation once it exceeds the memory budget
+    df_prod_gewicht = budget.grouped_sum(prepare_months(dfs_gewicht), ["abrnr", "ekpnr"], name="dwh_paket_gewicht")
+
+    logger.debug("\n%s", LazyDf(df_prod_gewicht))
+    logger.debug("%s", Lazy(log_df_string, df_prod_gewicht, ["ekpnr"]))
 
     save_df(files.df_prod_gewicht, df_prod_gewicht)
 
     return df_prod_gewicht
 
 
-def data_input_kundenkonzern_vertragspartner(logger: logging.Logger, calc_tables: CalculatedTables):
+def kundenkonzern_queries() -> Dict[str, str]:
     """
-    Creates input tables in DWH for kundenkonzern and vertragspartner
+    Defining queries of the kundenkonzern and vertragspartner tables per calc table key.
     """
     kpr_kunde_konzern = STATIC_TABLES["kpr_kunde_konzern"]
     vemo_vertragspartner_table = STATIC_TABLES["vemo_vertragspartner"]
 
-    log_minmax_date(td, vemo_vertragspartner_table, "gueltig_von", logger)
-
     query_kunde_konzern = f"""
         SELECT DISTINCT ag_ekp,
             ag_name,
@@ -171,12 +210,33 @@ def data_input_kundenkonzern_vertragspartner(logger: logging.Logger, calc_tables
             (partition by ekpnr, vbeln, posnr order by gueltig_von desc, gueltig_bis desc) = 1)
         """
 
-    query_dict = {"vemo_kunde_konzern": query_kunde_konzern, "vemo_vertragspartner": query_vemo_vertragspartner}
+    return {"vemo_kunde_konzern": query_kunde_konzern, "vemo_vertragspartner": query_vemo_vertragspartner}
+
+
+@profile_stage()
+def data_input_kundenkonzern_vertragspartner(logger: logging.Logger, calc_tables: CalculatedTables):
+    """
+    Creates input tables in DWH for kundenkonzern and vertragspartner
+    """
+    vemo_vertragspartner_table = STATIC_TABLES["vemo_vertragspartner"]
+
+    log_minmax_date(td, vemo_vertragspartner_table, "gueltig_von", logger)
+
+    query_dict = kundenkonzern_queries()
+    # tables with a freshness column in their source are only rebuilt if query or source data changed
+    watermark_sources = {"vemo_vertragspartner": {vemo_vertragspartner_table: "gueltig_von"}}
 
     for key in query_dict:
         table = calc_tables.get_table(key)
         query = query_dict[key]
-        create_table(td, table, query, calc_tables.get_index(key), logger)
-        logger.info(query)
+        tuning = {"statistics": calc_tables.get_statistics(key), "index_candidates": calc_tables.get_index_candidates(key)}
+        if key in watermark_sources:
+            watermarks = get_source_watermarks(td, watermark_sources[key], logger)
+            create_table(
+                td, table, query, calc_tables.get_index(key), logger, skip_unchanged=True, watermarks=watermarks, **tuning
+            )
+        else:
+            create_table(td, table, query, calc_tables.get_index(key), logger, **tuning)
+        logger.debug("%s", LazySql(query))
         log_table_shape(td, table, logger)
         log_table_sample(td, table, logger)
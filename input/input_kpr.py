@@ -1,13 +1,20 @@
 import datetime 
 import logging
 from dataclasses import asdict
+from typing import Dict, List, Optional
 
 import pandas as pd
 
+from src.calculation.calc_constants import PRODUKT_ID_MAPPING
 from src.utils.dwh_tables import STATIC_TABLES, CalculatedTables
 from src.utils.dwh_utils import log_minmax_date
+from src.utils.exclusion import anti_join_sql
 from src.utils.files import KprFiles
-from src.utils.td_connector import td
+from src.utils.hana_loader import load_delta
+from src.utils.month_cache import MonthCache, month_range
+from src.utils.profiling import profile_stage
+from src.utils.sql_templates import BoundQuery, SqlTemplate
+from src.utils.td_connector import read_query
 from src.utils.utils import log_df_string, monthdelta, normalize_code, read_df, save_df, cast_types
 
 KPR_COLUMN_TYPES = {
@@ -54,16 +61,72 @@ def input_kpr(
     calc_tables: CalculatedTables,
     reference_date: datetime.datetime,
     product: str,
+    month_cache: Optional[MonthCache] = None,
 ) -> None:
     logger.info("Starting KPR data input...")
     kpr_rv_ekpnr_mapping(kpr_files=kpr_files, reference_date=reference_date)
-    kpr_kosten(logger, kpr_files=kpr_files, calc_tables=calc_tables, reference_date=reference_date, product=product)
+    df_costs_report15 = kpr_kosten(
+        logger,
+        kpr_files=kpr_files,
+        calc_tables=calc_tables,
+        reference_date=reference_date,
+        product=product,
+        month_cache=month_cache,
+    )
+    insert_kpr_costs_into_hana(logger, df_costs_report15, product)
     kpr_kosten_merge(logger, kpr_files, product=product)
     kpr_treiber(logger, kpr_files=kpr_files, calc_tables=calc_tables, reference_date=reference_date, product=product)
     kpr_zustellung(logger, kpr_files=kpr_files, calc_tables=calc_tables, product=product, reference_date=reference_date)
     logger.info("Finished KPR data input.")
 
 
+def input_kpr_multi_product(
+    logger: logging.Logger,
+    kpr_files: Dict[str, KprFiles],
+    calc_tables: CalculatedTables,
+    reference_date: datetime.datetime,
+) -> None:
+    """
+    KPR data input for several products at once. The KPR cost views are scanned once for all products
+    and the results are split per product client-side, kpr_files holds the files of every product.
+    """
+    logger.info(f"Starting KPR data input for products {list(kpr_files)}...")
+    mapping_rv_abrnr = _download_rv_abrnr_mapping(reference_date=reference_date)
+    for files in kpr_files.values():
+        save_df(files.df_mapping_rv_abrnr, mapping_rv_abrnr)
+
+    dfs_costs = kpr_kosten_multi_product(
+        logger, kpr_files=kpr_files, calc_tables=calc_tables, reference_date=reference_date
+    )
+    for product, df_costs_report15 in dfs_costs.items():
+        insert_kpr_costs_into_hana(logger, df_costs_report15, product)
+    kpr_zustellung_multi_product(logger, kpr_files=kpr_files, reference_date=reference_date)
+    for product, files in kpr_files.items():
+        kpr_kosten_merge(logger, files, product=product)
+        kpr_treiber(logger, kpr_files=files, calc_tables=calc_tables, reference_date=reference_date, product=product)
+    logger.info("Finished KPR data input.")
+
+
+def product_ids(products) -> List[int]:
+    """
+    Returns the KPR produkt_ids of one or several products, bound to an IN clause.
+    """
+    products = [products] if isinstance(products, str) else products
+    return [int(i) for product in products for i in PRODUKT_ID_MAPPING[product.lower()]]
+
+
+def split_by_product(df: pd.DataFrame, products: List[str], group_cols: List[str]) -> Dict[str, pd.DataFrame]:
+    """
+    Splits a result with produkt_id column into one frame per product, summed over the product's ids.
+    """
+    dfs = {}
+    for product in products:
+        df_product = df[df["produkt_id"].astype(int).isin(PRODUKT_ID_MAPPING[product.lower()])]
+        dfs[product] = df_product.drop(columns="produkt_id").groupby(group_cols, as_index=False, dropna=False).sum()
+    return dfs
+
+
+@profile_stage()
 def kpr_rv_ekpnr_mapping(
     kpr_files: KprFiles,
     reference_date: datetime.datetime,
@@ -72,111 +135,154 @@ def kpr_rv_ekpnr_mapping(
     save_df(kpr_files.df_mapping_rv_abrnr, mapping_rv_abrnr)
 
 
-def _download_rv_abrnr_mapping(reference_date: datetime.date) -> pd.DataFrame:
-    mapping_sql = f"""SELECT RV_NR as rahmenvertrag,
+RV_ABRNR_MAPPING_SQL = SqlTemplate(f"""SELECT RV_NR as rahmenvertrag,
                                     LEFT(AB_NR, 10) as ekpnr,
                                     AB_NR as abrnr,
                                     RV_Name as kundenname
                             FROM {STATIC_TABLES["kpr_rv"]}
-                            WHERE RV_BEGIN <= {reference_date.strftime("%Y%m%d")}
-                                and RV_ENDE >= {reference_date.strftime("%Y%m%d")}
-    """
-    return td.download_table_odbc(mapping_sql)
+                            WHERE RV_BEGIN <= :reference_day
+                                and RV_ENDE >= :reference_day
+    """)
+
+
+def rv_abrnr_mapping_query(reference_date: datetime.date) -> BoundQuery:
+    return RV_ABRNR_MAPPING_SQL.bind(reference_day=int(reference_date.strftime("%Y%m%d")))
 
 
+def _download_rv_abrnr_mapping(reference_date: datetime.date) -> pd.DataFrame:
+    return read_query(rv_abrnr_mapping_query(reference_date))
+
+
+@profile_stage()
 def kpr_kosten(
     logger: logging.Logger,
     kpr_files: KprFiles,
     calc_tables: CalculatedTables,
     reference_date: datetime.datetime,
     product: str,
-):
+    month_cache: Optional[MonthCache] = None,
+) -> pd.DataFrame:
     """
     Queries KPR data and saves it to dataframes in the output location for KPR files.
     Different products can be specified, e.g., "Paket" or "Warenpost".
+    With a month_cache the costs are fetched per month and only the months not cached yet are queried.
+    Returns the costs, the caller loads them into HANA (see insert_kpr_costs_into_hana).
     """
-    product_id = "1" if product.lower() == "paket" else "34, 35"
+    product_id = product_ids(product)
     month_now = monthdelta(0, reference_date)
     delta_1_month = monthdelta(-1, reference_date)
     delta_6_month = monthdelta(-6, reference_date)
     delta_12_month = monthdelta(-12, reference_date)
 
     logger.info(f"Processing KPR costs for dates: now {month_now}, -1 month {delta_1_month}, -6 month {delta_6_month}, -12 month {delta_12_month}")
-    query_costs_report15 = get_query_costs_report15(delta_12_month, delta_1_month, product_id, calc_tables)
-
-    # Execute queries
-    df_costs_report15 = execute_kpr_queries(logger, kpr_files, product, query_costs_report15)
-
-    # Start of Abhijeet: Inserting the KPR costs data into HANA Cloud
-    if df_costs_report15 is not None and not df_costs_report15.empty:
-        logger.info("Inserting KPR data from DataFrame into HANA Cloud...")
-        try:
-            connection = connect_to_hana()  #  connect_to_hana is available in  utils
-            cursor = connection.cursor()
-
-            # Assuming your HANA table has corresponding columns to your DataFrame
-            sql = """
-                INSERT INTO KPR_HANA_TABLE (ekpnr, Prozessmenge, Fixkosten, Varkosten, ...)
-                VALUES (?, ?, ?, ?, ...)
-            """
-
-            # Map the DataFrame to tuples for insertion
-            data_to_insert = [
-                (
-                    row['ekpnr'], row['Prozessmenge'], row['Fixkosten'], row['Varkosten'], ...
-                )
-                for index, row in df_costs_report15.iterrows()
-            ]
-            
-
-            # Execute the insert statement with the DataFrame data
-            cursor.executemany(sql, data_to_insert)
-            connection.commit()
-
-            logger.info(f"Inserted {len(data_to_insert)} rows into HANA Cloud.")
-        except Exception as e:
-            logger.error(f"Error inserting KPR data into HANA Cloud: {str(e)}")
-        finally:
-            cursor.close()
-            connection.close()
+    if month_cache is None:
+        query_costs_report15 = get_query_costs_report15(delta_12_month, delta_1_month, product_id, calc_tables)
+
+        # Execute queries
+        df_costs_report15 = execute_kpr_queries(logger, kpr_files, product, query_costs_report15)
     else:
-        logger.warning("DataFrame is empty. No data to insert into HANA Cloud.")
-    
-    # End of Abhijeet
+        df_costs_month = month_cache.get(
+            f"kpr_kosten_{product.lower()}",
+            month_range(delta_12_month, delta_1_month),
+            lambda first, last: read_query(
+                get_query_costs_report15(first, last, product_id, calc_tables, by_month=True)
+            ),
+            "monat",
+        )
+        df_costs_report15 = df_costs_month.drop(columns="monat").groupby(
+            ["abrnr", "ekpnr", "prozessebene_id"], as_index=False, dropna=False
+        ).sum()
+        df_costs_report15 = save_costs_report15(kpr_files, df_costs_report15)
 
+    return df_costs_report15
 
-def get_query_costs_report15(since_month, until_month, product_id, calc_tables) -> str:
-    return f"""
+
+def insert_kpr_costs_into_hana(logger: logging.Logger, df_costs_report15: pd.DataFrame, product: str) -> None:
+    # Only the KPR costs changed since the last run are sent to HANA Cloud
+    load_delta(
+        logger,
+        df_costs_report15,
+        "KPR_HANA_TABLE",
+        key_cols=["abrnr", "prozessebene_id"],
+        partition={"produkt": product.lower()},
+    )
+
+
+@profile_stage()
+def kpr_kosten_multi_product(
+    logger: logging.Logger,
+    kpr_files: Dict[str, KprFiles],
+    calc_tables: CalculatedTables,
+    reference_date: datetime.datetime,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Queries the KPR costs of all products in kpr_files with one query and saves them per product.
+    Returns the costs per product.
+    """
+    products = list(kpr_files)
+    delta_1_month = monthdelta(-1, reference_date)
+    delta_12_month = monthdelta(-12, reference_date)
+    query = get_query_costs_report15(
+        delta_12_month, delta_1_month, product_ids(products), calc_tables, by_product=True
+    )
+    df_costs = read_query(query)
+    logger.info(f"KPR costs report for products {products} fetched with shape {df_costs.shape}.")
+
+    dfs_costs = split_by_product(df_costs, products, ["abrnr", "ekpnr", "prozessebene_id"])
+    return {
+        product: save_costs_report15(kpr_files[product], df_costs_report15)
+        for product, df_costs_report15 in dfs_costs.items()
+    }
+
+
+def get_query_costs_report15(
+    since_month, until_month, product_id, calc_tables, by_product=False, by_month=False
+) -> BoundQuery:
+    """
+    KPR costs per abrnr and prozessebene, with by_product additionally split by produkt_id
+    and with by_month by monat. The months and produkt_ids are bound, the text only depends on the split.
+    """
+    split_cols = (["TMP.produkt_id"] if by_product else []) + (["TMP.Monat as monat"] if by_month else [])
+    group_by = ",".join(str(i) for i in range(1, 4 + len(split_cols)))
+    return SqlTemplate(f"""
         SELECT
             TMP.abr as abrnr,
             substr(TMP.abr,1,10) as ekpnr,
             TMP.prozessebene_id,
+            {"".join(f"{col}," for col in split_cols)}
             sum(TMP.pmenge) Prozessmenge,
             sum(TMP.fix_kosten) Fixkosten,
             sum(TMP.var_kosten) Varkosten
         FROM
         (
-            SELECT abr, prozessebene_id, pmenge, fix_kosten, var_kosten
-            FROM {STATIC_TABLES["kpr_kosten"]}
-            WHERE (Monat between '{since_month}' and '{until_month}')
-                and produkt_id in ({product_id})
-                and abr not in (sel abrnr from {calc_tables.get_table("kt_abr_aktionsgeschaeft")} where abrnr is not null)
+            SELECT abr, prozessebene_id, produkt_id, Monat, pmenge, fix_kosten, var_kosten
+            FROM {STATIC_TABLES["kpr_kosten"]} AS kk
+            WHERE (Monat between :since_month and :until_month)
+                and produkt_id in (:product_id)
+                and abr is not null
+                and {anti_join_sql(calc_tables.get_table("kt_abr_aktionsgeschaeft"), "kk.abr")}
         ) AS TMP
-        GROUP BY 1,2,3
-    """
+        GROUP BY {group_by}
+    """).bind(since_month=str(since_month), until_month=str(until_month), product_id=product_id)
 
 
+@profile_stage()
 def execute_kpr_queries(logger, kpr_files, product, query_costs_report15) -> pd.DataFrame:
     """
     Execute the main KPR queries and store the results in relevant dataframes.
     """
-    df_costs_report15 = td.download_table_odbc(query_costs_report15)
+    df_costs_report15 = read_query(query_costs_report15)
     logger.info(f"KPR costs report for product '{product}' fetched successfully.")
+    return save_costs_report15(kpr_files, df_costs_report15)
+
+
+def save_costs_report15(kpr_files: KprFiles, df_costs_report15: pd.DataFrame) -> pd.DataFrame:
     cast_types(df_costs_report15, KPR_COLUMN_TYPES)
     save_df(kpr_files.df_kpr_costs_report15, df_costs_report15)
     return df_costs_report15
 
 
+@profile_stage()
 def kpr_kosten_merge(logger: logging.Logger, files: KprFiles, product: str):
     """
     Merges KPR data into a single dataframe and saves it.
@@ -188,22 +294,26 @@ def kpr_kosten_merge(logger: logging.Logger, files: KprFiles, product: str):
     save_df(files.df_kpr_kosten, df_kpr_kosten)
 
 
+@profile_stage()
 def kpr_treiber(logger: logging.Logger, kpr_files: KprFiles, calc_tables: CalculatedTables, product: str, reference_date: datetime.datetime):
     """
     Queries the KPR treiber data and saves it to CSV.
     """
     logger.info("Processing KPR treiber data...")
     delta_1_month = monthdelta(-1, reference_date)
-    kpr_treiber_table = STATIC_TABLES["kpr_treiber"] if product.lower() == "paket" else STATIC_TABLES["kpr_treiber_wapo"]
-    query = get_kpr_treiber_query(kpr_treiber_table, delta_1_month)
+    query = get_kpr_treiber_query(treiber_table(product), delta_1_month)
     
-    df_kpr_treiber = td.download_table_odbc(query)
+    df_kpr_treiber = read_query(query)
     logger.info(f"KPR treiber data fetched successfully with shape: {df_kpr_treiber.shape}")
     save_df(kpr_files.df_kpr_treiber, df_kpr_treiber)
 
 
-def get_kpr_treiber_query(treiber_table, delta_1_month):
-    return f"""
+def treiber_table(product: str) -> str:
+    return STATIC_TABLES["kpr_treiber"] if product.lower() == "paket" else STATIC_TABLES["kpr_treiber_wapo"]
+
+
+def get_kpr_treiber_query(treiber_table, delta_1_month) -> BoundQuery:
+    return SqlTemplate(f"""
         SELECT
             SUBSTR(abr,1,10) as ekpnr,
             abr as abrnr,
@@ -213,34 +323,73 @@ def get_kpr_treiber_query(treiber_table, delta_1_month):
             NULLIFZERO( SUM( CASE WHEN volumen IS NOT NULL THEN absatz ELSE 0 END ) ) as Absatz,
             SUM(ZEROIFNULL(absatz)) Menge
         FROM {treiber_table}
-        WHERE ( monat <= '{delta_1_month}' )
+        WHERE ( monat <= :until_month )
         GROUP BY 1, 2, 3
-    """
+    """).bind(until_month=str(delta_1_month))
 
 
+@profile_stage()
 def kpr_zustellung(logger: logging.Logger, kpr_files: KprFiles, calc_tables: CalculatedTables, product: str, reference_date: datetime.datetime):
     """
     Queries KPR zustellung data and saves it to CSV.
     """
     logger.info("Processing KPR zustellung data...")
-    query = get_kpr_zustellung_query(product, reference_date)
-    df_kpr_zustellung = td.download_table_odbc(query)
+    query = get_kpr_zustellung_query(product_ids(product), reference_date)
+    df_kpr_zustellung = read_query(query)
 
     logger.info(f"KPR zustellung data fetched with shape: {df_kpr_zustellung.shape}")
     save_df(kpr_files.df_kpr_zustellung, df_kpr_zustellung)
 
 
-def get_kpr_zustellung_query(product, reference_date):
+@profile_stage()
+def kpr_zustellung_multi_product(
+    logger: logging.Logger, kpr_files: Dict[str, KprFiles], reference_date: datetime.datetime
+):
+    """
+    Queries KPR zustellung data of all products in kpr_files with one query and saves it per product.
+    """
+    products = list(kpr_files)
+    query = get_kpr_zustellung_query(product_ids(products), reference_date, by_product=True)
+    df_kpr_zustellung = read_query(query)
+
+    logger.info(f"KPR zustellung data for products {products} fetched with shape: {df_kpr_zustellung.shape}")
+    for product, df in split_by_product(df_kpr_zustellung, products, ["abrnr", "ekpnr"]).items():
+        save_df(kpr_files[product].df_kpr_zustellung, df)
+
+
+def get_kpr_zustellung_query(product_id, reference_date, by_product=False) -> BoundQuery:
     delta_1_month = monthdelta(-1, reference_date)
     delta_12_month = monthdelta(-12, reference_date)
 
-    return f"""
+    return SqlTemplate(f"""
         SELECT
             abrnr,
             SUBSTR(abrnr,1,10) as ekpnr,
+            {"Produkt_id as produkt_id," if by_product else ""}
             SUM(CASE WHEN prozessstufe_id=6 THEN pmenge ELSE 0 END) as RZ
         FROM {STATIC_TABLES["kpr_kosten_drop"]}
-        WHERE monat BETWEEN '{delta_12_month}' AND '{delta_1_month}'
-            AND Produkt_id in ({'1' if product.lower() == 'paket' else '34,35'})
-        GROUP BY abrnr
+        WHERE monat BETWEEN :since_month AND :until_month
+            AND Produkt_id in (:product_id)
+        GROUP BY abrnr{", Produkt_id" if by_product else ""}
+    """).bind(since_month=str(delta_12_month), until_month=str(delta_1_month), product_id=product_id)
+
+
+def preflight_queries(
+    calc_tables: CalculatedTables, reference_date: datetime.datetime, products: List[str]
+) -> Dict[str, BoundQuery]:
+    """
+    The Teradata queries of input_kpr, for the pre-flight EXPLAIN. Several products share the cost and
+    zustellung queries like in input_kpr_multi_product.
     """
+    by_product = len(products) > 1
+    delta_1_month = monthdelta(-1, reference_date)
+    queries = {
+        "kpr_rv_abrnr_mapping": rv_abrnr_mapping_query(reference_date),
+        "kpr_kosten": get_query_costs_report15(
+            monthdelta(-12, reference_date), delta_1_month, product_ids(products), calc_tables, by_product=by_product
+        ),
+        "kpr_zustellung": get_kpr_zustellung_query(product_ids(products), reference_date, by_product=by_product),
+    }
+    for product in products:
+        queries[f"kpr_treiber_{product.lower()}"] = get_kpr_treiber_query(treiber_table(product), delta_1_month)
+    return queries
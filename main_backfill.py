@@ -0,0 +1,16 @@
+# import sys
+# sys.path.insert(0, "./")
+import argparse
+from datetime import date
+
+from src.app_paket import run_backfill
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the pipeline for a range of reference dates")
+    parser.add_argument("first_date", type=date.fromisoformat, help="first reference date, e.g. 2023-06-01")
+    parser.add_argument("last_date", type=date.fromisoformat, help="last reference date, e.g. 2024-05-01")
+    parser.add_argument("--product", default="paket")
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    run_backfill(args.first_date, args.last_date, product=args.product, max_workers=args.max_workers)
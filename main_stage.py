@@ -0,0 +1,52 @@
+# import sys
+# sys.path.insert(0, "./")
+import argparse
+from datetime import date
+from pathlib import Path
+
+from src.app_paket import STAGES, run_chain, run_stage
+from src.project_path import DATA_ROOT_FOLDER
+from src.run_config import reference_date
+
+
+def _artifact(value: str):
+    ref, sep, path = value.partition("=")
+    if not sep or "." not in ref:
+        raise argparse.ArgumentTypeError(f"expected <container>.<artifact>=<path>, got {value}")
+    return ref, path
+
+
+def _add_common_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--product", default="paket")
+    parser.add_argument("--reference-date", type=date.fromisoformat, default=reference_date)
+    parser.add_argument("--data-root", type=Path, default=DATA_ROOT_FOLDER)
+    parser.add_argument(
+        "--artifact",
+        type=_artifact,
+        action="append",
+        default=[],
+        help="overrides an artifact path, e.g. dwh.df_prod_gewicht=/mnt/shared/df_prod_gewicht.parquet",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs single stages of the pipeline, e.g. as separate containers")
+    subparsers = parser.add_subparsers(dest="stage", required=True)
+    for name, stage in STAGES.items():
+        stage_parser = subparsers.add_parser(
+            name, help=f"inputs {', '.join(stage.inputs) or '-'}; outputs {', '.join(stage.outputs) or '-'}"
+        )
+        _add_common_args(stage_parser)
+    chain_parser = subparsers.add_parser("chain", help="runs stages locally as a chain of subprocesses")
+    chain_parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    _add_common_args(chain_parser)
+    args = parser.parse_args()
+
+    if args.stage == "chain":
+        stage_args = ["--product", args.product, "--reference-date", args.reference_date.isoformat()]
+        stage_args += ["--data-root", str(args.data_root)]
+        for ref, path in args.artifact:
+            stage_args += ["--artifact", f"{ref}={path}"]
+        run_chain(stage_args, args.stages)
+    else:
+        run_stage(args.stage, args.product, args.reference_date, args.data_root, dict(args.artifact))
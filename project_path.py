@@ -11,3 +11,7 @@ PROJECT_ROOT_FOLDER_NAME = _project_root.stem
 
 DATA_ROOT_FOLDER = Path(f"/team/development/pricing/{run_name}")
 GENERAL_DATA = DATA_ROOT_FOLDER / "general"
+# snapshots of the data loaded into HANA, shared between runs to load only the changes
+HANA_SNAPSHOTS = DATA_ROOT_FOLDER.parent / "hana_snapshots"
+# performance of every run per stage and query, shared between runs to detect regressions
+PERF_HISTORY = DATA_ROOT_FOLDER.parent / "perf_history"
@@ -9,6 +9,79 @@ run_name = "ship2profile_202407_kalknr"
 
 frozen_zone = pd.to_datetime(reference_date + relativedelta(months=-3), format="%Y-%m-%d")
 
+# database access: "live", "record" (live, all results stored) or "replay" (recorded results, no database needed)
+db_backend_mode = "live"
+# latency in seconds added to every replayed query
+db_replay_latency_s = 0.0
+
+# execution backend of the heavy calc steps: "pandas" or "duckdb" (out-of-core, multi-threaded)
+calc_backend = "pandas"
+duckdb_memory_limit = "16GB"
+# spill directory of duckdb, None uses the duckdb default
+duckdb_temp_directory = None
+
+# memory budget of the large intermediates in GB, operations estimated above it run on hash partitions spilled
+# to disk; None keeps everything in memory
+memory_budget_gb = None
+# spill directory, None uses the system temp directory
+memory_spill_directory = None
+memory_spill_partitions = 16
+
+# the calc stages split their input by a hash of ekpnr/abrnr into this many shards run in parallel processes,
+# 1 runs them in the main process; inputs below calc_shard_min_rows are never sharded
+calc_shards = 1
+calc_shard_min_rows = 100_000
+
+# overlap database fetches, transformations and HANA writes in an asyncio pipeline
+pipeline_mode = False
+# chunks waiting between two pipeline steps, bounds the memory of the pipeline
+pipeline_queue_size = 2
+
+# create the HANA target tables with compact column types and partitioning before loading, and widen their
+# columns when new values do not fit (see utils/hana_schema.py); columns are never narrowed or dropped
+hana_manage_schema = True
+
+# after every HANA load compare row counts, key checksums and column sums per key range of the table with the
+# loaded data in one aggregate query (and the Teradata tmp tables with their downloads), see utils/reconciliation.py
+reconcile_loads = True
+reconcile_buckets = 32
+
+# before a run all its Teradata queries are EXPLAINed and the estimates checked against these budgets (None
+# disables a budget): "warn" logs queries over budget, "refuse" stops the run before any work, "off" skips the
+# pre-flight, see utils/preflight.py
+preflight_mode = "warn"
+preflight_max_rows = 500_000_000
+preflight_max_spool_gb = 200
+preflight_max_seconds = 3600
+preflight_max_run_seconds = 4 * 3600
+
+# every run adds duration, rows, bytes and peak memory per stage and query to the performance history (see
+# utils/perf_history.py); a measure is flagged as a regression when its z score against the last
+# perf_history_window runs exceeds perf_regression_z and it grew by perf_regression_min_ratio, or when the window
+# shows a significant growth (slope t statistic above perf_trend_t) of more than perf_trend_min_growth per run
+perf_history_window = 10
+perf_min_runs = 4
+perf_regression_z = 3.0
+perf_regression_min_ratio = 1.2
+perf_trend_t = 3.0
+perf_trend_min_growth = 0.02
+
+# bind the parameters of template queries over a pyodbc session (one cached plan per template), otherwise they
+# are inlined as literals for pda's download_table_odbc
+td_bind_parameters = True
+
+# "rows" fetches results as Python rows (pda/pyodbc), "arrow" column-wise into Arrow batches via arrow-odbc
+td_fetch_mode = "rows"
+
+# level of the run loggers, with "INFO" the queries, samples and df summaries logged at DEBUG are not rendered
+log_level = "DEBUG"
+
+# created tables with a primary index skew factor (1 - avg/max rows per AMP) above this get an index advice
+pi_max_skew_factor = 0.3
+
+# queries running longer than this are written to the slow query log
+slow_query_threshold_s = 300
+
 td_config = {
     "driver": "{/opt/teradata/client/ODBC_64/lib/tdataodbc_sb64.so}",
     "dbcname": "tdprd",
@@ -0,0 +1,25 @@
+import pytest
+
+from src.utils.async_pipeline import Pipeline
+
+
+def months(n_months: int, fail_at: int = -1):
+    for month in range(n_months):
+        if month == fail_at:
+            raise ValueError("fetch failed")
+        yield month
+
+
+def test_iterate_yields_transformed_chunks_in_order():
+    assert list(Pipeline(2).iterate(months(10), [lambda month: month * 2])) == list(range(0, 20, 2))
+
+
+def test_iterate_raises_source_errors():
+    with pytest.raises(ValueError, match="fetch failed"):
+        list(Pipeline(2).iterate(months(10, fail_at=3), []))
+
+
+def test_iterate_stops_when_closed():
+    chunks = Pipeline(1).iterate(months(1_000), [])
+    assert next(chunks) == 0
+    chunks.close()
@@ -0,0 +1,64 @@
+import logging
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("duckdb")
+
+from src.benchmark.synthetic_data import SyntheticData
+from src.calculation import calc_abrechungsnr, calc_duckdb, calc_fibu_presliste, calc_weight_distribution
+from src.utils.exclusion import AbrnrExclusion
+from src.utils.files import CalculatedFiles, DwhFiles, KprFiles, SapFiles
+from src.utils.utils import read_df, save_df
+
+logger = logging.getLogger("test_calc_backends")
+
+
+@pytest.fixture(scope="module")
+def synthetic(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("synthetic")
+    files = {
+        "kpr": KprFiles(in_data_path=None, df_data_path=str(folder)),
+        "dwh": DwhFiles(in_data_path="", df_data_path=str(folder)),
+        "calc": CalculatedFiles(in_data_path="", df_data_path=str(folder)),
+        "sap": SapFiles(in_data_path="", df_data_path=str(folder / "sap")),
+    }
+    base_data_path = SyntheticData(scale=0.2).write(files["kpr"], files["dwh"], files["calc"], files["sap"])
+    files["base_data"] = read_df(base_data_path)
+    # the DWH extract keys the weights by ekpnr, give them an abrnr of the mapping so the preparation keeps rows
+    df_mapping = read_df(files["calc"].df_mapping).drop_duplicates("ekpnr")
+    df_prod_gewicht = read_df(files["dwh"].df_prod_gewicht).drop(columns="abrnr")
+    df_prod_gewicht = df_prod_gewicht.merge(df_mapping[["ekpnr", "abrnr"]], on="ekpnr")
+    save_df(files["dwh"].df_prod_gewicht, df_prod_gewicht)
+    files["folder"] = folder
+    return files
+
+
+def assert_equal(df_pandas: pd.DataFrame, df_duckdb: pd.DataFrame):
+    assert len(df_pandas) > 0
+    pd.testing.assert_frame_equal(
+        df_pandas.reset_index(drop=True), df_duckdb.reset_index(drop=True), check_dtype=False, check_exact=False, rtol=1e-6
+    )
+
+
+def test_pivot_months_to_cols(synthetic):
+    df_base = synthetic["base_data"]
+    assert_equal(calc_abrechungsnr.pivot_months_to_cols(df_base), calc_duckdb.pivot_months_to_cols(df_base))
+
+
+def test_prod_gewicht_preparation(synthetic):
+    duckdb_output = str(synthetic["folder"] / "df_prod_gewicht_prepared_duckdb.parquet")
+    calc_weight_distribution.prod_gewicht_preparation(logger, synthetic["dwh"], synthetic["calc"])
+    calc_duckdb.prod_gewicht_preparation(logger, synthetic["dwh"], synthetic["calc"], output_path=duckdb_output)
+    assert_equal(read_df(synthetic["calc"].df_prod_gewicht_prepared), read_df(duckdb_output))
+
+
+def test_fibu_preisliste_unique(synthetic):
+    df_fibu = read_df(synthetic["sap"].df_fibu_excl_a)
+    df_mapping = read_df(synthetic["calc"].df_mapping)
+    kleinpaket = AbrnrExclusion.from_frame(read_df(synthetic["sap"].df_kt_abr_kleinpaket))
+    results = [
+        calc_fibu_presliste.fibu_preisliste_unique(df_fibu, df_mapping, kleinpaket, "paket", logger, backend=backend)
+        for backend in ("pandas", "duckdb")
+    ]
+    assert_equal(*results)
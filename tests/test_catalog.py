@@ -0,0 +1,46 @@
+import multiprocessing
+
+import pandas as pd
+import pytest
+
+from src.utils.catalog import Catalog, artifact_exists, catalog_for, copy_artifact
+from src.utils.files import GeneralFiles
+from src.utils.utils import save_df
+
+
+def _save_artifacts(folder: str, worker: int) -> None:
+    for i in range(20):
+        save_df(f"{folder}/df_worker{worker}_{i}.parquet", pd.DataFrame({"ekpnr": [str(i)]}))
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_record_from_parallel_processes(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_save_artifacts, args=(str(tmp_path), worker)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(Catalog(tmp_path).names()) == 80
+
+
+def test_copy_artifact_keeps_entry(tmp_path):
+    (tmp_path / "a").mkdir()
+    source, target = tmp_path / "df_prod_gewicht.parquet", tmp_path / "a" / "df_prod_gewicht.parquet"
+    save_df(source, pd.DataFrame({"ekpnr": ["1", "2"]}))
+    copy_artifact(source, target)
+    assert artifact_exists(target)
+    assert catalog_for(target).get(target)["checksum"] == catalog_for(source).get(source)["checksum"]
+
+
+def test_input_files_resolved_from_catalog(tmp_path):
+    save_df(tmp_path / "geo_distance_dhl_2024.parquet", pd.DataFrame({"plz": ["53113"]}))
+    files = GeneralFiles(in_data_path=str(tmp_path), df_data_path=str(tmp_path))
+    assert files.geo_distance == str(tmp_path / "geo_distance_dhl_2024.parquet")
+
+
+def test_input_files_not_in_catalog_found_on_disk(tmp_path):
+    save_df(tmp_path / "other.parquet", pd.DataFrame({"plz": ["53113"]}))
+    (tmp_path / "geo_distance_dhl.parquet").touch()
+    files = GeneralFiles(in_data_path=str(tmp_path), df_data_path=str(tmp_path))
+    assert files.geo_distance == str(tmp_path / "geo_distance_dhl.parquet")
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from src.utils.df_profile import HLL_PRECISION, hash_key, hll_estimate, hll_update, profile_df
+from src.utils.utils import log_df_string
+
+
+def _frame(n_rows: int, n_keys: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "ekpnr": (rng.integers(0, n_keys, n_rows) + 5_000_000_000).astype(str),
+        "verfa": rng.choice(["01", "62"], n_rows),
+        "menge": rng.random(n_rows),
+    })
+
+
+def test_hll_estimate_close_to_exact():
+    df = _frame(200_000, 50_000)
+    registers = np.zeros((1, 1 << HLL_PRECISION), dtype=np.uint8)
+    hll_update(registers, hash_key(df, "ekpnr"), np.zeros(len(df), dtype=np.int64))
+    exact = df["ekpnr"].nunique()
+    assert abs(hll_estimate(registers)[0] - exact) / exact < 0.03
+
+
+def test_hll_small_cardinality_exact():
+    df = pd.DataFrame({"abrnr": ["1", "2", "3", "2", "1"]})
+    assert profile_df(df, keys=["abrnr"]).distinct["abrnr"] == 3
+
+
+def test_profile_composite_key_and_groups():
+    df = _frame(50_000, 5_000)
+    df.loc[::10, "verfa"] = None
+    profile = profile_df(df, keys=["ekpnr", ("ekpnr", "verfa")], by="verfa", by_values=["01", "62"])
+
+    assert profile.shape == df.shape
+    assert profile.null_rate["verfa"] == df["verfa"].isna().mean()
+    # rows with a null in a key column are not counted as a distinct key tuple
+    exact = len(df.dropna(subset=["verfa"]).drop_duplicates(["ekpnr", "verfa"]))
+    assert abs(profile.distinct["ekpnr+verfa"] - exact) / exact < 0.03
+    for value in ("01", "62"):
+        df_group = df[df["verfa"] == value]
+        group = profile.groups[value]
+        assert group.shape == (len(df_group), df.shape[1])
+        assert abs(group.distinct["ekpnr"] - df_group["ekpnr"].nunique()) / df_group["ekpnr"].nunique() < 0.03
+
+
+def test_profile_quantiles():
+    df = _frame(10_000, 100)
+    profile = profile_df(df, quantile_cols=["menge"], quantiles=(0.5,))
+    assert profile.quantiles["menge"][0.5] == df["menge"].quantile(0.5)
+
+
+def test_log_df_string_exact_for_small_frames():
+    df = pd.DataFrame({"ekpnr": ["1", "1", "2", None], "verfa": ["01", "62", "01", "01"]})
+    assert log_df_string(df, ["ekpnr", ("ekpnr", "verfa")], "df_kosten") == (
+        "df_kosten shape (4, 2) | unique 'ekpnr': 2 | unique 'ekpnr'+'verfa': 3"
+    )
@@ -0,0 +1,54 @@
+import logging
+
+import pandas as pd
+
+from src.utils.dwh_tables import CalculatedTables
+from src.utils.dwh_utils import FINGERPRINT_PREFIX, create_table, table_fingerprint
+
+logger = logging.getLogger("test_dwh_utils")
+
+QUERY = "SELECT abrnr, jahr_monat FROM DBX_DWH_SBX_GB30_PRD.stp_monthly_volume"
+
+
+class _RecordingTd:
+    """
+    Teradata session recording the executed statements, the table comment is returned as stored fingerprint.
+    """
+
+    def __init__(self, comment=None):
+        self.comment = comment
+        self.statements = []
+
+    def execute_sql(self, sql):
+        self.statements.append(" ".join(sql.split()))
+
+    def download_table_odbc(self, sql):
+        return pd.DataFrame({"CommentString": [self.comment]})
+
+
+def test_volatile_table():
+    td = _RecordingTd()
+    table = CalculatedTables(run_name="run", chain="paket").get_scratch_table(
+        "tmp_monthlyV_kundenseit", 202401, volatile=True
+    )
+    assert table == "run_tmp_monthlyV_kundenseit_paket_202401"
+    assert create_table(td, table, QUERY, "(abrnr)", logger, volatile=True)
+    assert td.statements[-1] == (
+        f"CREATE VOLATILE TABLE {table} AS ({QUERY}) WITH DATA PRIMARY INDEX (abrnr) ON COMMIT PRESERVE ROWS"
+    )
+
+
+def test_volatile_table_never_skipped():
+    td = _RecordingTd(FINGERPRINT_PREFIX + table_fingerprint(QUERY, "(abrnr)", {}))
+    assert create_table(td, "run_tmp", QUERY, "(abrnr)", logger, volatile=True, skip_unchanged=True, watermarks={})
+
+
+def test_permanent_table_skipped_when_unchanged():
+    watermarks = {"DB_NEXTT.PZE_EVENT": "2024-01-31"}
+    td = _RecordingTd(FINGERPRINT_PREFIX + table_fingerprint(QUERY, "(abrnr)", watermarks))
+    assert not create_table(td, "S.run_tmp", QUERY, "(abrnr)", logger, skip_unchanged=True, watermarks=watermarks)
+    assert td.statements == []
+
+    td = _RecordingTd(FINGERPRINT_PREFIX + table_fingerprint(QUERY, "(abrnr)", watermarks))
+    assert create_table(td, "S.run_tmp", QUERY, "(abrnr)", logger, skip_unchanged=True, watermarks={"x": None})
+    assert td.statements[-1].startswith("CREATE TABLE S.run_tmp AS")
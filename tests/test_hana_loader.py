@@ -0,0 +1,48 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from src.utils.hana_loader import _stale_table_keys, compute_delta, row_hashes
+
+
+def _snapshot(df: pd.DataFrame) -> pd.DataFrame:
+    return row_hashes(df, ["ekpnr"])
+
+
+def test_compute_delta_inserts_changes_and_deletes():
+    df_last = pd.DataFrame({"ekpnr": ["1", "2", "3"], "gewicht": [1.0, 2.0, 3.0], "kalknr": ["a", "b", "c"]})
+    df = pd.DataFrame({"ekpnr": ["1", "2", "4"], "gewicht": [1.0, 2.5, 4.0], "kalknr": ["a", "b", "d"]})
+
+    df_upsert, df_delete = compute_delta(df, _snapshot(df_last), ["ekpnr"])
+
+    assert sorted(df_upsert["ekpnr"]) == ["2", "4"]
+    assert list(df_upsert.columns) == list(df.columns)
+    assert list(df_delete["ekpnr"]) == ["3"]
+
+
+def test_compute_delta_unchanged():
+    df = pd.DataFrame({"ekpnr": ["1", "2"], "gewicht": [1.0, 2.0]})
+    df_upsert, df_delete = compute_delta(df, _snapshot(df), ["ekpnr"])
+    assert df_upsert.empty and df_delete.empty
+
+
+def test_row_hash_independent_of_column_order():
+    df = pd.DataFrame({"ekpnr": ["1"], "a": [1], "b": ["x"]})
+    assert (_snapshot(df)["_row_hash"] == _snapshot(df[["b", "ekpnr", "a"]])["_row_hash"]).all()
+
+
+def test_stale_table_keys_within_partition():
+    duckdb = pytest.importorskip("duckdb")
+    connection = duckdb.connect()
+    connection.execute("CREATE TABLE gewicht (produkt VARCHAR, gewicht_avg_est DECIMAL(10, 1), anteil DOUBLE)")
+    connection.execute(
+        "INSERT INTO gewicht VALUES ('paket', 1.5, 0.1), ('paket', 2.5, 0.2), ('paket', 9.5, 0.3), ('warenpost', 9.5, 0.4)"
+    )
+    df = pd.DataFrame({"produkt": "paket", "gewicht_avg_est": [1.5, 2.5, 3.5], "anteil": [0.1, 0.2, 0.3]})
+
+    df_delete = _stale_table_keys(
+        logging.getLogger("test"), connection.cursor(), df, "gewicht", ["produkt", "gewicht_avg_est"], {"produkt": "paket"}
+    )
+
+    assert df_delete.to_dict("records") == [{"produkt": "paket", "gewicht_avg_est": 9.5}]
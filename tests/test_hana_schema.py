@@ -0,0 +1,56 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from src.utils.hana_schema import ENSURE_ATTEMPTS, ensure_table, table_spec
+
+logger = logging.getLogger("test_hana_schema")
+
+
+class _ConcurrentCursor:
+    """
+    Cursor on a table another load creates between reading the columns and the CREATE of this one.
+    """
+
+    def __init__(self, columns, fail_ddl: int = 1):
+        self.columns = columns
+        self.fail_ddl = fail_ddl
+        self.reads = 0
+        self.ddl = []
+
+    def execute(self, sql, params=None):
+        if sql.startswith("SELECT"):
+            self.reads += 1
+            return
+        self.ddl.append(sql)
+        if self.fail_ddl:
+            self.fail_ddl -= 1
+            raise RuntimeError("cannot use duplicate table name")
+
+    def fetchall(self):
+        return self.columns if self.reads > 1 else []
+
+
+def _spec():
+    df = pd.DataFrame({"abrnr": ["5000000001", "5000000002"], "menge": [1, 2]})
+    return table_spec(df, "TEST_TABLE", ["abrnr"])
+
+
+def test_table_created_concurrently_is_migrated():
+    cursor = _ConcurrentCursor([("ABRNR", "BIGINT", 19, 0, "FALSE"), ("MENGE", "SMALLINT", 5, 0, "TRUE")])
+    spec = ensure_table(cursor, _spec(), logger)
+    assert cursor.ddl == [_spec().create_sql]
+    assert [col.type_name for col in spec.columns] == ["BIGINT", "SMALLINT"]
+
+
+def test_table_created_concurrently_gets_missing_column():
+    cursor = _ConcurrentCursor([("ABRNR", "BIGINT", 19, 0, "FALSE")])
+    ensure_table(cursor, _spec(), logger)
+    assert cursor.ddl[-1] == "ALTER TABLE TEST_TABLE ADD (menge SMALLINT)"
+
+
+def test_failing_ddl_raised_after_attempts():
+    cursor = _ConcurrentCursor([("ABRNR", "BIGINT", 19, 0, "FALSE")], fail_ddl=ENSURE_ATTEMPTS)
+    with pytest.raises(RuntimeError):
+        ensure_table(cursor, _spec(), logger)
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from src.utils.memory_budget import MemoryBudget
+
+
+def _months(n_months: int = 4, n_rows: int = 5_000):
+    rng = np.random.default_rng(0)
+    return [
+        pd.DataFrame({
+            "ekpnr": rng.integers(0, 500, n_rows).astype(str),
+            "kalknr": rng.choice(["a", "b", None], n_rows),
+            "anzahl": rng.integers(1, 10, n_rows),
+            "gewicht": rng.random(n_rows),
+        })
+        for _ in range(n_months)
+    ]
+
+
+def _expected(frames):
+    df = pd.concat(frames, ignore_index=True).groupby(["ekpnr", "kalknr"], as_index=False, dropna=False).sum()
+    return df.sort_values(["ekpnr", "kalknr"], ignore_index=True)
+
+
+def test_grouped_sum_within_budget():
+    frames = _months()
+    df = MemoryBudget(None).grouped_sum(iter(frames), ["ekpnr", "kalknr"])
+    pd.testing.assert_frame_equal(df.sort_values(["ekpnr", "kalknr"], ignore_index=True), _expected(frames))
+
+
+def test_grouped_sum_spilled(tmp_path):
+    frames = _months()
+    budget = MemoryBudget(1, spill_dir=tmp_path, n_partitions=4)
+    df = budget.grouped_sum(iter(frames), ["ekpnr", "kalknr"])
+    pd.testing.assert_frame_equal(df, _expected(frames), check_exact=False, rtol=1e-12)
+    # the spill folders are removed
+    assert list(tmp_path.iterdir()) == []
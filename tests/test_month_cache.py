@@ -0,0 +1,32 @@
+import pandas as pd
+
+from src.utils.month_cache import MonthCache, month_range
+
+
+class Source:
+    def __init__(self):
+        self.calls = []
+
+    def fetch(self, first: int, last: int) -> pd.DataFrame:
+        self.calls.append((first, last))
+        months = month_range(first, last)
+        return pd.DataFrame({"monat": months, "menge": [len(self.calls)] * len(months)})
+
+
+def test_closed_months_fetched_once(tmp_path):
+    source = Source()
+    cache = MonthCache(tmp_path, open_month=202501)
+    cache.get("kosten", month_range(202401, 202406), source.fetch, "monat")
+    df = cache.get("kosten", month_range(202403, 202408), source.fetch, "monat")
+    assert source.calls == [(202401, 202406), (202407, 202408)]
+    assert df["monat"].tolist() == month_range(202403, 202408)
+
+
+def test_open_months_fetched_on_every_call(tmp_path):
+    source = Source()
+    cache = MonthCache(tmp_path, open_month=202412)
+    cache.get("gewicht", month_range(202410, 202412), source.fetch, "monat")
+    df = cache.get("gewicht", month_range(202410, 202412), source.fetch, "monat")
+    assert source.calls == [(202410, 202412), (202412, 202412)]
+    assert df["menge"].tolist() == [1, 1, 2]
+    assert not cache.path("gewicht", 202412).exists()
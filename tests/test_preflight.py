@@ -0,0 +1,102 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from src.utils.preflight import PreflightError, build_queries, parse_duration, parse_explain, preflight
+from src.utils.sql_templates import BoundQuery
+
+logger = logging.getLogger("test_preflight")
+
+RETRIEVE = """
+  1) First, we lock DWH.PZE_TABLE in view DWH.V_PZE_TABLE for access.
+  2) Next, we do an all-AMPs RETRIEVE step from DWH.PZE_TABLE in view DWH.V_PZE_TABLE by way of an
+     all-rows scan with a condition of ("(DWH.PZE_TABLE.EVT_DATUM >= DATE '2024-01-01') AND
+     (DWH.PZE_TABLE.EVT_DATUM <= DATE '2024-01-31')") into Spool 1 (group_amps), which is built locally on
+     the AMPs.  The size of Spool 1 is estimated with high confidence to be 1,234,567 rows (98,765,360
+     bytes).  The estimated time for this step is 0.52 seconds.
+  3) Finally, we send out an END TRANSACTION step to all AMPs involved in processing the request.
+  -> The contents of Spool 1 are sent back to the user as the result of statement 1.  The total estimated
+     time is 0.52 seconds.
+"""
+
+PRODUCT_JOIN = """
+  1) First, we lock KPR.KOSTEN for access, and we lock CALC.MAPPING for access.
+  2) Next, we do an all-AMPs RETRIEVE step from CALC.MAPPING by way of an all-rows scan with no residual
+     conditions into Spool 2 (all_amps), which is duplicated on all AMPs.  The size of Spool 2 is estimated
+     with low confidence to be 48,000 rows (1,152,000 bytes).  The estimated time for this step is 0.03
+     seconds.
+  3) We do an all-AMPs JOIN step from Spool 2 (Last Use) by way of an all-rows scan, which is joined to
+     KPR.KOSTEN by way of an all-rows scan with no residual conditions.  Spool 2 and KPR.KOSTEN are joined
+     using a product join, with a join condition of ("(1=1)").  The result goes into Spool 1 (group_amps),
+     which is built locally on the AMPs.  The size of Spool 1 is estimated with no confidence to be
+     912,000,000 rows (54,720,000,000 bytes).  The estimated time for this step is 1 hour and 12 minutes.
+  4) Finally, we send out an END TRANSACTION step to all AMPs involved in processing the request.
+  -> The contents of Spool 1 are sent back to the user as the result of statement 1.  The total estimated
+     time is 1 hour and 12 minutes.
+"""
+
+NO_TOTAL = """
+  1) First, we do an all-AMPs RETRIEVE step from CALC.KUNDEN_SEIT by way of an all-rows scan into Spool 3
+     (all_amps), which is redistributed by the hash code of (CALC.KUNDEN_SEIT.ABRNR) to all AMPs.  The size
+     of Spool 3 is estimated with high confidence to be 20,000 rows (640,000 bytes).  The estimated time for
+     this step is 0.10 seconds.
+  2) We do an all-AMPs SUM step to aggregate from Spool 3 by way of an all-rows scan.  Aggregate Intermediate
+     Results are computed globally, then placed in Spool 4.  The size of Spool 4 is estimated with low
+     confidence to be 5,000 rows (160,000 bytes).  The estimated time for this step is 0.05 seconds.
+"""
+
+
+def _fetch(texts):
+    def fetch(query: BoundQuery) -> pd.DataFrame:
+        return pd.DataFrame({"Explanation": texts[query.sql.split()[-1]].splitlines()})
+
+    return fetch
+
+
+@pytest.mark.parametrize(
+    "text, seconds",
+    [("0.52 seconds", 0.52), ("1 hour and 12 minutes", 4320), ("2 minutes and 1.5 seconds", 121.5), ("01:02:03", 3723)],
+)
+def test_parse_duration(text, seconds):
+    assert parse_duration(text) == pytest.approx(seconds)
+
+
+def test_parse_explain_retrieve():
+    estimate = parse_explain("weight_query", RETRIEVE)
+    assert (estimate.rows, estimate.spool_bytes, estimate.seconds) == (1_234_567, 98_765_360, 0.52)
+    assert not estimate.product_join
+
+
+def test_parse_explain_result_spool_and_product_join():
+    estimate = parse_explain("kpr_costs", PRODUCT_JOIN)
+    assert estimate.rows == 912_000_000
+    assert estimate.spool_bytes == 54_720_000_000
+    assert estimate.seconds == 4320
+    assert estimate.product_join
+
+
+def test_parse_explain_without_total_sums_steps():
+    estimate = parse_explain("kunden_seit", NO_TOTAL)
+    assert estimate.rows == 5_000
+    assert estimate.seconds == pytest.approx(0.15)
+
+
+def test_preflight_without_queries():
+    df = preflight({}, logger, fetch=_fetch({}), mode="warn")
+    assert df.empty and "seconds" in df.columns
+
+
+def test_preflight_refuses_over_budget():
+    queries = {name: BoundQuery(None, f"SELECT * FROM {name}", ()) for name in ("weight_query", "kpr_costs")}
+    fetch = _fetch({"weight_query": RETRIEVE, "kpr_costs": PRODUCT_JOIN})
+    df = preflight(queries, logger, fetch=fetch, mode="warn")
+    assert df.set_index("name").loc["kpr_costs", "over_budget"] == "rows, time"
+    with pytest.raises(PreflightError):
+        preflight(queries, logger, fetch=fetch, mode="refuse")
+
+
+def test_failing_builder_becomes_finding():
+    queries, failed = build_queries({"ok": lambda: {"q": BoundQuery(None, "SELECT 1", ())}, "broken": lambda: 1 / 0})
+    assert list(queries) == ["q"]
+    assert failed[0].name == "broken" and "ZeroDivisionError" in failed[0].error
@@ -0,0 +1,61 @@
+import json
+import tracemalloc
+
+import pandas as pd
+
+from src.utils.profiling import Profiler
+
+
+def test_nested_stages_record_parent_and_rows():
+    profiler = Profiler()
+
+    @profiler.profile("inner")
+    def inner(df):
+        return df.head(3)
+
+    with profiler.stage("outer", rows_in=10) as record:
+        record.set_output(inner(pd.DataFrame({"a": range(10)})))
+
+    records = {record.name: record for record in profiler.records}
+    assert records["inner"].parent == "outer"
+    assert records["outer"].parent is None
+    assert (records["inner"].rows_in, records["inner"].rows_out) == (10, 3)
+    assert records["outer"].rows_out == 3
+
+
+def test_summary_aggregates_calls():
+    profiler = Profiler()
+    for _ in range(3):
+        with profiler.stage("step", rows_in=5):
+            pass
+    df = profiler.summary()
+    assert df.loc[0, "calls"] == 3
+    assert df.loc[0, "rows_in"] == 15
+    assert pd.isna(df.loc[0, "rows_out"])
+
+
+def test_traced_peak_per_stage():
+    profiler = Profiler()
+    tracemalloc.start()
+    try:
+        with profiler.stage("outer"):
+            with profiler.stage("inner"):
+                data = bytearray(8 * 2**20)
+                del data
+    finally:
+        tracemalloc.stop()
+    records = {record.name: record for record in profiler.records}
+    assert records["inner"].peak_traced_mb >= 8
+    assert records["outer"].peak_traced_mb >= records["inner"].peak_traced_mb
+
+
+def test_export_and_reset(tmp_path):
+    profiler = Profiler()
+    with profiler.stage("step"):
+        pass
+    profiler.export(tmp_path, "run")
+    trace = json.loads((tmp_path / "run_trace.json").read_text())
+    assert [event["name"] for event in trace["traceEvents"]] == ["step"]
+    assert json.loads((tmp_path / "run_profile.json").read_text())["stages"][0]["calls"] == 1
+    profiler.reset()
+    assert profiler.records == [] and profiler.summary().empty
@@ -0,0 +1,67 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.reconciliation import COUNT, compare, local_aggregates, reconcile
+
+duckdb = pytest.importorskip("duckdb")
+
+logger = logging.getLogger("test_reconciliation")
+
+
+@pytest.fixture
+def loaded():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "produkt": "paket",
+        "abrnr": (rng.choice(1_000_000, 2_000, replace=False) + 500_000_000_000).astype(str),
+        "prozessebene_id": rng.integers(1, 9, 2_000),
+        "Fixkosten": rng.random(2_000).round(2),
+    })
+    connection = duckdb.connect()
+    connection.register("df_view", df)
+    connection.execute("CREATE TABLE kosten AS SELECT * FROM df_view")
+    return df, connection
+
+
+def _fetch(connection):
+    return lambda query: connection.execute(query.sql, query.params).fetchdf()
+
+
+def test_reconcile_matching_table(loaded):
+    df, connection = loaded
+    df_mismatch = reconcile(_fetch(connection), df, "kosten", ["abrnr", "prozessebene_id"], logger, {"produkt": "paket"})
+    assert df_mismatch is not None and df_mismatch.empty
+
+
+def test_reconcile_reports_key_range(loaded):
+    df, connection = loaded
+    abrnr = df["abrnr"].iloc[0]
+    connection.execute(f"UPDATE kosten SET Fixkosten = Fixkosten + 1 WHERE abrnr = '{abrnr}'")
+    connection.execute(f"DELETE FROM kosten WHERE abrnr = '{df['abrnr'].iloc[1]}'")
+
+    df_mismatch = reconcile(_fetch(connection), df, "kosten", ["abrnr", "prozessebene_id"], logger, {"produkt": "paket"})
+
+    assert len(df_mismatch) >= 1
+    for value in df["abrnr"].iloc[:2].astype(int):
+        assert ((df_mismatch["key_from"] <= value) & (value <= df_mismatch["key_to"])).any()
+    assert df_mismatch["differs"].str.contains(COUNT).any()
+    assert df_mismatch["differs"].str.contains("sum_Fixkosten").any()
+
+
+def test_reconcile_failed_query(loaded):
+    df, _ = loaded
+
+    def fail(query):
+        raise RuntimeError("table not found")
+
+    assert reconcile(fail, df, "kosten", ["abrnr"], logger) is None
+
+
+def test_compare_tolerates_rounding():
+    df = pd.DataFrame({"abrnr": [1, 2, 3], "kosten": [0.1, 0.2, 0.3]})
+    df_local = local_aggregates(df, [], ["abrnr"], ["kosten"], 1, 2)
+    df_remote = df_local.assign(sum_kosten=df_local["sum_kosten"] + 1e-12)
+    assert compare(df_local, df_remote, [], ["kosten"], 1, 2).empty
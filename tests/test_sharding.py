@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from src.utils.sharding import shard_apply, shard_ids
+
+
+def per_key_sum(df: pd.DataFrame) -> pd.DataFrame:
+    return df.groupby("ekpnr", as_index=False)["menge"].sum()
+
+
+def with_kalknr(df: pd.DataFrame, df_mapping: pd.DataFrame) -> pd.DataFrame:
+    return df.merge(df_mapping, on="ekpnr", how="left")
+
+
+def _frame(n_rows: int = 2_000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({"ekpnr": rng.integers(0, 300, n_rows).astype(str), "menge": rng.random(n_rows)})
+
+
+def test_shard_ids_stable():
+    df = _frame()
+    ids = shard_ids(df, ["ekpnr"], 8)
+    assert (ids == shard_ids(df.iloc[::-1], ["ekpnr"], 8)[::-1]).all()
+    # all rows of a key are in one shard
+    assert (pd.Series(ids).groupby(df["ekpnr"].to_numpy()).nunique() == 1).all()
+
+
+def test_shard_apply_sorted_like_unsharded():
+    df = _frame()
+    expected = per_key_sum(df).sort_values("ekpnr", ignore_index=True)
+    df_result = shard_apply(per_key_sum, df, ["ekpnr"], sort_by=["ekpnr"], n_shards=4, min_rows=0)
+    pd.testing.assert_frame_equal(df_result, expected)
+
+
+def test_shard_apply_keeps_row_order_with_co_sharded_frame():
+    df = _frame()
+    df_mapping = pd.DataFrame({"ekpnr": df["ekpnr"].unique()}).assign(kalknr=lambda d: "k" + d["ekpnr"])
+    df_result = shard_apply(
+        with_kalknr, df, ["ekpnr"], co_sharded={"df_mapping": (df_mapping, ["ekpnr"])}, keep_order=True,
+        n_shards=4, min_rows=0,
+    )
+    pd.testing.assert_frame_equal(df_result, with_kalknr(df, df_mapping))
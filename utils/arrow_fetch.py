@@ -0,0 +1,72 @@
+import datetime
+from typing import Any, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import arrow_odbc
+except ImportError:  # optional, only needed for td_fetch_mode = "arrow"
+    arrow_odbc = None
+
+# rows per Arrow batch fetched from the driver
+ARROW_BATCH_SIZE = 100_000
+# upper bound of the buffer of VARCHAR columns the driver reports without a length
+ARROW_MAX_TEXT_SIZE = 4_000
+
+
+def _parameter(value: Any) -> Optional[str]:
+    # arrow-odbc binds all parameters as text, Teradata casts them to the column types
+    if value is None:
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value.isoformat()
+    return str(value)
+
+
+def read_arrow_table(
+    connection_string: str,
+    sql: str,
+    params: Sequence[Any] = (),
+    batch_size: int = ARROW_BATCH_SIZE,
+    max_text_size: int = ARROW_MAX_TEXT_SIZE,
+) -> pa.Table:
+    """
+    Fetches the result set of sql column-wise into Arrow record batches, no Python object is built per cell.
+    """
+    if arrow_odbc is None:
+        raise ImportError("arrow-odbc is required for td_fetch_mode 'arrow'")
+    reader = arrow_odbc.read_arrow_batches_from_odbc(
+        query=sql,
+        connection_string=connection_string,
+        batch_size=batch_size,
+        parameters=[_parameter(value) for value in params] or None,
+        max_text_size=max_text_size,
+    )
+    return pa.Table.from_batches(list(reader), schema=reader.schema)
+
+
+def _numeric_type(decimal_type: pa.DataType) -> pa.DataType:
+    # DECIMAL(x,0) keys like ekpnr stay integers up to 18 digits, 5000000000 would print as 5000000000.0 as float
+    if decimal_type.scale == 0 and decimal_type.precision <= 18:
+        return pa.int64()
+    return pa.float64()
+
+
+def decimals_to_float(table: pa.Table) -> pa.Table:
+    """
+    Casts DECIMAL columns to float64, those without decimal places to int64, pandas would hold one Python Decimal
+    object per cell otherwise.
+    """
+    schema = pa.schema(
+        [f.with_type(_numeric_type(f.type)) if pa.types.is_decimal(f.type) else f for f in table.schema],
+        table.schema.metadata,
+    )
+    return table.cast(schema) if schema != table.schema else table
+
+
+def read_arrow(connection_string: str, sql: str, params: Sequence[Any] = (), **kwargs) -> pd.DataFrame:
+    """
+    DataFrame of sql fetched over the columnar Arrow path, see read_arrow_table.
+    """
+    return decimals_to_float(read_arrow_table(connection_string, sql, params, **kwargs)).to_pandas()
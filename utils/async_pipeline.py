@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+# marks the end of the stream in every queue
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Producer/consumer pipeline on asyncio: the blocking source iterator (e.g. Teradata fetches), the transform
+    steps and the sink (e.g. HANA writes) run in threads and hand chunks over bounded queues. A full queue blocks
+    its producer, so at most queue_size chunks wait between two steps and the run time approaches the one of the
+    slowest step instead of the sum of all steps.
+    """
+
+    def __init__(self, queue_size: int = 2, logger: Optional[logging.Logger] = None, name: str = "pipeline"):
+        self.queue_size = queue_size
+        self.logger = logger or logging.getLogger("async_pipeline")
+        self.name = name
+        self.busy_s: Dict[str, float] = defaultdict(float)
+
+    async def _timed(self, step: str, func: Callable, *args) -> Any:
+        start = time.perf_counter()
+        result = await asyncio.to_thread(func, *args)
+        self.busy_s[step] += time.perf_counter() - start
+        return result
+
+    async def _source(self, source: Iterable, out_queue: asyncio.Queue) -> None:
+        iterator = iter(source)
+        while True:
+            chunk = await self._timed("source", next, iterator, _DONE)
+            await out_queue.put(chunk)
+            if chunk is _DONE:
+                return
+
+    async def _transform(self, step: str, func: Callable, in_queue: asyncio.Queue, out_queue: asyncio.Queue) -> None:
+        while True:
+            chunk = await in_queue.get()
+            if chunk is _DONE:
+                await out_queue.put(_DONE)
+                return
+            await out_queue.put(await self._timed(step, func, chunk))
+
+    async def _sink(self, func: Callable, in_queue: asyncio.Queue) -> None:
+        while True:
+            chunk = await in_queue.get()
+            if chunk is _DONE:
+                # pass the end on to the other sink workers
+                await in_queue.put(_DONE)
+                return
+            await self._timed("sink", func, chunk)
+
+    async def _run(self, source: Iterable, transforms: List[Callable], sink: Callable, sink_workers: int) -> None:
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(len(transforms) + 1)]
+        tasks = [asyncio.create_task(self._source(source, queues[0]))]
+        for i, func in enumerate(transforms):
+            step = f"transform_{i}_{getattr(func, '__name__', 'step')}"
+            tasks.append(asyncio.create_task(self._transform(step, func, queues[i], queues[i + 1])))
+        tasks += [asyncio.create_task(self._sink(sink, queues[-1])) for _ in range(sink_workers)]
+
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+
+    def run(self, source: Iterable, transforms: List[Callable], sink: Callable, sink_workers: int = 1) -> None:
+        """
+        Feeds every chunk of source through the transforms in order and hands the results to sink.
+        With sink_workers > 1 the sink is called concurrently and has to be thread-safe.
+        """
+        start = time.perf_counter()
+        asyncio.run(self._run(source, transforms, sink, sink_workers))
+        wall_s = time.perf_counter() - start
+        busy = ", ".join(f"{step} {busy_s:.1f}s" for step, busy_s in self.busy_s.items())
+        self.logger.info(f"{self.name} finished in {wall_s:.1f}s, busy time per step: {busy}")
+
+    def iterate(self, source: Iterable, transforms: List[Callable]) -> Iterator:
+        """
+        Runs the pipeline in a background thread and yields every chunk as soon as it leaves the last transform,
+        so the caller works on one chunk while the next ones are fetched. At most queue_size chunks wait for it.
+        Errors of the pipeline are raised in the caller, closing the iterator early stops the pipeline.
+        """
+        out_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        closed = threading.Event()
+        errors: List[BaseException] = []
+
+        def put(chunk) -> None:
+            while not closed.is_set():
+                try:
+                    out_queue.put(chunk, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            raise RuntimeError(f"{self.name}: the consumer stopped")
+
+        def produce() -> None:
+            try:
+                self.run(source, transforms, put)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                try:
+                    put(_DONE)
+                except RuntimeError:
+                    pass
+
+        thread = threading.Thread(target=produce, name=self.name, daemon=True)
+        thread.start()
+        try:
+            while (chunk := out_queue.get()) is not _DONE:
+                yield chunk
+        finally:
+            closed.set()
+            thread.join()
+        if errors:
+            raise errors[0]
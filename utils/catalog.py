@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+
+from src.utils.profiling import profiler
+
+try:
+    import fcntl
+except ImportError:  # Windows, the manifest is only guarded within the process
+    fcntl = None
+
+MANIFEST_NAME = "_manifest.json"
+# sidecar file locked while the manifest is rewritten, the manifest itself is replaced and cannot hold the lock
+LOCK_NAME = "_manifest.lock"
+
+
+def data_checksum(df: pd.DataFrame) -> str:
+    """
+    Checksum of the content of df, independent of the file encoding.
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return "sha256:" + hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+
+def atomic_write(path: Union[Path, str], write) -> None:
+    """
+    Calls write(tmp_path) on a temporary file next to path and moves it into place, readers never see partial files.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Catalog:
+    """
+    Manifest of the artifacts in one data folder, kept as _manifest.json in the folder. save_df records schema,
+    row count, byte size, checksum, partitioning and the producing stage of every artifact it writes, so that
+    existence checks and lookups read one small file instead of scanning the folder of the network share.
+    """
+
+    def __init__(self, folder: Union[Path, str]):
+        self.folder = Path(folder)
+        self.path = self.folder / MANIFEST_NAME
+        self.lock_path = self.folder / LOCK_NAME
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, dict]] = None
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)["artifacts"]
+        except FileNotFoundError:
+            return {}
+
+    @property
+    def entries(self) -> Dict[str, dict]:
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def get(self, path: Union[Path, str]) -> Optional[dict]:
+        """
+        Manifest entry of an artifact. Entries written by other processes are picked up by re-reading the manifest
+        once on a miss.
+        """
+        name = Path(path).name
+        if name not in self.entries:
+            self._entries = self._load()
+        return self.entries.get(name)
+
+    def exists(self, path: Union[Path, str]) -> bool:
+        return self.get(path) is not None
+
+    def names(self) -> List[str]:
+        """
+        File names of all artifacts in the manifest, as written by other processes up to now.
+        """
+        self._entries = self._load()
+        return sorted(self._entries)
+
+    @contextmanager
+    def _locked(self):
+        # threads of this process wait on the lock, other processes (e.g. the calc workers) on the sidecar file
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def add(self, path: Union[Path, str], entry: dict) -> dict:
+        """
+        Writes the entry of an artifact into the manifest, the manifest is locked against other processes meanwhile.
+        """
+        with self._locked():
+            # merge with the entries other processes wrote in the meantime
+            entries = self._load()
+            entries[Path(path).name] = entry
+            atomic_write(
+                self.path,
+                lambda tmp_path: Path(tmp_path).write_text(
+                    json.dumps({"folder": str(self.folder), "artifacts": entries}, indent=1), encoding="utf-8"
+                ),
+            )
+            self._entries = entries
+        return entry
+
+    def record(
+        self, path: Union[Path, str], df: pd.DataFrame, partitioning: Optional[dict] = None, stage: Optional[str] = None
+    ) -> dict:
+        return self.add(path, {
+            "schema": {col: str(dtype) for col, dtype in df.dtypes.items()},
+            "rows": len(df),
+            "bytes": os.path.getsize(path),
+            "checksum": data_checksum(df),
+            "partitioning": partitioning,
+            "stage": stage or profiler.current_stage,
+            "written_at": time.time(),
+        })
+
+
+_catalogs: Dict[str, Catalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def catalog_for(path: Union[Path, str]) -> Catalog:
+    """
+    Catalog of the folder containing path, one instance per folder and process.
+    """
+    folder = str(Path(path).parent.absolute())
+    with _catalogs_lock:
+        if folder not in _catalogs:
+            _catalogs[folder] = Catalog(folder)
+        return _catalogs[folder]
+
+
+def copy_artifact(source: Union[Path, str], target: Union[Path, str]) -> dict:
+    """
+    Copies an artifact atomically and records it in the catalog of the target folder with the entry of the source,
+    the file is only read again if the source is not in its catalog.
+    """
+    atomic_write(target, lambda tmp_path: shutil.copyfile(source, tmp_path))
+    entry = catalog_for(source).get(source)
+    if entry is None:
+        return catalog_for(target).record(target, pd.read_parquet(target))
+    return catalog_for(target).add(target, {**entry, "bytes": os.path.getsize(target), "written_at": time.time()})
+
+
+def artifact_exists(path: Union[Path, str]) -> bool:
+    """
+    Looks the artifact up in the catalog of its folder. Only files the catalog does not know, e.g. SAP extracts
+    copied into the folder instead of written with save_df, are checked on disk.
+    """
+    return catalog_for(path).exists(path) or os.path.exists(path)
@@ -0,0 +1,290 @@
+import datetime
+import decimal
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import pandas as pd
+
+from src.project_path import GENERAL_DATA
+from src.run_config import db_backend_mode, db_replay_latency_s
+
+logger = logging.getLogger("db_backend")
+
+LIVE = "live"
+RECORD = "record"
+REPLAY = "replay"
+
+# Python types of object columns SQLite cannot store, kept as text and restored from their dtype entry on load
+_TEXT_TYPES = {
+    "decimal": (decimal.Decimal, decimal.Decimal),
+    "date": (datetime.date, datetime.date.fromisoformat),
+    "time": (datetime.time, datetime.time.fromisoformat),
+}
+
+
+def query_key(sql: str, params=None) -> str:
+    """
+    Key of a recorded result, literals and bound parameters are kept since they change the result.
+    """
+    key = " ".join(sql.split())
+    if params:
+        key += json.dumps(list(params), default=str)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _encode(df: pd.DataFrame):
+    """
+    Converts object columns of Decimal, date or time values (e.g. Teradata DECIMAL sums and DATE columns read by
+    pyodbc) to text, returns the frame and the dtypes to restore, the Python type name for converted columns.
+    """
+    dtypes, converted = {}, {}
+    for col, dtype in df.dtypes.items():
+        dtypes[col] = str(dtype)
+        if dtype != object:
+            continue
+        values = df[col].dropna()
+        for name, (python_type, _) in _TEXT_TYPES.items():
+            # datetime is a subclass of date and is stored as text by its own dtype
+            if len(values) and values.map(lambda value: type(value) is python_type).all():
+                dtypes[col] = name
+                converted[col] = df[col].map(str, na_action="ignore")
+                break
+    return df.assign(**converted), dtypes
+
+
+def _decode(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    for col, dtype in dtypes.items():
+        try:
+            if dtype in _TEXT_TYPES:
+                df[col] = df[col].astype(object).map(_TEXT_TYPES[dtype][1], na_action="ignore")
+            elif dtype.startswith("datetime"):
+                df[col] = pd.to_datetime(df[col])
+            else:
+                df[col] = df[col].astype(dtype)
+        except (TypeError, ValueError):
+            pass
+    return df
+
+
+class ReplayStore:
+    """
+    SQLite file holding recorded query results and the writes received in replay mode.
+    Every process opens its own connection on first use, a connection inherited by a forked worker is not used.
+    """
+
+    def __init__(self, path: Union[Path, str]):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(path)
+        self._pid = None
+        self._conn = None
+        self._lock, self._lock_pid = threading.Lock(), os.getpid()
+
+    def _connection(self) -> sqlite3.Connection:
+        # called under self._lock
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS queries (key TEXT PRIMARY KEY, sql TEXT, result_table TEXT, dtypes TEXT, "
+                "recorded_at REAL)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS writes (sql TEXT, n_rows INTEGER, payload TEXT, written_at REAL)")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    @property
+    def lock(self) -> threading.Lock:
+        # a lock held by another thread at fork time would never be released in the child
+        if self._lock_pid != os.getpid():
+            self._lock, self._lock_pid = threading.Lock(), os.getpid()
+        return self._lock
+
+    def save_result(self, sql: str, df: pd.DataFrame, params=None) -> None:
+        key = query_key(sql, params)
+        result_table = f"result_{key[:24]}"
+        df, dtypes = _encode(df)
+        with self.lock:
+            conn = self._connection()
+            df.to_sql(result_table, conn, if_exists="replace", index=False)
+            conn.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)",
+                (key, sql, result_table, json.dumps(dtypes), time.time()),
+            )
+            conn.commit()
+
+    def load_result(self, sql: str, params=None) -> pd.DataFrame:
+        with self.lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT result_table, dtypes FROM queries WHERE key = ?", (query_key(sql, params),)
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"No recorded result for query:\n{sql}\nparameters: {params}")
+            df = pd.read_sql(f"SELECT * FROM {row[0]}", conn)
+        return _decode(df, json.loads(row[1]))
+
+    def record_write(self, sql: str, data=None) -> None:
+        rows = [list(row) for row in data] if data is not None else []
+        with self.lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO writes VALUES (?, ?, ?, ?)", (sql, len(rows), json.dumps(rows, default=str), time.time())
+            )
+            conn.commit()
+
+
+class BufferedCursor:
+    """
+    DB-API cursor serving a DataFrame result, used to record and replay raw pyodbc/hdbcli sessions.
+    """
+
+    def __init__(self, backend: "DbBackend", cursor=None):
+        self.backend = backend
+        self.cursor = cursor
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+        self._pos = 0
+
+    def _serve(self, df: pd.DataFrame) -> None:
+        self.description = [(col, None, None, None, None, None, None) for col in df.columns]
+        self._rows = list(df.itertuples(index=False, name=None))
+        self.rowcount = len(self._rows)
+        self._pos = 0
+
+    def execute(self, sql, params=None):
+        if self.backend.mode == REPLAY:
+            self.backend.inject_latency()
+            if sql.lstrip().lower().startswith(("select", "sel ", "with", "explain", "help", "show")):
+                self._serve(self.backend.store.load_result(sql, params))
+            else:
+                self.backend.store.record_write(sql, [params] if params else None)
+                self.description = None
+            return self
+
+        if params:
+            self.cursor.execute(sql, params)
+        else:
+            self.cursor.execute(sql)
+        if self.cursor.description is not None:
+            columns = [column[0] for column in self.cursor.description]
+            df = pd.DataFrame.from_records(self.cursor.fetchall(), columns=columns)
+            self.backend.store.save_result(sql, df, params)
+            self._serve(df)
+        return self
+
+    def executemany(self, sql, data):
+        if self.backend.mode == REPLAY:
+            self.backend.inject_latency()
+            self.backend.store.record_write(sql, data)
+        else:
+            self.cursor.executemany(sql, data)
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size=1):
+        rows = self._rows[self._pos : self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self._rows) - self._pos)
+
+    def close(self):
+        if self.cursor is not None:
+            self.cursor.close()
+
+
+class BackendConnection:
+    """
+    Connection wrapper handing out BufferedCursors. Without a real connection (replay) all other calls are no-ops.
+    """
+
+    def __init__(self, backend: "DbBackend", connection=None):
+        self.backend = backend
+        self.connection = connection
+
+    def cursor(self):
+        return BufferedCursor(self.backend, self.connection.cursor() if self.connection is not None else None)
+
+    def __getattr__(self, name):
+        if self.connection is not None:
+            return getattr(self.connection, name)
+        return lambda *args, **kwargs: None
+
+
+class ReplayTeradata:
+    """
+    Stand-in for pda's Teradata serving recorded results of download_table_odbc.
+    """
+
+    def __init__(self, backend: "DbBackend"):
+        self.backend = backend
+
+    def download_table_odbc(self, sql, *args, **kwargs):
+        self.backend.inject_latency()
+        return self.backend.store.load_result(sql)
+
+    def execute_sql(self, sql, *args, **kwargs):
+        self.backend.inject_latency()
+        self.backend.store.record_write(sql)
+
+
+class DbBackend:
+    """
+    Selects how Teradata and HANA are accessed: live, live with recording of all results, or replay from the store.
+    """
+
+    def __init__(self, mode: str = LIVE, store_path: Optional[Union[Path, str]] = None, latency_s: float = 0.0):
+        if mode not in (LIVE, RECORD, REPLAY):
+            raise ValueError(f"unknown db backend mode {mode}")
+        self.mode = mode
+        self.latency_s = latency_s
+        self.store = ReplayStore(store_path) if mode != LIVE else None
+        logger.info(f"db backend mode {mode}, store {store_path}, latency {latency_s}s")
+
+    def inject_latency(self) -> None:
+        if self.latency_s > 0:
+            time.sleep(self.latency_s)
+
+    def teradata(self, factory):
+        """
+        Returns the Teradata instance built by factory, recording its results, or a ReplayTeradata.
+        """
+        if self.mode == REPLAY:
+            return ReplayTeradata(self)
+        td = factory()
+        if self.mode == RECORD:
+            download = td.download_table_odbc
+
+            @functools.wraps(download)
+            def download_and_record(sql, *args, **kwargs):
+                df = download(sql, *args, **kwargs)
+                self.store.save_result(sql, df)
+                return df
+
+            td.download_table_odbc = download_and_record
+        return td
+
+    def connection(self, factory):
+        """
+        Returns the DB-API connection built by factory, wrapped for recording, or a replay connection.
+        """
+        if self.mode == REPLAY:
+            return BackendConnection(self)
+        connection = factory()
+        return BackendConnection(self, connection) if self.mode == RECORD else connection
+
+
+# Backend shared by td_connector and hana_connector
+backend = DbBackend(mode=db_backend_mode, store_path=GENERAL_DATA / "db_replay.sqlite", latency_s=db_replay_latency_s)
@@ -0,0 +1,142 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+# 2^14 registers per HyperLogLog sketch, standard error of the distinct counts about 0.8%
+HLL_PRECISION = 14
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+Key = Union[str, Sequence[str]]
+
+
+def _key_name(key: Key) -> str:
+    return key if isinstance(key, str) else "+".join(key)
+
+
+def _key_cols(key: Key) -> List[str]:
+    return [key] if isinstance(key, str) else list(key)
+
+
+def hash_key(df: pd.DataFrame, key: Key) -> np.ndarray:
+    """
+    64 bit hash per row of one column or of a column tuple. The column values are hashed directly (no factorizing,
+    which costs as much as an exact count), no concatenated key columns are built. Rows with a null key hash to -1.
+    """
+    df_key = df[_key_cols(key)]
+    hashes = pd.util.hash_pandas_object(df_key, index=False, categorize=False).to_numpy()
+    return np.where(df_key.isna().any(axis=1).to_numpy(), np.uint64(0xFFFFFFFFFFFFFFFF), hashes)
+
+
+def hll_update(registers: np.ndarray, hashes: np.ndarray, codes: np.ndarray, p: int = HLL_PRECISION) -> None:
+    """
+    Adds hashes to the HyperLogLog registers of their group: the top p bits of the hash select the register, the
+    position of the first set bit of the low 32 bits is its value. Rows with code -1 are ignored.
+    """
+    index = (hashes >> np.uint64(64 - p)).astype(np.int64)
+    low_bits = (hashes & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    rho = (33 - np.frexp(low_bits)[1]).astype(np.uint8)
+    valid = (codes >= 0) & (hashes != np.uint64(0xFFFFFFFFFFFFFFFF))
+    np.maximum.at(registers, (codes[valid], index[valid]), rho[valid])
+
+
+def hll_estimate(registers: np.ndarray) -> np.ndarray:
+    """
+    Distinct count estimate per row of registers, with linear counting for small cardinalities.
+    """
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.power(2.0, -registers.astype(np.float64)).sum(axis=-1)
+    zeros = (registers == 0).sum(axis=-1)
+    with np.errstate(divide="ignore"):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.round(np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)).astype(np.int64)
+
+
+@dataclass
+class DfProfile:
+    name: str
+    shape: tuple
+    distinct: Dict[str, int] = field(default_factory=dict)
+    null_rate: Dict[str, float] = field(default_factory=dict)
+    quantiles: Dict[str, Dict[float, float]] = field(default_factory=dict)
+    groups: Dict[str, "DfProfile"] = field(default_factory=dict)
+
+    def __str__(self):
+        string = f"{self.name} shape {self.shape}"
+        for key, n in self.distinct.items():
+            string += f" | unique '{key}': ~{n}"
+        for col, rate in self.null_rate.items():
+            if rate > 0:
+                string += f" | null '{col}': {rate:.2%}"
+        for col, values in self.quantiles.items():
+            string += f" | '{col}' " + " ".join(f"p{int(q * 100)}={v:.4g}" for q, v in values.items())
+        lines = [string] + [f"  {group}" for group in self.groups.values()]
+        return "\n".join(lines)
+
+
+def profile_df(
+    df: pd.DataFrame,
+    keys: List[Key] = [],
+    by: Optional[str] = None,
+    by_values: Optional[Sequence] = None,
+    quantile_cols: Sequence[str] = (),
+    quantiles: Sequence[float] = DEFAULT_QUANTILES,
+    name: str = "df",
+) -> DfProfile:
+    """
+    Row counts, approximate distinct counts of keys (columns or column tuples), null rates and quantiles in one
+    pass over df, without copies of the frame. With by the same pass yields a profile per value of that column
+    (only by_values if given), e.g. by="verfa", by_values=["01", "62"].
+    """
+    if by is None:
+        codes, groups = np.zeros(len(df), dtype=np.int64), []
+    else:
+        codes, uniques = pd.factorize(df[by])
+        groups = list(uniques)
+        if by_values is not None:
+            groups = list(by_values)
+            # position of every value of by in by_values, -1 for values not profiled and nulls
+            codes = np.where(codes >= 0, pd.Index(groups).get_indexer(uniques)[codes], -1)
+    # group 0 is the whole frame, group i + 1 the i-th value of by
+    n_groups = len(groups) + 1
+    group_codes = np.where(codes >= 0, codes + 1, -1) if by is not None else codes
+    counts = np.bincount(group_codes[group_codes >= 0], minlength=n_groups)
+    counts[0] = len(df)
+
+    distinct = {}
+    for key in keys:
+        hashes = hash_key(df, key)
+        registers = np.zeros((n_groups, 1 << HLL_PRECISION), dtype=np.uint8)
+        hll_update(registers, hashes, np.zeros(len(df), dtype=np.int64))
+        if by is not None:
+            hll_update(registers, hashes, group_codes)
+        distinct[_key_name(key)] = hll_estimate(registers)
+
+    null_cols = [col for key in keys for col in _key_cols(key)] + list(quantile_cols)
+    null_counts = {}
+    for col in dict.fromkeys(null_cols):
+        isna = df[col].isna().to_numpy()
+        per_group = np.bincount(group_codes[group_codes >= 0], weights=isna[group_codes >= 0], minlength=n_groups)
+        per_group[0] = isna.sum()
+        null_counts[col] = per_group
+
+    profiles = []
+    for i in range(n_groups):
+        rows = int(counts[i])
+        profile = DfProfile(
+            name=name if i == 0 else f"{name} {by}={groups[i - 1]}",
+            shape=(rows, df.shape[1]),
+            distinct={key: int(values[i]) for key, values in distinct.items()},
+            null_rate={col: (float(values[i]) / rows if rows else 0.0) for col, values in null_counts.items()},
+        )
+        profiles.append(profile)
+
+    for col in quantile_cols:
+        values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+        if np.isfinite(values).any():
+            profiles[0].quantiles[col] = dict(zip(quantiles, np.nanquantile(values, quantiles)))
+
+    profiles[0].groups = {str(group): profile for group, profile in zip(groups, profiles[1:])}
+    return profiles[0]
@@ -28,6 +28,8 @@ STP_TABLES = {
 class CalculatedTables:
     run_name: str
     schema: str = "DBX_DWH_SBX_GB30_PRD"
+    # Calc chain of the run (e.g. the product) the scratch tables belong to, chains of one run run in parallel
+    chain: str = ""
 
     # Only KPR and DWH-related calculated tables
     tables = {
@@ -37,6 +39,9 @@ class CalculatedTables:
         "kunden_seit",
         "kt_abr_aktionsgeschaeft",
         "kt_abr_kleinpaket",
+        "tmp_monthlyV_kundenseit",
+        "vemo_kunde_konzern",
+        "vemo_vertragspartner",
     }
 
     # Primary index lookup for calculated tables
@@ -47,6 +52,27 @@ class CalculatedTables:
         "kunden_seit": "(abrnr, ekpnr)",
         "kt_abr_aktionsgeschaeft": "(ekpnr)",
         "kt_abr_kleinpaket": "(ekpnr)",
+        "tmp_monthlyV_kundenseit": "(abrnr)",
+        "vemo_kunde_konzern": "(ag_ekp)",
+        "vemo_vertragspartner": "(ekpnr, vbeln, posnr)",
+    }
+
+    # Alternative primary indexes measured by the skew advisor if the primary index is skewed
+    index_candidates_lookup = {
+        "kunden_seit": ["(abrnr)"],
+        "kt_abr_aktionsgeschaeft": ["(abrnr)"],
+        "kt_abr_kleinpaket": ["(abrnr)"],
+        "tmp_monthlyV_kundenseit": ["(abrnr, jahr_monat)"],
+        "vemo_vertragspartner": ["(vbeln, posnr)"],
+    }
+
+    # Join and filter columns statistics are collected on in addition to the primary index
+    statistics_lookup = {
+        "kunden_seit": ["(abrnr)"],
+        "kt_abr_aktionsgeschaeft": ["(abrnr)"],
+        "kt_abr_kleinpaket": ["(abrnr)"],
+        "tmp_monthlyV_kundenseit": ["(jahr_monat)"],
+        "vemo_vertragspartner": ["(ekpnr)"],
     }
 
     def get_table(self, table):
@@ -58,6 +84,17 @@ class CalculatedTables:
         else:
             raise ValueError(f"{table} does not exist!")
 
+    def get_scratch_table(self, table, *scope, volatile=False):
+        """
+        Retrieve the name of a table a calc chain builds and reads back, suffixed by the chain and the scope
+        (e.g. its reference month), so that concurrent chains of one run do not drop each other's table.
+        Volatile tables are session-scoped and have no schema.
+        """
+        name = self.get_table(table)
+        if volatile:
+            name = name.split(".", 1)[1]
+        return "_".join([name, *filter(None, [self.chain]), *map(str, scope)])
+
     def get_index(self, table):
         """
         Retrieve the primary index for a specific table.
@@ -66,3 +103,15 @@ class CalculatedTables:
             return self.primary_index_lookup[table]
         else:
             raise ValueError(f"Primary index for {table} does not exist!")
+
+    def get_index_candidates(self, table):
+        """
+        Retrieve the alternative primary indexes of a table for the skew advisor.
+        """
+        return self.index_candidates_lookup.get(table, [])
+
+    def get_statistics(self, table):
+        """
+        Retrieve the column groups to collect statistics on, the primary index first.
+        """
+        return [self.get_index(table)] + self.statistics_lookup.get(table, [])
@@ -1,5 +1,15 @@
+import hashlib
+import json
+import logging
+
 import pandas as pd
-from pda.connection.teradata import Teradata
+
+from ..run_config import pi_max_skew_factor
+from .logger import LazyDf
+from .td_connector import telemetry
+
+# Prefix of the table comment holding the fingerprint of the defining query
+FINGERPRINT_PREFIX = "sha256:"
 
 
 def log_minmax_date(session, db_table, date_column, logger):
@@ -14,10 +24,10 @@ def log_minmax_date(session, db_table, date_column, logger):
     )
 
     try:
-        if isinstance(session, Teradata):
+        if hasattr(session, "download_table_odbc"):
             min_max_date = session.download_table_odbc(query)
         else:
-            min_max_date = pd.read_sql(query, session)
+            min_max_date = telemetry.read_sql(session, query)
         logger.info(f"\nQuery: {db_table} \n{min_max_date}")
     except Exception as e:
         logger.error(f"Error retrieving min/max dates from {db_table}: {e}")
@@ -52,19 +62,82 @@ def log_table_sample(td, db_table, logger, sample=5):
     """
     Logs a sample of rows from a table.
     """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return None
     q = f"""SELECT * FROM {db_table} SAMPLE {str(sample)}"""
     try:
         df = td.download_table_odbc(q)
-        logger.info(f"\n{db_table} sample: \n{df}")
+        logger.debug("\n%s sample: \n%s", db_table, LazyDf(df))
         return df
     except Exception as e:
         logger.error(f"Error retrieving sample for {db_table}: {e}")
         return None
 
 
-def create_table(td, tmp_table, query, index, logger):
+def get_source_watermarks(td, sources, logger):
     """
-    Drops and recreates a table with the specified query and primary index.
+    Retrieves the current watermark (maximum value of a date or load column) for each source table.
+
+    Args:
+        sources (dict): Mapping of source table to the column that marks its freshness.
+    """
+    watermarks = {}
+    for db_table, column in sources.items():
+        query = f"""SELECT max({column}) as watermark FROM {db_table}"""
+        try:
+            watermarks[db_table] = str(td.download_table_odbc(query).iloc[0, 0])
+        except Exception as e:
+            logger.warning(f"Failed retrieving watermark for {db_table}: {e}")
+            watermarks[db_table] = None
+    return watermarks
+
+
+def get_table_checksums(td, tables, logger):
+    """
+    Retrieves row count and a row hash sum of each table, a fingerprint of the content of small tables.
+
+    Args:
+        tables (dict): Mapping of table to the hashed columns, e.g. "(abrnr, kunden_seit)".
+    """
+    checksums = {}
+    for db_table, columns in tables.items():
+        query = f"""SELECT COUNT(*) AS n_rows, SUM(CAST(HASHBUCKET(HASHROW{columns}) AS BIGINT)) AS row_hash_sum
+            FROM {db_table}"""
+        try:
+            df = td.download_table_odbc(query)
+            checksums[db_table] = f"{df.iloc[0, 0]}:{df.iloc[0, 1]}"
+        except Exception as e:
+            logger.warning(f"Failed retrieving checksum of {db_table}: {e}")
+            checksums[db_table] = None
+    return checksums
+
+
+def table_fingerprint(query, index, watermarks=None):
+    """
+    Hashes the defining query, the primary index and the source watermarks of a table.
+    """
+    payload = json.dumps(
+        {"query": " ".join(query.split()), "index": index, "watermarks": watermarks or {}}, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _read_table_fingerprint(td, tmp_table):
+    """
+    Reads the fingerprint stored in the table comment, returns None if there is none.
+    """
+    schema, table = tmp_table.split(".")
+    query = f"""SELECT CommentString FROM DBC.TablesV WHERE DatabaseName='{schema}' AND TableName='{table}'"""
+    df = td.download_table_odbc(query)
+    if df.empty or not isinstance(df.iloc[0, 0], str):
+        return None
+    comment = df.iloc[0, 0]
+    return comment[len(FINGERPRINT_PREFIX):] if comment.startswith(FINGERPRINT_PREFIX) else None
+
+
+def drop_table(td, tmp_table, logger):
+    """
+    Drops a table, a missing table is only logged.
     """
     try:
         td.execute_sql(f''' DROP TABLE {tmp_table} ''')
@@ -72,12 +145,131 @@ def create_table(td, tmp_table, query, index, logger):
     except Exception as e:
         logger.warning(f"Failed dropping {tmp_table} \nError: {e}")
 
+
+def create_table(
+    td,
+    tmp_table,
+    query,
+    index,
+    logger,
+    volatile=False,
+    skip_unchanged=False,
+    watermarks=None,
+    statistics=None,
+    index_candidates=None,
+):
+    """
+    Drops and recreates a table with the specified query and primary index.
+
+    Args:
+        volatile (bool): Creates a session-scoped volatile table instead of a permanent one. Volatile tables are
+            not journaled and vanish with the session, so tmp_table must not be qualified with a schema and has to
+            be read back on the same session (td.download_table_odbc, not read_query).
+        skip_unchanged (bool): Keeps an existing permanent table if it was built from the same query, index and
+            source watermarks. The fingerprint is stored as table comment. A watermark that could not be retrieved
+            counts as changed.
+        watermarks (dict): Source watermarks as returned by get_source_watermarks.
+        statistics (list): Column groups like "(abrnr, ekpnr)" to collect statistics on after creation.
+        index_candidates (list): Alternative primary indexes measured by advise_primary_index if index is skewed.
+
+    Returns:
+        bool: True if the table was (re)built.
+    """
+    fingerprint = None
+    if skip_unchanged and volatile:
+        logger.warning(f"Rebuilding {tmp_table}, a volatile table does not outlive its session")
+    elif skip_unchanged and None in (watermarks or {}).values():
+        logger.warning(f"Rebuilding {tmp_table}, a source watermark is missing")
+    elif skip_unchanged:
+        fingerprint = table_fingerprint(query, index, watermarks)
+        try:
+            if _read_table_fingerprint(td, tmp_table) == fingerprint:
+                logger.info(f"Skipped {tmp_table}, query and source watermarks unchanged")
+                return False
+        except Exception as e:
+            logger.warning(f"Failed reading fingerprint of {tmp_table} \nError: {e}")
+
+    drop_table(td, tmp_table, logger)
+
     try:
         sql = f'''
-        CREATE TABLE {tmp_table} AS ({query}) WITH DATA
+        CREATE {"VOLATILE " if volatile else ""}TABLE {tmp_table} AS ({query}) WITH DATA
         PRIMARY INDEX {index}
+        {"ON COMMIT PRESERVE ROWS" if volatile else ""}
         '''
         td.execute_sql(sql)
-        logger.info(f"Created {tmp_table}")
+        logger.info(f"Created {'volatile ' if volatile else ''}{tmp_table}")
     except Exception as e:
         logger.error(f"Failed to create {tmp_table}: {e}")
+        return False
+
+    if fingerprint is not None:
+        try:
+            td.execute_sql(f"COMMENT ON TABLE {tmp_table} AS '{FINGERPRINT_PREFIX}{fingerprint}'")
+        except Exception as e:
+            logger.warning(f"Failed storing fingerprint of {tmp_table} \nError: {e}")
+
+    if index_candidates is not None:
+        advise_primary_index(td, tmp_table, index, index_candidates, logger)
+    if statistics:
+        collect_statistics(td, tmp_table, statistics, logger)
+    return True
+
+
+def measure_skew(td, db_table, columns):
+    """
+    Measures the row distribution over the AMPs if the table had the primary index columns, e.g. "(abrnr, ekpnr)".
+    The skew factor is 1 - average/maximum rows per AMP, 0 means perfectly even.
+    """
+    query = f"""
+        SELECT amp_no, n_rows, (SELECT HASHAMP() + 1) AS n_amps
+        FROM (
+            SELECT HASHAMP(HASHBUCKET(HASHROW{columns})) AS amp_no, COUNT(*) AS n_rows
+            FROM {db_table}
+            GROUP BY 1
+        ) AS dist
+    """
+    df = td.download_table_odbc(query)
+    if df.empty:
+        return {"index": columns, "rows": 0, "max_amp_rows": 0, "skew_factor": 0.0}
+    rows = int(df["n_rows"].sum())
+    max_rows = int(df["n_rows"].max())
+    avg_rows = rows / int(df["n_amps"].iloc[0])
+    return {"index": columns, "rows": rows, "max_amp_rows": max_rows, "skew_factor": round(1 - avg_rows / max_rows, 4)}
+
+
+def advise_primary_index(td, db_table, index, candidates, logger, max_skew=pi_max_skew_factor):
+    """
+    Warns if the primary index of a table is skewed above max_skew and measures the candidate indexes then.
+    Returns the measurements of the index and candidates, the least skewed first.
+    """
+    try:
+        measurements = [measure_skew(td, db_table, index)]
+        logger.info(f"Primary index {index} of {db_table}: skew factor {measurements[0]['skew_factor']}")
+        if measurements[0]["skew_factor"] <= max_skew:
+            return pd.DataFrame(measurements)
+        measurements += [measure_skew(td, db_table, candidate) for candidate in candidates]
+    except Exception as e:
+        logger.warning(f"Failed measuring skew of {db_table} \nError: {e}")
+        return None
+
+    df = pd.DataFrame(measurements).sort_values("skew_factor", kind="stable").reset_index(drop=True)
+    best = df.iloc[0]
+    advice = f"consider PRIMARY INDEX {best['index']} (skew {best['skew_factor']})" if best["index"] != index else ""
+    logger.warning(
+        f"Primary index {index} of {db_table} is skewed: skew factor {measurements[0]['skew_factor']} "
+        f"> {max_skew}, hot AMP holds {measurements[0]['max_amp_rows']} of {measurements[0]['rows']} rows. {advice}"
+    )
+    return df
+
+
+def collect_statistics(td, db_table, column_groups, logger):
+    """
+    Collects statistics on the primary index and join columns, e.g. ["(abrnr, ekpnr)", "(abrnr)"].
+    """
+    columns = ", ".join(f"COLUMN {group}" for group in dict.fromkeys(column_groups))
+    try:
+        td.execute_sql(f"COLLECT STATISTICS {columns} ON {db_table}")
+        logger.info(f"Collected statistics {columns} on {db_table}")
+    except Exception as e:
+        logger.warning(f"Failed collecting statistics on {db_table} \nError: {e}")
@@ -0,0 +1,65 @@
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+
+class AbrnrExclusion:
+    """
+    Set of abrnr to exclude, held as sorted string index whose hash table is built once for all membership tests.
+    Codes are compared as strings like in the plain isin filter, leading zeros and whitespace are significant.
+    """
+
+    def __init__(self, abrnr: pd.Series, name: str = ""):
+        abrnr = pd.Series(abrnr)
+        self.name = name
+        self.codes = pd.Index(abrnr.dropna().astype(str).unique()).sort_values()
+        # a missing abrnr in the list excludes the missing values, like isin does
+        self.missing = bool(abrnr.isna().any())
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, column: str = "abrnr", name: str = ""):
+        return cls(df[column], name=name)
+
+    def isin(self, values: pd.Series) -> np.ndarray:
+        """
+        Returns a boolean mask which entries of values are part of the exclusion set.
+        """
+        values = pd.Series(values)
+        missing = values.isna().to_numpy()
+        return np.where(missing, self.missing, self.codes.get_indexer(values.astype(str)) >= 0)
+
+    def filter(self, df: pd.DataFrame, logger: logging.Logger, column: str = "abrnr") -> pd.DataFrame:
+        """
+        Removes all rows whose column value is part of the exclusion set.
+        """
+        df_filtered = df.loc[~self.isin(df[column])]
+        logger.info(f"Removed {df.shape[0] - df_filtered.shape[0]} entries {self.name}")
+        return df_filtered
+
+
+@lru_cache(maxsize=32)
+def _load_exclusion_file(path: str, mtime_ns: int) -> AbrnrExclusion:
+    return AbrnrExclusion.from_frame(pd.read_parquet(path), name=Path(path).stem)
+
+
+def load_exclusion(path: Union[Path, str]) -> AbrnrExclusion:
+    """
+    Loads an exclusion list from parquet, a file is read again only after it changed.
+    """
+    return _load_exclusion_file(str(path), os.stat(path).st_mtime_ns)
+
+
+def anti_join_sql(db_table: str, column: str, alias: str = "excl") -> str:
+    """
+    Returns a NOT EXISTS predicate excluding all rows whose column matches an abrnr of db_table.
+    Replaces NOT IN subqueries, which Teradata has to evaluate with NULL-aware semantics.
+    """
+    return f"NOT EXISTS (SELECT 1 FROM {db_table} AS {alias} WHERE {alias}.abrnr = {column})"
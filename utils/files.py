@@ -2,9 +2,11 @@ import collections
 import os
 import re
 from dataclasses import dataclass, field, fields
-from glob import glob
+from fnmatch import fnmatch
 from typing import Optional
 
+from src.utils.catalog import MANIFEST_NAME, catalog_for
+
 @dataclass
 class FileContainer:
     """
@@ -17,7 +19,13 @@ class FileContainer:
     def __post_init__(self):
         """
         Checks if fieldname of class is a dict or not. If dict, then loops through all entries and joins filepath.
+        The input files are looked up in the catalog of the input folder, the folder is listed once if a file is not
+        in the catalog (e.g. it was copied into the folder without save_df).
         """
+        self.__in_data_files = (
+            catalog_for(os.path.join(self.in_data_path, MANIFEST_NAME)).names() if self.in_data_path else []
+        )
+        self.__in_data_listed = False
         for entry in fields(self):
             filename = getattr(self, entry.name)
             if (entry.name != "in_data_path") & (entry.name != "df_data_path"):
@@ -35,27 +43,33 @@ class FileContainer:
         filepath = ""
         if file is not None:
             if ("df" not in file) and (self.in_data_path):
-                filepath = os.path.join(self.in_data_path, f"{file}")
-                searchstring = os.path.join(self.in_data_path, f"*{file}*")
-                filepath = glob(searchstring)[0] if glob(searchstring) else filepath + ".parquet"
-                if not os.path.isfile(filepath):
-                    raise FileNotFoundError(f"{filepath} does not exist!")
+                matches = [name for name in self.__in_data_files if fnmatch(name, f"*{file}*")]
+                if not matches and not self.__in_data_listed:
+                    self.__in_data_files = sorted(os.listdir(self.in_data_path))
+                    self.__in_data_listed = True
+                    matches = [name for name in self.__in_data_files if fnmatch(name, f"*{file}*")]
+                if not matches:
+                    raise FileNotFoundError(f"{os.path.join(self.in_data_path, file)}.parquet does not exist!")
+                filepath = os.path.join(self.in_data_path, matches[0])
             elif "df" in file:
                 filepath = os.path.join(self.df_data_path, f"{file}.parquet")
             return filepath
 
     def files_exist(self, logger):
         """
-        Checks if all files exist and logs their presence.
+        Checks if all files exist and logs their presence. Calculated files are looked up in the catalog of
+        df_data_path, input files were found when the container was created.
         """
         for entry in fields(self):
             filename = getattr(self, entry.name)
-            if entry.name != "path":
-                if isinstance(filename, dict):
-                    for key, value in filename.items():
-                        logger.info(f"{value} exists: {os.path.isfile(value)}")
-                else:
-                    logger.info(f"{filename} exists: {os.path.isfile(filename)}")
+            if entry.name not in ("in_data_path", "df_data_path"):
+                for value in filename.values() if isinstance(filename, dict) else [filename]:
+                    logger.info(f"{value} exists: {self.__exists(value)}")
+
+    def __exists(self, filepath: str) -> bool:
+        if os.path.dirname(filepath) == self.df_data_path.rstrip(os.sep):
+            return catalog_for(filepath).exists(filepath)
+        return os.path.basename(filepath) in self.__in_data_files
 
     def log(self, logger):
         logger.info(f"{self}")
@@ -81,6 +95,17 @@ class DwhFiles(FileContainer):
     df_kunden_seit: str = "df_kunden_seit"
 
 
+@dataclass
+class SapFiles(FileContainer):
+    df_fibu: str = "df_fibu"
+    df_fibu_excl_a: str = "df_fibu_excl_a"
+    df_kt_report: str = "df_kt_report"
+    df_kt_report_excl_a: str = "df_kt_report_excl_a"
+    df_kt_sh2pr: str = "df_kt_sh2pr"
+    df_kontrakt: str = "df_kontrakt"
+    df_kt_abr_kleinpaket: str = "df_kt_abr_kleinpaket"
+
+
 @dataclass
 class CalculatedFiles(FileContainer):
     df_sh2pr_12M_abrnr: str = "df_sh2pr_12M_abrnr"
@@ -1,6 +1,7 @@
 import hdbcli.dbapi as dbapi
 import logging
-from utils.logger import setup_logger  # Assuming setup_logger is in utils.logger
+from src.utils.db_backend import backend
+from src.utils.logger import Lazy, LazySql, setup_logger
 
 # Set up a logger for HANA connections and operations
 hana_logger = setup_logger('hana_logger', 'hana_operations.log', level=logging.DEBUG, console_output=True)
@@ -16,12 +17,9 @@ def connect_to_hana():
     hana_password = "your_password"  # Replace with HANA Cloud password
     
     try:
-        # Attempting to establish a connection
-        connection = dbapi.connect(
-            address=hana_host,
-            port=hana_port,
-            user=hana_user,
-            password=hana_password
+        # Attempting to establish a connection, in replay mode inserts are stored locally
+        connection = backend.connection(
+            lambda: dbapi.connect(address=hana_host, port=hana_port, user=hana_user, password=hana_password)
         )
         hana_logger.info(f"Successfully connected to HANA Cloud at {hana_host}:{hana_port}")
         return connection
@@ -42,11 +40,12 @@ def execute_query(connection, query, data=None):
     """
     try:
         cursor = connection.cursor()
-        hana_logger.info(f"Executing query: {query}")
+        hana_logger.info("Executing query: %s", LazySql(query))
 
         if data:
             cursor.executemany(query, data)
-            hana_logger.debug(f"Data provided for query: {data}")
+            # only size and first row of the payload, never the full data
+            hana_logger.debug("Data provided for query: %s rows, first row %s", len(data), Lazy(lambda: data[0]))
         else:
             cursor.execute(query)
         
@@ -0,0 +1,219 @@
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from src.project_path import HANA_SNAPSHOTS
+from src.run_config import hana_manage_schema, pipeline_mode, pipeline_queue_size, reconcile_loads
+from src.utils.async_pipeline import Pipeline
+from src.utils.db_backend import REPLAY, backend
+from src.utils.hana_schema import TableSpec, coerce, ensure_table, table_spec
+from src.utils.reconciliation import reconcile
+from src.utils.sql_templates import BoundQuery
+from src.utils.utils import read_df, save_df
+
+try:
+    import fcntl
+except ImportError:  # Windows, the schema is only guarded by the retries of ensure_table
+    fcntl = None
+
+ROW_HASH = "_row_hash"
+BATCH_SIZE = 10_000
+
+
+def row_hashes(df: pd.DataFrame, key_cols: List[str]) -> pd.DataFrame:
+    """
+    Business key columns and one hash over all other columns per row.
+    """
+    value_cols = sorted(col for col in df.columns if col not in key_cols)
+    df_hashes = df[key_cols].reset_index(drop=True)
+    df_hashes[ROW_HASH] = pd.util.hash_pandas_object(df[value_cols], index=False).to_numpy()
+    return df_hashes
+
+
+def compute_delta(
+    df: pd.DataFrame, df_snapshot: pd.DataFrame, key_cols: List[str]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Compares the rows of df with the snapshot of the last load.
+    Returns the new or changed rows of df and the keys of the snapshot missing in df.
+    """
+    df_hashes = row_hashes(df, key_cols)
+    df_compare = df_hashes.merge(df_snapshot, on=key_cols, how="outer", suffixes=("", "_snapshot"), indicator=True)
+
+    changed = (df_compare["_merge"] == "both") & (df_compare[ROW_HASH] != df_compare[f"{ROW_HASH}_snapshot"])
+    df_upsert_keys = df_compare.loc[(df_compare["_merge"] == "left_only") | changed, key_cols]
+    df_upsert = df.merge(df_upsert_keys, on=key_cols, how="inner")
+    df_delete = df_compare.loc[df_compare["_merge"] == "right_only", key_cols].reset_index(drop=True)
+    return df_upsert, df_delete
+
+
+def _rows(df: pd.DataFrame) -> List[tuple]:
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def _fetch(cursor, query: BoundQuery) -> pd.DataFrame:
+    cursor.execute(query.sql, query.params)
+    return pd.DataFrame.from_records(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+
+
+def _reconciled(
+    logger: logging.Logger,
+    cursor,
+    df: pd.DataFrame,
+    table: str,
+    key_cols: List[str],
+    partition: Dict[str, str],
+    spec: Optional[TableSpec],
+) -> bool:
+    """
+    False if the aggregates of the table differ from the loaded frame, True if they agree or could not be checked.
+    """
+    if not reconcile_loads or backend.mode == REPLAY:
+        return True
+    # DECIMAL columns hold the rounded values
+    df_loaded = coerce(df, spec) if spec is not None else df
+    df_mismatch = reconcile(lambda query: _fetch(cursor, query), df_loaded, table, key_cols, logger, partition)
+    return df_mismatch is None or df_mismatch.empty
+
+
+def _stale_table_keys(
+    logger: logging.Logger, cursor, df: pd.DataFrame, table: str, key_cols: List[str], partition: Dict[str, str]
+) -> pd.DataFrame:
+    """
+    Keys of the table (within the partition) missing in df, the delete set of a load without snapshot.
+    Empty if the keys could not be read, e.g. the table does not exist yet.
+    """
+    where = " AND ".join(f"{col} = ?" for col in partition)
+    query = BoundQuery(
+        "table_keys",
+        f"SELECT {', '.join(key_cols)} FROM {table}" + (f" WHERE {where}" if where else ""),
+        list(partition.values()),
+    )
+    try:
+        df_table = _fetch(cursor, query)
+    except Exception as e:
+        logger.warning(f"Failed reading the keys of HANA table {table}, no rows are deleted: {e}")
+        return pd.DataFrame(columns=key_cols)
+    for col in key_cols:
+        # DECIMAL keys are read as Decimal objects
+        if pd.api.types.is_numeric_dtype(df[col]):
+            df_table[col] = pd.to_numeric(df_table[col])
+        df_table[col] = df_table[col].astype(df[col].dtype)
+    df_table = df_table.merge(df[key_cols].drop_duplicates(), on=key_cols, how="left", indicator=True)
+    return df_table.loc[df_table["_merge"] == "left_only", key_cols].reset_index(drop=True)
+
+
+def snapshot_path(table: str, partition: Optional[Dict[str, str]] = None) -> Path:
+    name = "_".join([table] + [f"{col}_{value}" for col, value in (partition or {}).items()])
+    return HANA_SNAPSHOTS / f"{name}.parquet"
+
+
+@contextmanager
+def _schema_lock(table: str):
+    # the product chains load the same tables from parallel processes, one at a time creates or alters a table
+    if fcntl is None:
+        yield
+        return
+    HANA_SNAPSHOTS.mkdir(parents=True, exist_ok=True)
+    with open(HANA_SNAPSHOTS / f"{table}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_delta(
+    logger: logging.Logger,
+    df: pd.DataFrame,
+    table: str,
+    key_cols: List[str],
+    partition: Optional[Dict[str, str]] = None,
+    batch_size: int = BATCH_SIZE,
+) -> None:
+    """
+    Loads df into the HANA table sending only the rows changed since the last load: new and changed rows with
+    UPSERT ... WITH PRIMARY KEY, keys not present anymore with DELETE. The comparison uses row hashes stored as
+    snapshot after every successful load. Without a snapshot all rows are sent and the keys of the table missing
+    in df are deleted, so a table holding extra rows converges. partition adds constant columns, e.g. the product, so that several
+    loads can share one table without deleting each other's rows.
+    With hana_manage_schema the table is created or widened first, see hana_schema.ensure_table. With
+    reconcile_loads row counts, key checksums and column sums of the table are compared with df after the load.
+    """
+    if df is None or df.empty:
+        logger.warning(f"DataFrame is empty. No data to load into HANA table {table}.")
+        return
+
+    partition = partition or {}
+    df = df.assign(**partition)
+    key_cols = list(partition) + [col for col in key_cols if col not in partition]
+    if df.duplicated(subset=key_cols).any():
+        raise ValueError(f"key {key_cols} of HANA table {table} is not unique")
+
+    path = snapshot_path(table, partition)
+    has_snapshot = path.is_file()
+    if has_snapshot:
+        df_upsert, df_delete = compute_delta(df, read_df(path), key_cols)
+        logger.info(f"HANA table {table}: {len(df)} rows, {len(df_upsert)} to upsert, {len(df_delete)} to delete")
+    else:
+        logger.info(f"no snapshot {path}, loading all {len(df)} rows of {table}, deleting the other keys of the table")
+        df_upsert, df_delete = df, pd.DataFrame(columns=key_cols)
+
+    if len(df_upsert) or len(df_delete):
+        columns = ", ".join(df.columns)
+        upsert_sql = f"UPSERT {table} ({columns}) VALUES ({', '.join('?' * len(df.columns))}) WITH PRIMARY KEY"
+        delete_sql = f"DELETE FROM {table} WHERE {' AND '.join(f'{col} = ?' for col in key_cols)}"
+
+        # imported here, the calc steps and benchmarks run without hdbcli as long as nothing changed
+        from src.utils.hana_connector import connect_to_hana
+
+        connection = connect_to_hana()
+        cursor = connection.cursor()
+        spec = None
+        try:
+            # in replay mode no table exists, the catalog query would not find a recorded result
+            if hana_manage_schema and backend.mode != REPLAY:
+                # the spec is derived from all rows, not only the delta, so that the types do not flip between loads
+                with _schema_lock(table):
+                    spec = ensure_table(cursor, table_spec(df, table, key_cols), logger)
+                df_upsert, df_delete = coerce(df_upsert, spec), coerce(df_delete, spec)
+            if not has_snapshot:
+                df_delete = _stale_table_keys(logger, cursor, df_upsert, table, key_cols, partition)
+                logger.info(f"HANA table {table}: {len(df_delete)} keys not in the loaded data to delete")
+            for start in range(0, len(df_delete), batch_size):
+                cursor.executemany(delete_sql, _rows(df_delete.iloc[start : start + batch_size]))
+            batches = (df_upsert.iloc[start : start + batch_size] for start in range(0, len(df_upsert), batch_size))
+            if pipeline_mode:
+                # the next batch is converted while the last one is written, within the same transaction
+                Pipeline(pipeline_queue_size, logger, f"load {table}").run(
+                    batches, [_rows], lambda rows: cursor.executemany(upsert_sql, rows)
+                )
+            else:
+                for batch in batches:
+                    cursor.executemany(upsert_sql, _rows(batch))
+            connection.commit()
+            consistent = _reconciled(logger, cursor, df, table, key_cols, partition, spec)
+        except Exception as e:
+            # the snapshot is kept, the next load sends these changes again
+            connection.rollback()
+            logger.error(f"Error loading HANA table {table}, rolled back: {str(e)}")
+            return
+        finally:
+            cursor.close()
+            connection.close()
+
+        if not consistent:
+            # without a snapshot the next load sends all rows again and deletes the keys the table holds beyond them
+            path.unlink(missing_ok=True)
+            logger.error(
+                f"HANA table {table} does not match the loaded data, the next load resends all rows and deletes "
+                f"the keys not in them."
+            )
+            return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    save_df(path, row_hashes(df, key_cols))
+    logger.info(f"Finished loading HANA table {table}.")
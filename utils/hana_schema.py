@@ -0,0 +1,254 @@
+import logging
+import re
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.calculation.calc_constants import PRODUKT_ID_MAPPING
+
+# values may grow by this factor before a column has to be widened
+HEADROOM = 4
+MAX_DECIMAL_SCALE = 6
+# NVARCHAR lengths are rounded up to these steps, so that reloads with slightly longer values keep the type
+NVARCHAR_STEPS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1000, 2000, 5000)
+MONEY_COLUMNS = re.compile(r"kosten|umsatz|preis|betrag|dbii|db2|kdg", re.IGNORECASE)
+INTEGER_TYPES = ("SMALLINT", "INTEGER", "BIGINT")
+# a load of another process (e.g. a parallel product chain) may create or alter the table between reading its
+# columns and the DDL, ensure_table then reads them again
+ENSURE_ATTEMPTS = 3
+
+
+@dataclass
+class ColumnSpec:
+    name: str
+    type_name: str
+    length: Optional[int] = None
+    scale: Optional[int] = None
+    nullable: bool = True
+
+    @property
+    def sql_type(self) -> str:
+        if self.type_name == "DECIMAL":
+            return f"DECIMAL({self.length}, {self.scale})"
+        if self.type_name == "NVARCHAR":
+            return f"NVARCHAR({self.length})"
+        return self.type_name
+
+    @property
+    def ddl(self) -> str:
+        return f"{self.name} {self.sql_type}{'' if self.nullable else ' NOT NULL'}"
+
+
+@dataclass
+class TableSpec:
+    name: str
+    columns: List[ColumnSpec]
+    key_cols: List[str]
+    partition_sql: str = ""
+
+    def column(self, name: str) -> ColumnSpec:
+        return next(col for col in self.columns if col.name == name)
+
+    @property
+    def create_sql(self) -> str:
+        columns = ", ".join(col.ddl for col in self.columns)
+        return f"CREATE COLUMN TABLE {self.name} ({columns}, PRIMARY KEY ({', '.join(self.key_cols)})) {self.partition_sql}"
+
+
+@dataclass
+class TableHints:
+    """
+    Per table overrides of the derived types: money columns become DECIMAL with at least 2 decimals,
+    partition_by is a list partitioning column (e.g. the product) or None for a hash partitioning by the key.
+    """
+
+    money: List[str] = field(default_factory=list)
+    partition_by: Optional[str] = None
+    partition_values: List[str] = field(default_factory=list)
+    hash_partitions: int = 4
+
+
+HANA_TABLES: Dict[str, TableHints] = {
+    "DWH_HANA_TABLE": TableHints(),
+    "KPR_HANA_TABLE": TableHints(
+        money=["Fixkosten", "Varkosten"], partition_by="produkt", partition_values=list(PRODUKT_ID_MAPPING)
+    ),
+    "PRIMA_PRICE_DELTA": TableHints(partition_by="produkt", partition_values=list(PRODUKT_ID_MAPPING)),
+    "SHIPTOPROFILE_KONTRAKT_SERV": TableHints(hash_partitions=1),
+}
+
+
+def _integer_type(max_abs: float) -> str:
+    max_abs *= HEADROOM
+    if max_abs < 2**15:
+        return "SMALLINT"
+    if max_abs < 2**31:
+        return "INTEGER"
+    return "BIGINT"
+
+
+def _decimal_scale(values: np.ndarray) -> Optional[int]:
+    # smallest number of decimals the values are rounded to, None for unrounded values
+    for scale in range(MAX_DECIMAL_SCALE + 1):
+        scaled = values * 10**scale
+        if np.allclose(scaled, np.round(scaled), rtol=0, atol=1e-6):
+            return scale
+    return None
+
+
+def _numeric_key(values: pd.Series) -> bool:
+    # digit strings without leading zeros fitting BIGINT, e.g. ekpnr and abrnr
+    return bool(values.str.fullmatch(r"[1-9]\d{0,17}").all())
+
+
+def column_spec(series: pd.Series, money: bool = False, key: bool = False) -> ColumnSpec:
+    """
+    Tightest HANA column type of the values of series.
+    """
+    name, values = series.name, series.dropna()
+    # only key columns are NOT NULL, columns added to filled tables have to allow NULL
+    nullable = not key
+    if pd.api.types.is_bool_dtype(series):
+        return ColumnSpec(name, "BOOLEAN", nullable=nullable)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return ColumnSpec(name, "TIMESTAMP", nullable=nullable)
+    if pd.api.types.is_numeric_dtype(series):
+        if values.empty:
+            return ColumnSpec(name, "BIGINT" if pd.api.types.is_integer_dtype(series) else "DOUBLE", nullable=nullable)
+        numbers = values.to_numpy(dtype=np.float64)
+        max_abs = float(np.abs(numbers).max())
+        scale = _decimal_scale(numbers)
+        if money:
+            scale = max(scale if scale is not None else 2, 2)
+        if scale == 0 and not money:
+            return ColumnSpec(name, _integer_type(max_abs), nullable=nullable)
+        if scale is None:
+            return ColumnSpec(name, "DOUBLE", nullable=nullable)
+        digits = len(str(int(max_abs * HEADROOM)))
+        return ColumnSpec(name, "DECIMAL", length=min(digits + scale, 38), scale=scale, nullable=nullable)
+
+    strings = values.astype(str)
+    if key and len(strings) and _numeric_key(strings):
+        return ColumnSpec(name, "BIGINT", nullable=False)
+    max_length = int(strings.str.len().max()) if len(strings) else 1
+    length = next((step for step in NVARCHAR_STEPS if step >= max_length), max_length)
+    return ColumnSpec(name, "NVARCHAR", length=length, nullable=nullable)
+
+
+def table_spec(df: pd.DataFrame, table: str, key_cols: List[str]) -> TableSpec:
+    """
+    Column store table of df with primary key key_cols and the partitioning of its HANA_TABLES hints.
+    """
+    hints = HANA_TABLES.get(table, TableHints())
+    columns = [
+        column_spec(df[col], money=col in hints.money or bool(MONEY_COLUMNS.search(col)) and col not in key_cols,
+                    key=col in key_cols)
+        for col in df.columns
+    ]
+    if hints.partition_by is not None:
+        values = ", ".join(f"PARTITION VALUE = '{value}'" for value in hints.partition_values)
+        partition_sql = f"PARTITION BY RANGE ({hints.partition_by}) ({values}, PARTITION OTHERS)"
+    elif hints.hash_partitions > 1:
+        partition_sql = f"PARTITION BY HASH ({key_cols[-1]}) PARTITIONS {hints.hash_partitions}"
+    else:
+        partition_sql = ""
+    return TableSpec(table, columns, key_cols, partition_sql)
+
+
+def _widens(existing: ColumnSpec, new: ColumnSpec) -> bool:
+    if existing.type_name in INTEGER_TYPES and new.type_name in INTEGER_TYPES:
+        return INTEGER_TYPES.index(new.type_name) > INTEGER_TYPES.index(existing.type_name)
+    if existing.type_name == new.type_name == "NVARCHAR":
+        return new.length > existing.length
+    if existing.type_name == new.type_name == "DECIMAL":
+        return new.scale > existing.scale or new.length - new.scale > existing.length - existing.scale
+    return False
+
+
+def _lossy(existing: ColumnSpec, new: ColumnSpec) -> bool:
+    # values HANA would truncate or reject, e.g. decimals in an INTEGER column
+    if existing.type_name in INTEGER_TYPES:
+        return new.type_name not in INTEGER_TYPES
+    if new.type_name == "NVARCHAR":
+        return existing.type_name != "NVARCHAR"
+    return False
+
+
+def _merged(existing: ColumnSpec, new: ColumnSpec) -> ColumnSpec:
+    if existing.type_name == new.type_name == "DECIMAL":
+        scale = max(existing.scale, new.scale)
+        digits = max(existing.length - existing.scale, new.length - new.scale)
+        return ColumnSpec(new.name, "DECIMAL", length=min(digits + scale, 38), scale=scale, nullable=existing.nullable)
+    return ColumnSpec(new.name, new.type_name, new.length, new.scale, existing.nullable)
+
+
+def existing_columns(cursor, table: str) -> Dict[str, ColumnSpec]:
+    cursor.execute(
+        "SELECT COLUMN_NAME, DATA_TYPE_NAME, LENGTH, SCALE, IS_NULLABLE FROM SYS.TABLE_COLUMNS "
+        "WHERE SCHEMA_NAME = CURRENT_SCHEMA AND TABLE_NAME = ? ORDER BY POSITION",
+        (table.upper(),),
+    )
+    return {
+        name.lower(): ColumnSpec(name, type_name, length, scale, nullable == "TRUE")
+        for name, type_name, length, scale, nullable in cursor.fetchall()
+    }
+
+
+def ensure_table(cursor, spec: TableSpec, logger: logging.Logger) -> TableSpec:
+    """
+    Creates the table of spec or migrates an existing one: missing columns are added and columns too narrow for
+    the new values are widened. Columns are never narrowed or dropped, so repeated calls change nothing.
+    A failing DDL (e.g. the table was created by a concurrent load) is retried on the columns read again.
+    Returns the spec of the table as it is after the migration.
+    """
+    for attempt in range(1, ENSURE_ATTEMPTS + 1):
+        existing = existing_columns(cursor, spec.name)
+        try:
+            if not existing:
+                logger.info(f"creating HANA table {spec.name}: {spec.create_sql}")
+                cursor.execute(spec.create_sql)
+                return spec
+            return _migrate(cursor, spec, existing, logger)
+        except Exception as e:
+            if attempt == ENSURE_ATTEMPTS:
+                raise
+            logger.warning(f"HANA table {spec.name}: {str(e)}, reading its columns again")
+
+
+def _migrate(cursor, spec: TableSpec, existing: Dict[str, ColumnSpec], logger: logging.Logger) -> TableSpec:
+    columns = []
+    for col in spec.columns:
+        current = existing.get(col.name.lower())
+        if current is None:
+            logger.info(f"HANA table {spec.name}: adding column {col.ddl}")
+            cursor.execute(f"ALTER TABLE {spec.name} ADD ({col.ddl})")
+            columns.append(col)
+        elif _widens(current, col):
+            widened = replace(_merged(current, col), name=col.name)
+            logger.info(f"HANA table {spec.name}: widening {current.sql_type} to {widened.ddl}")
+            cursor.execute(f"ALTER TABLE {spec.name} ALTER ({widened.ddl})")
+            columns.append(widened)
+        else:
+            if _lossy(current, col):
+                logger.warning(f"HANA table {spec.name}: column {col.name} is {current.sql_type}, values are {col.sql_type}")
+            columns.append(replace(current, name=col.name))
+    return TableSpec(spec.name, columns, spec.key_cols, spec.partition_sql)
+
+
+def coerce(df: pd.DataFrame, spec: TableSpec) -> pd.DataFrame:
+    """
+    Converts the values of df to the column types of spec: digit string keys to int, DECIMALs rounded to their scale.
+    """
+    df = df.copy()
+    for col in spec.columns:
+        if col.name not in df.columns:
+            continue
+        if col.type_name in INTEGER_TYPES and not pd.api.types.is_numeric_dtype(df[col.name]):
+            df[col.name] = pd.to_numeric(df[col.name]).astype("Int64")
+        elif col.type_name in INTEGER_TYPES and pd.api.types.is_float_dtype(df[col.name]):
+            df[col.name] = df[col.name].round().astype("Int64")
+        elif col.type_name == "DECIMAL":
+            df[col.name] = df[col.name].round(col.scale)
+    return df
@@ -1,37 +1,162 @@
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+from typing import Dict, List, Optional, Tuple
+
 import pandas as pd
 
 pd.set_option('display.max_row', 100)
 pd.set_option('display.max_columns', 20)
 
+# caps of the lazily rendered log payloads
+MAX_LOG_ROWS = 5
+MAX_LOG_CHARS = 4_000
+
+# logger name -> (log file, listener writing the queued records of that logger, its handlers)
+# the listener is None in forked children, which write with the handlers directly
+_listeners: Dict[str, Tuple[str, Optional[logging.handlers.QueueListener], List[logging.Handler]]] = {}
+# set in forked children, their loggers write directly, a process pool worker exits without running atexit
+_forked_child = False
+
+
 def setup_logger(name, log_file, level=logging.DEBUG, console_output=False):
     """
-    Set up as many loggers as you want. 
-    
+    Set up as many loggers as you want.
+    Records are put into a queue and written to the file by a background thread, so logging does not block the
+    pipeline (in forked worker processes the file is written directly). Calling it again with the same name and
+    file returns the existing logger without adding handlers.
+
     Args:
         name (str): The name of the logger.
         log_file (str): The file where logs will be written.
         level (int): Logging level (e.g., logging.DEBUG, logging.INFO).
         console_output (bool): If True, also output logs to the console (stdout).
     """
-    
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    log_file = os.path.abspath(log_file)
+    if name in _listeners:
+        if _listeners[name][0] == log_file:
+            return logger
+        _remove_handlers(name)
+
     formatter = logging.Formatter(
-        fmt="[%(asctime)s %(levelname)s - {%(filename)s:%(lineno)4s - %(funcName)s()}]: %(message)s", 
+        fmt="[%(asctime)s %(levelname)s - {%(filename)s:%(lineno)4s - %(funcName)s()}]: %(message)s",
         datefmt='%Y-%m-%d %H:%M:%S'
     )
-    
+
     # File handler
     file_handler = logging.FileHandler(log_file)
     file_handler.setFormatter(formatter)
-
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-    logger.addHandler(file_handler)
+    handlers = [file_handler]
 
     # Optional console output
     if console_output:
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
+
+    if _forked_child:
+        for handler in handlers:
+            logger.addHandler(handler)
+        _listeners[name] = (log_file, None, handlers)
+        return logger
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listeners[name] = (log_file, listener, handlers)
 
     return logger
+
+
+def _remove_handlers(name):
+    logger = logging.getLogger(name)
+    _, listener, handlers = _listeners.pop(name)
+    for handler in [h for h in logger.handlers if isinstance(h, logging.handlers.QueueHandler) or h in handlers]:
+        logger.removeHandler(handler)
+    if listener is not None:
+        listener.stop()
+    for handler in handlers:
+        handler.close()
+
+
+def _write_directly_in_child():
+    """
+    A forked child (e.g. a ProcessPoolExecutor worker) inherits the queue handlers but not the listener threads,
+    its records would never be written. The child writes with the file handlers directly instead, the records
+    queued by the parent before the fork are written by the parent.
+    """
+    global _forked_child
+    _forked_child = True
+    for name, (log_file, listener, handlers) in list(_listeners.items()):
+        logger = logging.getLogger(name)
+        for handler in [h for h in logger.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+            logger.removeHandler(handler)
+        for handler in handlers:
+            logger.addHandler(handler)
+        _listeners[name] = (log_file, None, handlers)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_write_directly_in_child)
+
+
+@atexit.register
+def shutdown_loggers():
+    """
+    Writes all queued records and closes the log files.
+    """
+    for name in list(_listeners):
+        _remove_handlers(name)
+
+
+def _cap(text: str, max_chars: int = MAX_LOG_CHARS) -> str:
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]} ... [{len(text) - max_chars} characters cut]"
+
+
+class LazyDf:
+    """
+    Log argument rendering the head of a DataFrame only when the record is emitted:
+    logger.debug("sample:\\n%s", LazyDf(df))
+    """
+
+    def __init__(self, df: pd.DataFrame, rows: int = MAX_LOG_ROWS):
+        self.df = df
+        self.rows = rows
+
+    def __str__(self):
+        return _cap(f"{self.df.head(self.rows)}\n[{self.df.shape[0]} rows x {self.df.shape[1]} columns]")
+
+
+class LazySql:
+    """
+    Log argument rendering a query with collapsed whitespace and capped length only when the record is emitted.
+    """
+
+    def __init__(self, sql: str, max_chars: int = MAX_LOG_CHARS):
+        self.sql = sql
+        self.max_chars = max_chars
+
+    def __str__(self):
+        return _cap(" ".join(self.sql.split()), self.max_chars)
+
+
+class Lazy:
+    """
+    Log argument calling func(*args, **kwargs) only when the record is emitted, e.g. for nunique summaries:
+    logger.debug("%s", Lazy(log_df_string, df, ["abrnr"]))
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return _cap(str(self.func(*self.args, **self.kwargs)))
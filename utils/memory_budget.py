@@ -0,0 +1,187 @@
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.run_config import memory_budget_gb, memory_spill_directory, memory_spill_partitions
+
+# rows of the sample the memory usage of object columns is estimated from
+ESTIMATE_SAMPLE_ROWS = 10_000
+
+
+def estimate_bytes(df: pd.DataFrame) -> int:
+    """
+    In-memory size of df. Object columns are measured deep on a sample and scaled, not on every value.
+    """
+    if len(df) <= ESTIMATE_SAMPLE_ROWS:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    sample = df.iloc[:: len(df) // ESTIMATE_SAMPLE_ROWS]
+    return int(sample.memory_usage(index=True, deep=True).sum() * len(df) / len(sample))
+
+
+class HashSpill:
+    """
+    Frames split by the hash of key_cols into n_partitions parquet partitions in a temporary folder. All rows of a
+    key end up in the same partition, so per-key operations can run partition by partition.
+    """
+
+    def __init__(self, key_cols: List[str], n_partitions: int, spill_dir: Optional[Union[Path, str]] = None):
+        self.key_cols = key_cols
+        self.n_partitions = n_partitions
+        if spill_dir is not None:
+            Path(spill_dir).mkdir(parents=True, exist_ok=True)
+        self.folder = Path(tempfile.mkdtemp(prefix="spill_", dir=spill_dir))
+        self.bytes = 0
+        self._parts = [0] * n_partitions
+
+    def add(self, df: pd.DataFrame) -> None:
+        partition = pd.util.hash_pandas_object(df[self.key_cols], index=False).to_numpy() % self.n_partitions
+        for i in np.unique(partition):
+            path = self.folder / f"part_{i}_{self._parts[i]}.parquet"
+            df[partition == i].to_parquet(path, index=False)
+            self.bytes += path.stat().st_size
+            self._parts[i] += 1
+
+    def partition(self, i: int) -> Optional[pd.DataFrame]:
+        if not self._parts[i]:
+            return None
+        return pd.concat(
+            [pd.read_parquet(self.folder / f"part_{i}_{j}.parquet") for j in range(self._parts[i])], ignore_index=True
+        )
+
+    def partitions(self) -> Iterable[pd.DataFrame]:
+        """
+        Yields the non-empty partitions, one at a time.
+        """
+        for i in range(self.n_partitions):
+            if self._parts[i]:
+                yield self.partition(i)
+
+    def close(self) -> None:
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemoryBudget:
+    """
+    Guards large transient frames of a run. An operation whose estimated peak (input size times factor) exceeds the
+    budget is run per hash partition of its keys, spilled to disk, and the partition results are concatenated.
+    Without a limit every operation runs in memory.
+    """
+
+    def __init__(
+        self,
+        limit_bytes: Optional[int],
+        spill_dir: Optional[Union[Path, str]] = None,
+        n_partitions: int = 16,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.limit_bytes = limit_bytes
+        self.spill_dir = spill_dir
+        self.n_partitions = n_partitions
+        self.logger = logger or logging.getLogger("memory_budget")
+
+    def fits(self, n_bytes: float) -> bool:
+        return self.limit_bytes is None or n_bytes <= self.limit_bytes
+
+    def _spill(self, key_cols: List[str]) -> HashSpill:
+        return HashSpill(key_cols, self.n_partitions, self.spill_dir)
+
+    def apply(
+        self,
+        df: pd.DataFrame,
+        key_cols: List[str],
+        func: Callable[[pd.DataFrame], pd.DataFrame],
+        factor: float = 2.0,
+        sort_by: Optional[List[str]] = None,
+        name: str = "apply",
+    ) -> pd.DataFrame:
+        """
+        func(df) for a func working per key (pivot, groupby over key_cols). Spilled results are sorted by sort_by.
+        """
+        estimate = estimate_bytes(df) * factor
+        if self.fits(estimate):
+            return func(df)
+        with self._spill(key_cols) as spill:
+            spill.add(df)
+            self.logger.info(
+                f"{name}: estimated {estimate / 1e9:.2f} GB over budget {self.limit_bytes / 1e9:.2f} GB, "
+                f"running on {self.n_partitions} partitions spilled to {spill.folder} ({spill.bytes / 1e9:.2f} GB)"
+            )
+            df_result = pd.concat([func(partition) for partition in spill.partitions()], ignore_index=True)
+        return df_result.sort_values(sort_by, ignore_index=True) if sort_by else df_result
+
+    def merge(self, left: pd.DataFrame, right: pd.DataFrame, on: List[str], how: str = "left", name: str = "merge"):
+        """
+        left.merge(right, on=on, how=how), partitioned by the join keys if over budget. The row order of a
+        left or inner merge is kept.
+        """
+        estimate = (estimate_bytes(left) + estimate_bytes(right)) * 2
+        if self.fits(estimate):
+            return left.merge(right, on=on, how=how)
+        position = "__position"
+        with self._spill(on) as spill_left, self._spill(on) as spill_right:
+            spill_left.add(left.assign(**{position: np.arange(len(left))}))
+            spill_right.add(right)
+            self.logger.info(
+                f"{name}: estimated {estimate / 1e9:.2f} GB over budget {self.limit_bytes / 1e9:.2f} GB, "
+                f"merging {self.n_partitions} partitions spilled to {spill_left.folder}, {spill_right.folder}"
+            )
+            dfs = []
+            for i in range(self.n_partitions):
+                df_left, df_right = spill_left.partition(i), spill_right.partition(i)
+                if df_left is None and (df_right is None or how in ("left", "inner")):
+                    continue
+                df_left = left.iloc[:0].assign(**{position: 0}) if df_left is None else df_left
+                df_right = right.iloc[:0] if df_right is None else df_right
+                dfs.append(df_left.merge(df_right, on=on, how=how))
+        df_merged = pd.concat(dfs, ignore_index=True)
+        if how in ("left", "inner"):
+            df_merged = df_merged.sort_values(position, kind="stable", ignore_index=True)
+        return df_merged.drop(columns=position)
+
+    def grouped_sum(self, frames: Iterable[pd.DataFrame], by: List[str], name: str = "grouped_sum") -> pd.DataFrame:
+        """
+        concat(frames).groupby(by).sum() without holding the concatenation once the frames exceed the budget:
+        from then on the frames are spilled by the hash of by and summed partition by partition.
+        """
+        held, held_bytes, spill = [], 0, None
+        try:
+            for df in frames:
+                held_bytes += estimate_bytes(df)
+                if spill is None and not self.fits(held_bytes * 2):
+                    spill = self._spill(by)
+                    self.logger.info(
+                        f"{name}: frames exceed budget {self.limit_bytes / 1e9:.2f} GB, spilling to {spill.folder}"
+                    )
+                    for df_held in held:
+                        spill.add(df_held)
+                    held = []
+                if spill is None:
+                    held.append(df)
+                else:
+                    spill.add(df)
+            if spill is None:
+                return pd.concat(held, ignore_index=True).groupby(by, as_index=False, dropna=False).sum()
+            dfs = [partition.groupby(by, as_index=False, dropna=False).sum() for partition in spill.partitions()]
+            return pd.concat(dfs, ignore_index=True).sort_values(by, ignore_index=True)
+        finally:
+            if spill is not None:
+                spill.close()
+
+
+# Budget of the run, shared by the calc steps
+budget = MemoryBudget(
+    int(memory_budget_gb * 1e9) if memory_budget_gb is not None else None,
+    spill_dir=memory_spill_directory,
+    n_partitions=memory_spill_partitions,
+)
@@ -0,0 +1,76 @@
+import logging
+import threading
+from datetime import date
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+import pandas as pd
+
+from src.utils.catalog import catalog_for
+from src.utils.utils import monthdelta, read_df, save_df
+
+
+def month_range(first: int, last: int) -> List[int]:
+    """
+    All months yyyymm from first to last, both included.
+    """
+    months = []
+    month = first
+    while month <= last:
+        months.append(month)
+        month = month + 89 if month % 100 == 12 else month + 1
+    return months
+
+
+class MonthCache:
+    """
+    Monthly partitions of source extracts as parquet files root/<source>/<yyyymm>.parquet. Runs for different
+    reference dates share their overlapping months, every month of a source is fetched from the database once.
+    Months from open_month on (by default the current month) still receive data, they are fetched on every call
+    and never stored.
+    """
+
+    def __init__(self, root: Union[Path, str], logger: logging.Logger = None, open_month: Optional[int] = None):
+        self.root = Path(root)
+        self.logger = logger or logging.getLogger("month_cache")
+        self.open_month = open_month or monthdelta(0, date.today())
+        self._lock = threading.Lock()
+
+    def path(self, source: str, month: int) -> Path:
+        return self.root / source / f"{month}.parquet"
+
+    def missing(self, source: str, months: List[int]) -> List[int]:
+        # the catalog of the source folder is read once instead of a file check per month
+        catalog = catalog_for(self.path(source, months[0]))
+        return [month for month in months if not catalog.exists(self.path(source, month))]
+
+    def get(
+        self, source: str, months: List[int], fetch: Callable[[int, int], pd.DataFrame], month_col: str
+    ) -> pd.DataFrame:
+        """
+        Returns the rows of all months, fetching the missing and the open ones with fetch(first_month, last_month) in
+        one call. The fetched frame has to contain month_col, every closed month of the fetched range is stored,
+        empty ones as well.
+        """
+        closed = [month for month in months if month < self.open_month]
+        open_months = [month for month in months if month >= self.open_month]
+        df_open = None
+        with self._lock:
+            missing = self.missing(source, closed) if closed else []
+            if missing or open_months:
+                first, last = min(missing + open_months), max(missing + open_months)
+                self.logger.info(
+                    f"month cache {source}: fetching {first} to {last}, {len(closed) - len(missing)} cached, "
+                    f"{len(open_months)} open months not cached"
+                )
+                df_fetched = fetch(first, last)
+                month_values = pd.to_numeric(df_fetched[month_col], errors="coerce")
+                if missing:
+                    (self.root / source).mkdir(parents=True, exist_ok=True)
+                    for month in month_range(min(missing), max(missing)):
+                        save_df(self.path(source, month), df_fetched[month_values == month], partitioning={month_col: month})
+                df_open = df_fetched[month_values.isin(open_months)]
+            else:
+                self.logger.info(f"month cache {source}: all {len(months)} months cached")
+        frames = [read_df(self.path(source, month)) for month in closed]
+        return pd.concat(frames + ([df_open] if df_open is not None else []), ignore_index=True)
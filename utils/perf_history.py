@@ -0,0 +1,169 @@
+import logging
+from datetime import date, datetime
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.project_path import PERF_HISTORY
+from src.run_config import (
+    perf_history_window,
+    perf_min_runs,
+    perf_regression_min_ratio,
+    perf_regression_z,
+    perf_trend_min_growth,
+    perf_trend_t,
+    run_name,
+)
+
+SERIES = ["scope", "kind", "stage", "fingerprint"]
+# measures checked for regressions, rows and bytes are kept as context: growing inputs explain growing durations
+CHECKED = ["duration_s", "peak_rss_mb", "peak_traced_mb"]
+MEASURES = ["calls", "duration_s", "cpu_s", "rows", "bytes", "peak_rss_mb", "peak_traced_mb"]
+COLUMNS = SERIES + ["run_name", "run_id", "reference_date"] + MEASURES
+
+
+def run_frame(
+    scope: str,
+    stages: pd.DataFrame,
+    queries: pd.DataFrame,
+    reference_date: Optional[date] = None,
+    run_id: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    One history row per stage of the profiler summary and per stage and query fingerprint of the query telemetry.
+    """
+    frames = []
+    if not stages.empty:
+        frames.append(pd.DataFrame({
+            "kind": "stage",
+            "stage": stages["name"],
+            "fingerprint": "",
+            "calls": stages["calls"],
+            "duration_s": stages["wall_s"],
+            "cpu_s": stages["cpu_s"],
+            "rows": stages["rows_out"].fillna(stages["rows_in"]),
+            "bytes": stages["df_memory_mb"] * 2**20,
+            "peak_rss_mb": stages["peak_rss_mb"],
+            "peak_traced_mb": stages["peak_traced_mb"],
+        }))
+    if not queries.empty:
+        df_queries = queries.assign(stage=queries["stage"].fillna("")).groupby(["stage", "fingerprint"], as_index=False).agg(
+            calls=("duration_s", "size"),
+            duration_s=("duration_s", "sum"),
+            rows=("rows", lambda rows: rows.sum(min_count=1)),
+            bytes=("approx_bytes", lambda size: size.sum(min_count=1)),
+        )
+        frames.append(df_queries.assign(kind="query"))
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+    df = df.assign(
+        scope=scope,
+        run_name=run_name,
+        run_id=run_id or datetime.now().strftime("%Y%m%d%H%M%S%f"),
+        reference_date=pd.Timestamp(reference_date) if reference_date else pd.NaT,
+    )
+    return df.reindex(columns=COLUMNS).astype({col: "float64" for col in MEASURES})
+
+
+def append(df_run: pd.DataFrame, history: Union[Path, str] = PERF_HISTORY) -> Path:
+    """
+    Adds the rows of a run to the history, one parquet file per run, so runs in parallel processes never share a file.
+    """
+    history = Path(history)
+    history.mkdir(parents=True, exist_ok=True)
+    scope, run_id = df_run["scope"].iloc[0], df_run["run_id"].iloc[0]
+    path = history / f"{scope}_{run_id}.parquet"
+    df_run.to_parquet(path, index=False)
+    return path
+
+
+def load(history: Union[Path, str] = PERF_HISTORY, scope: Optional[str] = None) -> pd.DataFrame:
+    """
+    All runs of the history, of one scope if given, ordered by run.
+    """
+    paths = sorted(Path(history).glob(f"{scope}_*.parquet" if scope else "*.parquet"))
+    frames = [pd.read_parquet(path) for path in paths]
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS)
+    df = pd.concat(frames, ignore_index=True)
+    # file names of scopes sharing a prefix (paket and paket_calc) match both globs
+    return (df[df["scope"] == scope] if scope else df).sort_values("run_id", kind="stable", ignore_index=True)
+
+
+def _trend_t(values: np.ndarray) -> float:
+    # t statistic of the slope of a least squares line through the values over the run index
+    x = np.arange(len(values), dtype=np.float64)
+    slope, intercept = np.polyfit(x, values, 1)
+    residuals = values - (slope * x + intercept)
+    se = np.sqrt(residuals @ residuals / (len(values) - 2) / ((x - x.mean()) @ (x - x.mean())))
+    return float(slope / se) if se > 0 else (np.inf if slope > 0 else 0.0)
+
+
+def regressions(df_history: pd.DataFrame, run_id: Optional[str] = None) -> pd.DataFrame:
+    """
+    Measures of a run (the latest without run_id) that regressed against the perf_history_window runs before it:
+    - "jump": z score against the earlier runs above perf_regression_z and at least perf_regression_min_ratio times
+      their mean
+    - "trend": the window including the run grows significantly (slope t statistic above perf_trend_t) by more than
+      perf_trend_min_growth of the mean per run, a slow growth that no single run shows
+    Series with fewer than perf_min_runs earlier runs are not checked.
+    """
+    run_id = run_id or df_history["run_id"].max()
+    flagged = []
+    for key, df_series in df_history.groupby(SERIES, sort=False):
+        df_series = df_series[df_series["run_id"] <= run_id]
+        if df_series.empty or df_series["run_id"].iloc[-1] != run_id:
+            continue
+        for measure in CHECKED:
+            values = df_series[measure].dropna().to_numpy(dtype=np.float64)[-(perf_history_window + 1):]
+            if len(values) <= perf_min_runs or np.isnan(df_series[measure].iloc[-1]):
+                continue
+            current, earlier = values[-1], values[:-1]
+            mean = earlier.mean()
+            # a floor on the spread keeps identical earlier runs from flagging every small change
+            std = max(earlier.std(ddof=1), 0.05 * abs(mean), 1e-3)
+            z = (current - mean) / std
+            t = _trend_t(values)
+            growth = (values[-1] - values[0]) / (len(values) - 1) / max(abs(values.mean()), 1e-9)
+            kinds = []
+            if z > perf_regression_z and current >= perf_regression_min_ratio * mean:
+                kinds.append("jump")
+            if t > perf_trend_t and growth > perf_trend_min_growth:
+                kinds.append("trend")
+            if kinds:
+                flagged.append(dict(
+                    zip(SERIES, key), measure=measure, regression=", ".join(kinds), current=current, mean=mean,
+                    ratio=current / mean if mean else np.inf, z=z, trend_t=t, growth_per_run=growth,
+                    rows_ratio=df_series["rows"].iloc[-1] / df_series["rows"].iloc[-len(values):-1].mean(),
+                    n_runs=len(earlier),
+                ))
+    return pd.DataFrame(flagged, columns=SERIES + ["measure", "regression", "current", "mean", "ratio", "z",
+                                                   "trend_t", "growth_per_run", "rows_ratio", "n_runs"])
+
+
+def record(
+    scope: str,
+    stages: pd.DataFrame,
+    queries: pd.DataFrame,
+    logger: logging.Logger,
+    reference_date: Optional[date] = None,
+    history: Union[Path, str] = PERF_HISTORY,
+) -> pd.DataFrame:
+    """
+    Adds a run to the history and logs the measures that regressed against the earlier runs of its scope.
+    Returns the regressions.
+    """
+    df_run = run_frame(scope, stages, queries, reference_date)
+    if df_run.empty:
+        return pd.DataFrame()
+    append(df_run, history)
+    df_regressions = regressions(load(history, scope), df_run["run_id"].iloc[0])
+    if df_regressions.empty:
+        logger.info(f"performance history {scope}: {len(df_run)} measures recorded, no regressions")
+    else:
+        logger.warning(
+            f"performance history {scope}: {len(df_regressions)} regressions against the earlier runs\n"
+            f"{df_regressions.to_string(index=False, float_format=lambda value: f'{value:,.3g}')}"
+        )
+    return df_regressions
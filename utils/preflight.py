@@ -0,0 +1,178 @@
+import logging
+import re
+from dataclasses import asdict, dataclass, fields
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from src.run_config import (
+    preflight_max_rows,
+    preflight_max_run_seconds,
+    preflight_max_seconds,
+    preflight_max_spool_gb,
+    preflight_mode,
+)
+from src.utils.sql_templates import BoundQuery
+
+_SPOOL = re.compile(r"[Tt]he size of Spool (\d+) is estimated with \w+ confidence to be ([\d,]+) rows? \(\s*([\d,]+) bytes\)")
+_RESULT = re.compile(r"[Tt]he contents of Spool (\d+) are sent back to the user")
+_TOTAL_TIME = re.compile(r"[Tt]he total estimated time is ([^.]+(?:\.\d+)?[^.]*)\.")
+_STEP_TIME = re.compile(r"[Tt]he estimated time for this step is ([^.]+(?:\.\d+)?[^.]*)\.")
+_DURATION = re.compile(r"([\d.,]+)\s*(hours?|minutes?|seconds?)")
+_CLOCK = re.compile(r"(\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+_PRODUCT_JOIN = re.compile(r"product join", re.IGNORECASE)
+_UNITS = {"hour": 3600, "minute": 60, "second": 1}
+
+
+class PreflightError(RuntimeError):
+    """
+    Raised in preflight_mode "refuse" when queries of a run exceed their budgets.
+    """
+
+
+@dataclass
+class QueryEstimate:
+    """
+    Optimizer estimates of one query: rows of the result, the largest spool and the total time.
+    """
+
+    name: str
+    rows: Optional[int] = None
+    spool_bytes: Optional[int] = None
+    seconds: Optional[float] = None
+    product_join: bool = False
+    error: Optional[str] = None
+    over_budget: str = ""
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """
+    Seconds of an EXPLAIN duration like "0.05 seconds", "1 hour and 12 minutes" or "01:02:03".
+    """
+    clock = _CLOCK.search(text)
+    if clock:
+        return int(clock.group(1)) * 3600 + int(clock.group(2)) * 60 + float(clock.group(3))
+    parts = _DURATION.findall(text)
+    if not parts:
+        return None
+    return sum(float(value.replace(",", "")) * _UNITS[unit.rstrip("s")] for value, unit in parts)
+
+
+def parse_explain(name: str, text: str) -> QueryEstimate:
+    """
+    Estimates of a Teradata EXPLAIN text. The rows are those of the spool sent back to the user (the last spool
+    without one), the time is the total estimated time (the sum of the steps without one).
+    """
+    text = " ".join(text.split())
+    spools = {int(spool): (int(rows.replace(",", "")), int(size.replace(",", ""))) for spool, rows, size in _SPOOL.findall(text)}
+    result = _RESULT.findall(text)
+    rows = None
+    if result and int(result[-1]) in spools:
+        rows = spools[int(result[-1])][0]
+    elif spools:
+        rows = list(spools.values())[-1][0]
+
+    total = _TOTAL_TIME.search(text)
+    seconds = parse_duration(total.group(1)) if total else None
+    if seconds is None:
+        steps = [parse_duration(step) for step in _STEP_TIME.findall(text)]
+        seconds = sum(step for step in steps if step is not None) if steps else None
+
+    return QueryEstimate(
+        name=name,
+        rows=rows,
+        spool_bytes=max((size for _, size in spools.values()), default=None),
+        seconds=seconds,
+        product_join=bool(_PRODUCT_JOIN.search(text)),
+    )
+
+
+def explain(fetch: Callable[[BoundQuery], pd.DataFrame], name: str, query: BoundQuery) -> QueryEstimate:
+    """
+    Runs EXPLAIN for the query with its bound parameters, errors (e.g. a table created later in the run) are kept.
+    """
+    try:
+        df = fetch(BoundQuery(query.template, "EXPLAIN " + query.sql.strip(), query.params))
+    except Exception as e:
+        return QueryEstimate(name=name, error=str(e).splitlines()[0] if str(e) else type(e).__name__)
+    return parse_explain(name, "\n".join(df.iloc[:, 0].astype(str)))
+
+
+def _over_budget(estimate: QueryEstimate) -> str:
+    exceeded = []
+    if preflight_max_rows is not None and (estimate.rows or 0) > preflight_max_rows:
+        exceeded.append("rows")
+    if preflight_max_spool_gb is not None and (estimate.spool_bytes or 0) > preflight_max_spool_gb * 2**30:
+        exceeded.append("spool")
+    if preflight_max_seconds is not None and (estimate.seconds or 0) > preflight_max_seconds:
+        exceeded.append("time")
+    return ", ".join(exceeded)
+
+
+def build_queries(
+    builders: Dict[str, Callable[[], Dict[str, BoundQuery]]]
+) -> Tuple[Dict[str, BoundQuery], List[QueryEstimate]]:
+    """
+    Calls the query builders of the stages. A builder that fails (e.g. on a table missing in the configuration)
+    becomes a finding of the pre-flight instead of stopping the run.
+    """
+    queries: Dict[str, BoundQuery] = {}
+    failed: List[QueryEstimate] = []
+    for name, build in builders.items():
+        try:
+            queries.update(build())
+        except Exception as e:
+            failed.append(QueryEstimate(name=name, error=f"queries not built: {type(e).__name__}: {e}"))
+    return queries, failed
+
+
+def preflight(
+    queries: Dict[str, BoundQuery],
+    logger: logging.Logger,
+    fetch: Optional[Callable[[BoundQuery], pd.DataFrame]] = None,
+    mode: str = preflight_mode,
+    failed: Optional[List[QueryEstimate]] = None,
+) -> pd.DataFrame:
+    """
+    EXPLAINs all queries of a run before any work starts and checks the estimates against the run_config budgets.
+    Logs a cost summary per query and for the run. Queries over budget are logged as warnings, with mode "refuse"
+    the run is stopped with a PreflightError. failed are the builders that could not build their queries, see
+    build_queries. Returns the estimates, empty with mode "off".
+    """
+    if mode == "off":
+        return pd.DataFrame()
+    if not queries and not failed:
+        logger.info("pre-flight: no queries to EXPLAIN")
+        return pd.DataFrame(columns=[field.name for field in fields(QueryEstimate)])
+    if fetch is None:
+        from src.utils.td_connector import read_query as fetch
+
+    estimates: List[QueryEstimate] = list(failed or [])
+    for name, query in queries.items():
+        estimate = explain(fetch, name, query)
+        estimate.over_budget = _over_budget(estimate)
+        estimates.append(estimate)
+    df = pd.DataFrame([asdict(estimate) for estimate in estimates])
+
+    total_seconds = df["seconds"].sum()
+    logger.info(
+        f"pre-flight of {len(df)} queries: {df['rows'].sum():,.0f} result rows, largest spool "
+        f"{df['spool_bytes'].max() / 2**30:,.2f} GB, total estimated time {total_seconds:,.0f} s\n"
+        f"{df.drop(columns='error').to_string(index=False)}"
+    )
+    for estimate in estimates:
+        if estimate.error:
+            logger.warning(f"pre-flight: no EXPLAIN for {estimate.name}: {estimate.error}")
+        if estimate.product_join:
+            logger.warning(f"pre-flight: {estimate.name} contains a product join")
+
+    violations = [f"{estimate.name} ({estimate.over_budget})" for estimate in estimates if estimate.over_budget]
+    if preflight_max_run_seconds is not None and total_seconds > preflight_max_run_seconds:
+        violations.append(f"run total time {total_seconds:,.0f} s")
+    if violations:
+        message = f"pre-flight budget exceeded: {'; '.join(violations)}"
+        if mode == "refuse":
+            logger.error(message)
+            raise PreflightError(message)
+        logger.warning(message)
+    return df
@@ -0,0 +1,213 @@
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional, Union
+
+import pandas as pd
+
+
+@dataclass
+class StageRecord:
+    """
+    Measurements of one stage execution. rows_out and df_memory_mb can be set inside a stage context.
+    peak_rss_mb is the peak RSS of the process up to the end of the stage (ru_maxrss never decreases), a stage
+    only shows up in it if it raised the peak of all stages before it.
+    peak_traced_mb is the peak of the memory allocated during the stage above its start, only while tracemalloc
+    is tracing; with stages running in several threads at once it covers their allocations too.
+    """
+
+    name: str
+    parent: Optional[str]
+    thread_id: int
+    start: float
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    peak_rss_mb: float = 0.0
+    peak_traced_mb: Optional[float] = None
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    df_memory_mb: Optional[float] = None
+
+    def set_output(self, df: pd.DataFrame):
+        self.rows_out = len(df)
+        self.df_memory_mb = round(df.memory_usage(index=True, deep=False).sum() / 2**20, 3)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 3)
+
+
+# [traced memory at the start, peak so far] of the open stages of all profilers, tracemalloc keeps only one
+# global peak that every stage resets
+_traced = threading.local()
+
+
+def _enter_traced() -> None:
+    stack = _traced.__dict__.setdefault("stack", [])
+    current, peak = tracemalloc.get_traced_memory()
+    if stack:
+        stack[-1][1] = max(stack[-1][1], peak)
+    tracemalloc.reset_peak()
+    stack.append([current, current])
+
+
+def _exit_traced(record: StageRecord) -> None:
+    stack = _traced.stack
+    start, peak = stack.pop()
+    peak = max(peak, tracemalloc.get_traced_memory()[1])
+    record.peak_traced_mb = round((peak - start) / 2**20, 3)
+    if stack:
+        stack[-1][1] = max(stack[-1][1], peak)
+    tracemalloc.reset_peak()
+
+
+def _count_rows(args, kwargs) -> Optional[int]:
+    frames = [arg for arg in list(args) + list(kwargs.values()) if isinstance(arg, pd.DataFrame)]
+    return sum(len(df) for df in frames) if frames else None
+
+
+class Profiler:
+    """
+    Collects wall time, CPU time, peak RSS, traced peak memory and row counts for nested pipeline stages.
+    """
+
+    def __init__(self):
+        self.records: List[StageRecord] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> List[StageRecord]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @property
+    def current_stage(self) -> Optional[str]:
+        stack = self._stack()
+        return stack[-1].name if stack else None
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None):
+        """
+        Context manager measuring the enclosed block, yields the StageRecord.
+        """
+        record = StageRecord(
+            name=name, parent=self.current_stage, thread_id=threading.get_ident(), start=time.time(), rows_in=rows_in
+        )
+        stack = self._stack()
+        stack.append(record)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            _enter_traced()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_s = round(time.perf_counter() - wall_start, 6)
+            record.cpu_s = round(time.process_time() - cpu_start, 6)
+            record.peak_rss_mb = _peak_rss_mb()
+            if tracing:
+                _exit_traced(record)
+            stack.pop()
+            with self._lock:
+                self.records.append(record)
+
+    def profile(self, name: Optional[str] = None):
+        """
+        Decorator measuring a function as stage. Rows in are counted from DataFrame arguments,
+        rows out and memory from a returned DataFrame.
+        """
+
+        def decorator(func):
+            stage_name = name or f"{func.__module__.split('.')[-1]}.{func.__name__}"
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name, rows_in=_count_rows(args, kwargs)) as record:
+                    result = func(*args, **kwargs)
+                    if isinstance(result, pd.DataFrame):
+                        record.set_output(result)
+                    return result
+
+            return wrapper
+
+        return decorator
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Aggregates all records per stage name.
+        """
+        df = pd.DataFrame([asdict(record) for record in self.records])
+        if df.empty:
+            return df
+        return df.groupby("name", as_index=False, sort=False).agg(
+            calls=("wall_s", "size"),
+            wall_s=("wall_s", "sum"),
+            cpu_s=("cpu_s", "sum"),
+            peak_rss_mb=("peak_rss_mb", "max"),
+            peak_traced_mb=("peak_traced_mb", "max"),
+            rows_in=("rows_in", lambda rows: rows.sum(min_count=1)),
+            rows_out=("rows_out", lambda rows: rows.sum(min_count=1)),
+            df_memory_mb=("df_memory_mb", "max"),
+        )
+
+    def to_chrome_trace(self) -> dict:
+        """
+        Returns the records as Chrome/Perfetto trace (complete events, timestamps in microseconds).
+        """
+        pid = os.getpid()
+        events = []
+        for record in self.records:
+            args = {key: value for key, value in asdict(record).items() if key not in ("name", "start", "thread_id")}
+            events.append(
+                {
+                    "name": record.name,
+                    "cat": "stage",
+                    "ph": "X",
+                    "ts": int(record.start * 1e6),
+                    "dur": int(record.wall_s * 1e6),
+                    "pid": pid,
+                    "tid": record.thread_id,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, folder: Union[Path, str], run_name: str) -> None:
+        """
+        Writes <run_name>_trace.json (load in chrome://tracing or ui.perfetto.dev) and <run_name>_profile.json.
+        """
+        folder = Path(folder)
+        with open(folder / f"{run_name}_trace.json", "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+        summary = {
+            "run_name": run_name,
+            "stages": self.summary().to_dict(orient="records"),
+            "records": [asdict(record) for record in self.records],
+        }
+        with open(folder / f"{run_name}_profile.json", "w") as f:
+            json.dump(summary, f, indent=2, default=str)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.records = []
+
+
+# Profiler shared by all modules of one run
+profiler = Profiler()
+
+
+def profile_stage(name: Optional[str] = None):
+    """
+    Decorator measuring a function with the shared profiler.
+    """
+    return profiler.profile(name)
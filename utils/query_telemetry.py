@@ -0,0 +1,161 @@
+import functools
+import hashlib
+import logging
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional, Union
+
+import pandas as pd
+
+from src.utils.memory_budget import estimate_bytes
+from src.utils.profiling import profiler
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalizes a query to its shape: comments removed, literals replaced by ?, lists collapsed, lower case.
+    """
+    sql = _COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(?)", sql)
+    return _WHITESPACE.sub(" ", sql).strip().lower()
+
+
+def fingerprint_sql(sql: str) -> str:
+    """
+    Short stable hash of the normalized query, equal for queries that only differ in their literals.
+    """
+    return hashlib.sha1(normalize_sql(sql).encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class QueryRecord:
+    fingerprint: str
+    normalized_sql: str
+    method: str
+    stage: Optional[str]
+    start: float
+    end: float = 0.0
+    duration_s: float = 0.0
+    time_to_first_row_s: Optional[float] = None
+    rows: Optional[int] = None
+    approx_bytes: Optional[int] = None
+    error: Optional[str] = None
+
+
+class QueryTelemetry:
+    """
+    Records latency, rows and transferred bytes of every Teradata call and logs queries above a threshold.
+    """
+
+    def __init__(self, slow_query_threshold_s: float, slow_logger: Optional[logging.Logger] = None):
+        self.slow_query_threshold_s = slow_query_threshold_s
+        self.slow_logger = slow_logger or logging.getLogger("slow_queries")
+        self.records: List[QueryRecord] = []
+        self._lock = threading.Lock()
+
+    def _start(self, method: str, sql: str) -> QueryRecord:
+        return QueryRecord(
+            fingerprint=fingerprint_sql(sql),
+            normalized_sql=normalize_sql(sql)[:1000],
+            method=method,
+            stage=profiler.current_stage,
+            start=time.time(),
+        )
+
+    def _finish(self, record: QueryRecord, sql: str, result=None) -> None:
+        record.end = time.time()
+        record.duration_s = round(record.end - record.start, 6)
+        if isinstance(result, pd.DataFrame):
+            record.rows = len(result)
+            # string contents included, measured on a sample of large results
+            record.approx_bytes = estimate_bytes(result)
+        with self._lock:
+            self.records.append(record)
+        if record.duration_s >= self.slow_query_threshold_s:
+            self.slow_logger.warning(
+                f"slow query {record.fingerprint} in stage {record.stage}: {record.duration_s:.1f}s, "
+                f"rows {record.rows}, bytes {record.approx_bytes}, error {record.error}\n{sql}"
+            )
+
+    def _wrap(self, method: str, func):
+        @functools.wraps(func)
+        def wrapper(sql, *args, **kwargs):
+            record = self._start(method, sql)
+            result = None
+            try:
+                result = func(sql, *args, **kwargs)
+                return result
+            except Exception as e:
+                record.error = f"{type(e).__name__}: {e}"[:500]
+                raise
+            finally:
+                self._finish(record, sql, result)
+
+        return wrapper
+
+    def call(self, method: str, func, sql: str, *args, **kwargs):
+        """
+        Calls func(sql, *args, **kwargs) and records it like the instrumented Teradata methods.
+        """
+        return self._wrap(method, func)(sql, *args, **kwargs)
+
+    def instrument(self, td) -> None:
+        """
+        Wraps download_table_odbc and execute_sql of a Teradata instance in place, so isinstance checks still hold.
+        """
+        td.download_table_odbc = self._wrap("download_table_odbc", td.download_table_odbc)
+        td.execute_sql = self._wrap("execute_sql", td.execute_sql)
+
+    def read_sql(self, session, sql: str, batch_size: int = 100_000, params=None) -> pd.DataFrame:
+        """
+        Downloads a query over a raw DB-API session (pyodbc), measuring the time to the first batch of rows.
+        params are bound to the ? markers of sql.
+        """
+        record = self._start("read_sql", sql)
+        df = None
+        cursor = session.cursor()
+        try:
+            if params:
+                cursor.execute(sql, params)
+            else:
+                cursor.execute(sql)
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchmany(batch_size)
+            record.time_to_first_row_s = round(time.time() - record.start, 6)
+            data = []
+            while rows:
+                data.extend(rows)
+                rows = cursor.fetchmany(batch_size)
+            # DECIMAL values arrive as Decimal objects, converted to float like pd.read_sql does for pda's downloads
+            df = pd.DataFrame.from_records(data, columns=columns, coerce_float=True)
+            return df
+        except Exception as e:
+            record.error = f"{type(e).__name__}: {e}"[:500]
+            raise
+        finally:
+            cursor.close()
+            self._finish(record, sql, df)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.records = []
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame([asdict(record) for record in self.records])
+
+    def export(self, path: Union[Path, str]) -> None:
+        """
+        Saves the per-run query table as parquet.
+        """
+        self.to_frame().to_parquet(path, index=False)
@@ -0,0 +1,164 @@
+import logging
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.run_config import reconcile_buckets
+from src.utils.sql_templates import BoundQuery, bind
+
+# key checksum: sum over the rows of MOD(MOD(key, PRIME) * multiplier, PRIME), one multiplier per key column,
+# modulo PRIME. The products and sums stay below 2**63 in BIGINT arithmetic of HANA and Teradata and in numpy.
+PRIME = 1_000_000_007
+MULTIPLIERS = (48271, 69621, 16807, 39373)
+BUCKET = "bucket"
+COUNT = "n_rows"
+CHECKSUM = "key_checksum"
+
+
+def checksum_columns(df: pd.DataFrame, key_cols: List[str]) -> List[str]:
+    """
+    Key columns that can enter the checksum: integers and digit strings, e.g. ekpnr and abrnr.
+    """
+    columns = []
+    for col in key_cols:
+        if pd.api.types.is_integer_dtype(df[col]):
+            columns.append(col)
+        elif not pd.api.types.is_numeric_dtype(df[col]) and df[col].astype(str).str.fullmatch(r"\d{1,18}").all():
+            columns.append(col)
+    return columns[: len(MULTIPLIERS)]
+
+
+def value_columns(df: pd.DataFrame, key_cols: List[str]) -> List[str]:
+    return [
+        col
+        for col in df.columns
+        if col not in key_cols and pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])
+    ]
+
+
+def _mod(expr: str, dialect: str) -> str:
+    return f"(({expr}) MOD {PRIME})" if dialect == "teradata" else f"MOD({expr}, {PRIME})"
+
+
+def aggregate_sql(
+    table: str,
+    group_cols: List[str],
+    key_cols: List[str],
+    value_cols: List[str],
+    offset: int,
+    width: int,
+    dialect: str = "hana",
+) -> str:
+    """
+    Template of the aggregates of local_aggregates computed inside the database, one query for the whole table.
+    The rows are restricted to the partition by :<group col> parameters.
+    """
+    keys = [f"CAST({col} AS BIGINT)" for col in key_cols]
+    bucket = f"FLOOR(({keys[0]} - {offset}) / {width})" if keys else "0"
+    hashes = " + ".join(_mod(f"{_mod(key, dialect)} * {m}", dialect) for key, m in zip(keys, MULTIPLIERS)) or "0"
+    select = group_cols + [f"{bucket} AS {BUCKET}", f"COUNT(*) AS {COUNT}", f"{_mod(f'SUM({hashes})', dialect)} AS {CHECKSUM}"]
+    select += [f"SUM({col}) AS sum_{col}" for col in value_cols]
+    where = " AND ".join(f"{col} = :{col}" for col in group_cols)
+    return (
+        f"SELECT {', '.join(select)} FROM {table}"
+        + (f" WHERE {where}" if where else "")
+        + f" GROUP BY {', '.join(group_cols + [bucket])}"
+    )
+
+
+def local_aggregates(
+    df: pd.DataFrame, group_cols: List[str], key_cols: List[str], value_cols: List[str], offset: int, width: int
+) -> pd.DataFrame:
+    """
+    Row count, key checksum and column sums per partition and key bucket of df, vectorized.
+    """
+    keys = [pd.to_numeric(df[col]).to_numpy(dtype=np.int64) for col in key_cols]
+    hashes = np.zeros(len(df), dtype=np.int64)
+    for key, multiplier in zip(keys, MULTIPLIERS):
+        hashes += (key % PRIME) * multiplier % PRIME
+    df_agg = df[group_cols + value_cols].assign(
+        **{BUCKET: (keys[0] - offset) // width if keys else 0, COUNT: 1, CHECKSUM: hashes}
+    )
+    df_agg = df_agg.groupby(group_cols + [BUCKET], as_index=False).sum()
+    df_agg[CHECKSUM] %= PRIME
+    return df_agg.rename(columns={col: f"sum_{col}" for col in value_cols})
+
+
+def compare(
+    df_local: pd.DataFrame,
+    df_remote: pd.DataFrame,
+    group_cols: List[str],
+    value_cols: List[str],
+    offset: int,
+    width: int,
+) -> pd.DataFrame:
+    """
+    Partitions and key buckets whose aggregates differ, with the key range of the bucket and the differing measures.
+    """
+    on = group_cols + [BUCKET]
+    df_remote = df_remote.astype({BUCKET: "int64"})
+    df = df_local.merge(df_remote, on=on, how="outer", suffixes=("_local", "_remote"))
+    measures = [COUNT, CHECKSUM] + [f"sum_{col}" for col in value_cols]
+    for measure in measures:
+        for side in ("local", "remote"):
+            # the remote side may come back as DECIMAL, counts and checksums are below 2**53 and stay exact
+            df[f"{measure}_{side}"] = pd.to_numeric(df[f"{measure}_{side}"]).astype("float64").fillna(0)
+
+    differs = pd.Series(False, index=df.index)
+    df["differs"] = ""
+    for measure in measures:
+        local, remote = df[f"{measure}_local"], df[f"{measure}_remote"]
+        if measure in (COUNT, CHECKSUM):
+            mismatch = local != remote
+        else:
+            mismatch = ~np.isclose(local, remote, rtol=1e-9, atol=1e-6 * df[f"{COUNT}_local"].clip(lower=1))
+        df.loc[mismatch, "differs"] += f" {measure}"
+        differs |= mismatch
+    df = df[differs].copy()
+    df["differs"] = df["differs"].str.strip()
+    df["key_from"] = offset + df[BUCKET] * width
+    df["key_to"] = df["key_from"] + width - 1
+    return df[on + ["key_from", "key_to", f"{COUNT}_local", f"{COUNT}_remote", "differs"]].reset_index(drop=True)
+
+
+def reconcile(
+    fetch: Callable[[BoundQuery], pd.DataFrame],
+    df: pd.DataFrame,
+    table: str,
+    key_cols: List[str],
+    logger: logging.Logger,
+    partition: Optional[Dict[str, str]] = None,
+    dialect: str = "hana",
+    n_buckets: int = reconcile_buckets,
+) -> Optional[pd.DataFrame]:
+    """
+    Checks that the table holds the rows of df without reading them back: row counts, key checksums and sums of
+    the numeric columns per partition and key bucket are computed locally and by one aggregate query fetched with
+    fetch. The partition columns restrict the query to the rows of this load. Returns the mismatching buckets,
+    empty if table and df agree, None if the aggregate query failed.
+    """
+    partition = partition or {}
+    group_cols = list(partition)
+    key_cols = checksum_columns(df, [col for col in key_cols if col not in partition])
+    values = value_columns(df, list(partition) + key_cols)
+    # the buckets split the key range of the first key column, a mismatch is reported with its range
+    first_key = pd.to_numeric(df[key_cols[0]]) if key_cols and len(df) else pd.Series([0])
+    offset = int(first_key.min())
+    width = max(1, -(-(int(first_key.max()) - offset + 1) // n_buckets))
+
+    query = bind(aggregate_sql(table, group_cols, key_cols, values, offset, width, dialect), **partition)
+    try:
+        df_remote = fetch(query)
+    except Exception as e:
+        logger.warning(f"Could not reconcile {table}: {e}")
+        return None
+    df_remote.columns = group_cols + [BUCKET, COUNT, CHECKSUM] + [f"sum_{col}" for col in values]
+    df_local = local_aggregates(df, group_cols, key_cols, values, offset, width)
+    df_mismatch = compare(df_local, df_remote, group_cols, values, offset, width)
+
+    if df_mismatch.empty:
+        logger.info(f"reconciled {table} {partition}: {len(df)} rows, checksum over {key_cols}, sums of {len(values)} columns")
+    else:
+        logger.error(f"{table} {partition} differs from the loaded data in {len(df_mismatch)} key ranges:\n{df_mismatch.to_string(index=False)}")
+    return df_mismatch
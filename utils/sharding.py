@@ -0,0 +1,99 @@
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from src.run_config import calc_shard_min_rows, calc_shards
+
+logger = logging.getLogger("sharding")
+
+POSITION = "__shard_position"
+
+
+def shard_ids(df: pd.DataFrame, key_cols: List[str], n_shards: int) -> np.ndarray:
+    """
+    Shard of every row, a stable hash of key_cols modulo n_shards. Equal keys of different frames get the same shard.
+    """
+    return pd.util.hash_pandas_object(df[key_cols], index=False).to_numpy() % n_shards
+
+
+def _write(df: pd.DataFrame, path: Path) -> str:
+    # uncompressed Arrow IPC files can be memory-mapped by the workers without a copy of the raw buffers
+    feather.write_feather(df.reset_index(drop=True), path, compression="uncompressed")
+    return str(path)
+
+
+def _read(path: str) -> pd.DataFrame:
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+
+def _run_shard(func: Callable, paths: Dict[str, str], out_path: str, kwargs: dict) -> str:
+    frames = {name: _read(path) for name, path in paths.items()}
+    df_result = func(frames.pop(""), **frames, **kwargs)
+    return _write(df_result, Path(out_path))
+
+
+def shard_apply(
+    func: Callable[..., pd.DataFrame],
+    df: pd.DataFrame,
+    key_cols: List[str],
+    co_sharded: Optional[Dict[str, Tuple[pd.DataFrame, List[str]]]] = None,
+    keep_order: bool = False,
+    sort_by: Optional[List[str]] = None,
+    n_shards: int = calc_shards,
+    min_rows: int = calc_shard_min_rows,
+    name: str = "shard_apply",
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    func(df, **co_sharded frames, **kwargs) run on n_shards shards of df in a process pool, for a func working per
+    key. co_sharded frames, e.g. {"df_mapping": (df_mapping, ["abrnr"])}, are split by their own key columns into
+    the same shards. The shards are handed to the workers as memory-mapped Arrow files and the results are
+    concatenated in shard order, then restored to the row order of df (keep_order, for row-wise funcs and left
+    merges) or sorted by sort_by, so the result does not depend on the number of shards.
+    func has to be a module level function, it is pickled to the workers.
+    """
+    co_sharded = co_sharded or {}
+    if n_shards <= 1 or len(df) < min_rows:
+        return func(df, **{other: frame for other, (frame, _) in co_sharded.items()}, **kwargs)
+
+    if keep_order:
+        df = df.assign(**{POSITION: np.arange(len(df))})
+    folder = Path(tempfile.mkdtemp(prefix=f"{name}_"))
+    try:
+        shards = shard_ids(df, key_cols, n_shards)
+        # shards without rows of df are skipped, their result would be empty
+        used = [i for i in range(n_shards) if (shards == i).any()]
+        shard_paths = {i: {"": _write(df[shards == i], folder / f"df_{i}.arrow")} for i in used}
+        for other, (frame, other_keys) in co_sharded.items():
+            other_shards = shard_ids(frame, other_keys, n_shards)
+            for i in used:
+                shard_paths[i][other] = _write(frame[other_shards == i], folder / f"{other}_{i}.arrow")
+
+        logger.info(f"{name}: {len(df)} rows on {len(used)} shards by {key_cols}")
+        with ProcessPoolExecutor(max_workers=min(len(used), os.cpu_count() or 1)) as pool:
+            out_paths = list(
+                pool.map(
+                    _run_shard,
+                    [func] * len(used),
+                    [shard_paths[i] for i in used],
+                    [str(folder / f"result_{i}.arrow") for i in used],
+                    [kwargs] * len(used),
+                )
+            )
+        df_result = pd.concat([_read(path) for path in out_paths], ignore_index=True)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    if keep_order:
+        df_result = df_result.sort_values(POSITION, kind="stable", ignore_index=True).drop(columns=POSITION)
+    elif sort_by:
+        df_result = df_result.sort_values(sort_by, kind="stable", ignore_index=True)
+    return df_result
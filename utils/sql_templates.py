@@ -0,0 +1,112 @@
+import datetime
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Tuple
+
+from src.utils.query_telemetry import fingerprint_sql
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PARAMETER = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+
+@lru_cache(maxsize=None)
+def _parse(text: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Splits a template into the SQL pieces around its :name parameters and the parameter names.
+    String literals of the template are left untouched.
+    """
+    pieces, names = [], []
+    piece, pos = "", 0
+    for literal in list(_STRING.finditer(text)) + [None]:
+        end = literal.start() if literal is not None else len(text)
+        last = pos
+        for match in _PARAMETER.finditer(text, pos, end):
+            pieces.append(piece + text[last : match.start()])
+            names.append(match.group(1))
+            piece, last = "", match.end()
+        piece += text[last:end]
+        if literal is not None:
+            piece += literal.group(0)
+            pos = literal.end()
+    pieces.append(piece)
+    return tuple(pieces), tuple(names)
+
+
+def render_literal(value: Any) -> str:
+    """
+    Teradata literal of a parameter value, used by connections without parameter binding.
+    """
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, datetime.datetime):
+        return f"TIMESTAMP '{value:%Y-%m-%d %H:%M:%S}'"
+    if isinstance(value, datetime.date):
+        return f"DATE '{value:%Y-%m-%d}'"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+@dataclass(frozen=True)
+class BoundQuery:
+    """
+    Query text with ? markers and the values bound to them.
+    """
+
+    template: "SqlTemplate"
+    sql: str
+    params: Tuple[Any, ...]
+
+    @property
+    def fingerprint(self) -> str:
+        return self.template.fingerprint
+
+    def render(self) -> str:
+        """
+        The query with the parameters inlined as literals.
+        """
+        pieces = self.sql.split("?")
+        return pieces[0] + "".join(render_literal(value) + piece for value, piece in zip(self.params, pieces[1:]))
+
+
+@dataclass(frozen=True)
+class SqlTemplate:
+    """
+    SQL text with :name parameters, e.g. "WHERE monat BETWEEN :since_month AND :until_month". Table names are
+    formatted into the text when the template is built, dates, months and ids are bound per call, so the text
+    Teradata parses stays the same for all chunks and its request cache can reuse the plan. A list value binds
+    one marker per element, e.g. the produkt_ids of a product.
+    """
+
+    text: str
+
+    @property
+    def fingerprint(self) -> str:
+        return fingerprint_sql(self.text)
+
+    def bind(self, **params: Any) -> BoundQuery:
+        pieces, names = _parse(self.text)
+        missing = set(names) - set(params)
+        if missing:
+            raise KeyError(f"Missing SQL parameters {sorted(missing)}")
+        sql, values = pieces[0], []
+        for name, piece in zip(names, pieces[1:]):
+            value = params[name]
+            if isinstance(value, (list, tuple)):
+                sql += ", ".join("?" for _ in value)
+                values.extend(value)
+            else:
+                sql += "?"
+                values.append(value)
+            sql += piece
+        return BoundQuery(self, sql, tuple(values))
+
+
+def bind(text: str, **params: Any) -> BoundQuery:
+    """
+    Binds the parameters of a template given as text.
+    """
+    return SqlTemplate(text).bind(**params)
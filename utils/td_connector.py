@@ -1,8 +1,14 @@
 # from ..utils.logger import global_logger
+import os
 import pyodbc
+import threading
 
 from pda.connection.teradata import Teradata
-from ..run_config import td_config
+from ..run_config import slow_query_threshold_s, td_bind_parameters, td_config, td_fetch_mode
+from .arrow_fetch import read_arrow
+from .db_backend import LIVE, backend
+from .query_telemetry import QueryTelemetry
+from .sql_templates import BoundQuery
 import logging
 
 
@@ -14,8 +20,45 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
-# Initialize Teradata connection
-td = Teradata(config_base=td_config)
+# Initialize Teradata connection, every query is recorded by the telemetry
+telemetry = QueryTelemetry(slow_query_threshold_s)
+td = backend.teradata(lambda: Teradata(config_base=td_config))
+telemetry.instrument(td)
+
+# pyodbc session of the parameterized template queries, opened on first use in every process: a session inherited
+# by a forked calc worker would share the socket of the parent
+_bound_session = None
+_bound_session_pid = None
+_bound_session_lock = threading.Lock()
+
+
+def read_query(query: BoundQuery):
+    """
+    Downloads a template query. With td_fetch_mode "arrow" the result is fetched column-wise over arrow-odbc.
+    With td_bind_parameters its values are bound to the ? markers over a pyodbc session, so every chunk sends the
+    same SQL text. Otherwise they are inlined for td.download_table_odbc.
+    Recording and replaying always use the row path.
+    """
+    global _bound_session, _bound_session_pid
+    if td_fetch_mode == "arrow" and backend.mode == LIVE:
+        return telemetry.call("read_arrow", lambda sql: read_arrow(dwh_connection_string(), sql, query.params), query.sql)
+    if not td_bind_parameters:
+        return td.download_table_odbc(query.render())
+    with _bound_session_lock:
+        if _bound_session is None or _bound_session_pid != os.getpid():
+            _bound_session, _bound_session_pid = open_dwh_session(), os.getpid()
+        session = _bound_session
+    return telemetry.read_sql(session, query.sql, params=query.params)
+
+
+def dwh_connection_string() -> str:
+    # Teradata connection parameters
+    user = 'OA1B_BI_AWB19_PRD'  # Replace with your username
+    pwd = '$tdwallet('+user+')'  # Using Teradata Wallet for secure password storage
+    host = 'TDP-N0101.deutschepost.dpwn.com'  # Teradata host
+    driver = '{/opt/teradata/client/16.20/lib64/tdataodbc_sb64.so}'  # ODBC driver for Teradata
+    return "driver=" + driver + ";dbcname=" + host + ";uid=" + user + ";pwd=" + pwd + ";charset=utf8;"
+
 
 def open_dwh_session():
     """
@@ -23,6 +66,10 @@ def open_dwh_session():
     Enhanced with logging and error handling.
     """
     logger.info("Initializing Teradata connection using pyodbc")
+    return backend.connection(_connect_dwh)
+
+
+def _connect_dwh():
     try:
         # Log pyodbc version and driver details
         logger.info(f"pyodbc version: {pyodbc.version}")
@@ -30,19 +77,10 @@ def open_dwh_session():
         pyodbc.dataSources()
         pyodbc.drivers()
 
-        # Teradata connection parameters
-        user = 'OA1B_BI_AWB19_PRD'  # Replace with your username
-        pwd = '$tdwallet('+user+')'  # Using Teradata Wallet for secure password storage
-        host = 'TDP-N0101.deutschepost.dpwn.com'  # Teradata host
-        driver = '{/opt/teradata/client/16.20/lib64/tdataodbc_sb64.so}'  # ODBC driver for Teradata
-
-        logger.info(f"Connecting to Teradata host: {host}")
+        logger.info("Connecting to Teradata host: TDP-N0101.deutschepost.dpwn.com")
 
         # Establishing the connection to Teradata
-        session = pyodbc.connect(
-            "driver=" + driver + ";dbcname=" + host + ";uid=" + user + ";pwd=" + pwd + ";charset=utf8;",
-            autocommit=True
-        )
+        session = pyodbc.connect(dwh_connection_string(), autocommit=True)
         
         # Setting the encoding and decoding for session
         session.setdecoding(pyodbc.SQL_CHAR, encoding='utf-8')
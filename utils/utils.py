@@ -1,11 +1,14 @@
 import logging
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
 import numpy as np
 import pandas as pd
 
 from src.run_config import reference_date
+from src.utils.catalog import atomic_write, catalog_for
+from src.utils.df_profile import profile_df
+from src.utils.exclusion import AbrnrExclusion
 
 def read_df(path: Union[Path, str], skiprows: int = None, header: str = "infer"):
     if ~isinstance(path, Path):
@@ -29,8 +32,12 @@ def read_df(path: Union[Path, str], skiprows: int = None, header: str = "infer")
     return df
 
 
-def save_df(path: Union[Path, str], df_to_save: pd.DataFrame):
-    df_to_save.to_parquet(path, index=False)
+def save_df(path: Union[Path, str], df_to_save: pd.DataFrame, partitioning: Optional[dict] = None):
+    """
+    Writes df atomically and records it in the catalog of its folder.
+    """
+    atomic_write(path, lambda tmp_path: df_to_save.to_parquet(tmp_path, index=False))
+    catalog_for(path).record(path, df_to_save, partitioning=partitioning)
 
 
 def read_dfs(files: Dict[str, str], logger: logging.Logger) -> Dict[str, pd.DataFrame]:
@@ -42,35 +49,53 @@ def read_dfs(files: Dict[str, str], logger: logging.Logger) -> Dict[str, pd.Data
 
 
 def normalize_code(df: pd.DataFrame, columns: dict = {"ekpnr": 10}) -> pd.DataFrame:
+    """
+    Pads the codes with zeros to their width, blank and all zero codes become " ".
+    """
     for col, width in columns.items():
-        df[col] = df[col].apply(lambda x: str(x).zfill(width) if not str(x).isspace() else " ")
-        df[col] = np.where(df[col] == ("0" * width), " ", df[col])
+        codes = df[col].astype(str)
+        # missing codes are padded as their text like before, the string dtype of pandas 3 would keep them missing
+        missing = codes.isna()
+        if missing.any():
+            codes = codes.where(~missing, df[col].map(str))
+        padded = codes.str.zfill(width)
+        df[col] = padded.where(~codes.str.isspace() & (padded != "0" * width), " ")
     return df
 
 
 def strip(df: pd.DataFrame) -> pd.DataFrame:
     for col in df.columns:
-        df[col] = df[col].astype(str).str.lstrip().str.rstrip()
+        df[col] = df[col].astype(str).str.strip()
     return df
 
 
-def exclude_abrnr(df_input: pd.DataFrame, df_abrnr: pd.DataFrame, logger: logging.Logger):
-    abrnr_set = set(df_abrnr["abrnr"].values)
-    df = df_input.loc[~df_input.abrnr.isin(abrnr_set)]
-    logger.info(f"Removed {df_input.shape[0] - df.shape[0]} entries")
-    return df
+def exclude_abrnr(
+    df_input: pd.DataFrame, df_abrnr: Union[pd.DataFrame, AbrnrExclusion], logger: logging.Logger
+) -> pd.DataFrame:
+    if not isinstance(df_abrnr, AbrnrExclusion):
+        df_abrnr = AbrnrExclusion.from_frame(df_abrnr)
+    return df_abrnr.filter(df_input, logger)
+
+
+# frames up to this number of rows get exact unique counts in log_df_string, larger ones approximate counts
+LOG_EXACT_MAX_ROWS = 1_000_000
 
 
 def log_df_string(df, columns=[], start_string="df "):
+    """
+    One line summary of df with unique counts of columns or column tuples. Above LOG_EXACT_MAX_ROWS rows the counts
+    are approximate (marked with ~), see df_profile.profile_df.
+    """
+    if len(df) > LOG_EXACT_MAX_ROWS:
+        return str(profile_df(df, keys=columns, name=start_string.strip()))
     string = f"{start_string} "
     string += f"shape {df.shape}"
     for col in columns:
         if isinstance(col, str):
             string += f" | unique '{col}': {df[col].nunique()}"
-        elif len(col) == 2:
-            string += f" | unique '{col[0]}'+'{col[1]}': {(df[col[0]] + '|' + df[col[1]]).nunique()}"
-        elif len(col) == 3:
-            string += f" | unique '{col[0]}'+'{col[1]}'+'{col[2]}': {(df[col[0]] + '|' + df[col[1]] + '|' + df[col[2]]).nunique()}"
+        else:
+            name = "+".join(f"'{c}'" for c in col)
+            string += f" | unique {name}: {len(df[list(col)].dropna().drop_duplicates())}"
     return string
 
 
@@ -83,9 +108,12 @@ def monthdelta(delta, date=reference_date):
 
 
 def cast_types(df: pd.DataFrame, column_types: dict) -> None:
-    for col in df.columns:
-        if col in column_types.keys():
-            df[col] = df[col].astype(column_types[col])
+    # columns already of their type are not copied, one astype for all others
+    column_types = {
+        col: dtype for col, dtype in column_types.items() if col in df.columns and df[col].dtype != dtype
+    }
+    if column_types:
+        df[list(column_types)] = df[list(column_types)].astype(column_types)
 
 
 def setup_identifier_column(data: pd.DataFrame, identifier_columns: List) -> None: